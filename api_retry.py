@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+API限流与重试
+全局令牌桶限制请求速率；429/529/5xx 按 retry-after 或带抖动的指数退避重试，
+限流时所有并发页面一起排队等待，而不是丢弃页面
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+import requests
+
+# 408 timeout, 429 rate limited, 529 overloaded, 5xx transient server errors
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+# Responses that mean "the whole account is over its limit", not just this request
+THROTTLE_STATUS_CODES = {429, 529}
+RATE_LIMIT_RESOURCES = ('requests', 'tokens', 'input-tokens', 'output-tokens')
+
+
+class TokenBucket:
+    """线程安全的令牌桶，每个请求消耗一个令牌
+
+    pause_for() 让所有调用 acquire() 的线程等到限流解除。
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate=50 / 60, capacity=5, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """所有OCR处理器共用的令牌桶 (默认约为每分钟50个请求)"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def pause_for(self, seconds):
+        """在接下来的 seconds 秒内不发放令牌"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class RetryScheduler:
+    """通过令牌桶发送请求，并在可重试的失败后重新发送"""
+
+    def __init__(self, bucket=None, max_attempts=6, base_delay=1.0, max_delay=60.0,
+                 sleep=time.sleep, rng=random.random):
+        self.bucket = bucket or TokenBucket.shared()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._rng = rng
+
+    def call(self, send, on_retry=None):
+        """调用 send() 直到成功或用完重试次数，返回最后一个响应
+
+        on_retry(attempt, delay, reason) 在每次等待重试前调用。
+        连接错误在最后一次尝试时重新抛出。
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self.bucket.acquire()
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay, reason = self._backoff(attempt), f"{type(e).__name__}"
+                throttled = False
+            else:
+                self._observe_rate_limits(response)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_attempts:
+                    return response
+                retry_after = self._retry_after(response)
+                if retry_after is not None:
+                    # Spread the retries of concurrent pages a little
+                    delay = retry_after + self._rng() * self.base_delay
+                else:
+                    delay = self._backoff(attempt)
+                reason = f"HTTP {response.status_code}"
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+                # Streamed responses hold their pooled connection until closed
+                response.close()
+
+            if on_retry:
+                on_retry(attempt, delay, reason)
+            if throttled:
+                # Everyone waits: the next acquire() blocks until the pause is over
+                self.bucket.pause_for(delay)
+            else:
+                self._sleep(delay)
+
+    def _backoff(self, attempt):
+        """Full jitter: uniform in [0, min(max_delay, base * 2^attempt))"""
+        return self._rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    def _retry_after(self, response):
+        value = response.headers.get('retry-after')
+        if value is not None:
+            try:
+                return min(self.max_delay, max(0.0, float(value)))
+            except ValueError:
+                pass
+        # No retry-after: fall back to the latest exhausted limit's reset time
+        resets = [
+            self._seconds_until(response.headers.get(f'anthropic-ratelimit-{name}-reset'))
+            for name in RATE_LIMIT_RESOURCES
+            if response.headers.get(f'anthropic-ratelimit-{name}-remaining') == '0'
+        ]
+        resets = [seconds for seconds in resets if seconds is not None]
+        return min(self.max_delay, max(resets)) if resets else None
+
+    def _observe_rate_limits(self, response):
+        """成功的响应里某个配额已用完时，提前暂停令牌桶直到重置"""
+        if response.status_code in RETRY_STATUS_CODES:
+            return
+        for name in RATE_LIMIT_RESOURCES:
+            if response.headers.get(f'anthropic-ratelimit-{name}-remaining') == '0':
+                seconds = self._seconds_until(response.headers.get(f'anthropic-ratelimit-{name}-reset'))
+                if seconds:
+                    self.bucket.pause_for(min(self.max_delay, seconds))
+
+    @staticmethod
+    def _seconds_until(timestamp):
+        """RFC 3339 时间 -> 距现在的秒数"""
+        if not timestamp:
+            return None
+        try:
+            reset = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if reset.tzinfo is None:
+            reset = reset.replace(tzinfo=timezone.utc)
+        return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+条码搜索基准测试
+对比原始表结构 (没有索引) 上的双向 LIKE '%..%' 查询与三元组索引搜索 (100k 商品)，
+分别放在多个小送货单和一个大送货单中，同时报告两种结构的导入耗时 (三元组表和触发器的代价)；
+并检查搜索语句的查询计划
+(没有 ANALYZE 统计时，ORDER BY name 可能让SQLite改走 idx_items_note_name 扫描整个送货单)
+
+运行: python benchmarks/bench_barcode_search.py
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+ITEMS = 100000
+ITEMS_PER_NOTE = 300
+QUERIES = 300
+# Indexes the exact/partial branches must never fall back to
+FORBIDDEN_PLANS = ('idx_items_note_name', 'SCAN items')
+
+# Schema before the barcode work: no indexes, no side tables
+BASELINE_SCHEMA = '''
+    CREATE TABLE delivery_notes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total_items INTEGER DEFAULT 0
+    );
+    CREATE TABLE items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        delivery_note_id INTEGER,
+        barcode TEXT,
+        name TEXT NOT NULL,
+        unit_price REAL,
+        quantity INTEGER,
+        status TEXT DEFAULT 'unchecked',
+        FOREIGN KEY (delivery_note_id) REFERENCES delivery_notes (id)
+    );
+'''
+
+LEGACY_SQL = '''
+    SELECT * FROM items
+    WHERE delivery_note_id = ?
+      AND barcode IS NOT NULL
+      AND barcode != ''
+      AND (
+          barcode = ?
+          OR barcode LIKE '%' || ? || '%'
+          OR ? LIKE '%' || barcode || '%'
+      )
+    ORDER BY
+        CASE WHEN barcode = ? THEN 0 ELSE 1 END,
+        name
+'''
+
+
+def _random_ean(rng):
+    prefix = rng.choice(['84', '843', '8410', '3760', '400', '690'])
+    return prefix + ''.join(rng.choice('0123456789') for _ in range(13 - len(prefix)))
+
+
+def _notes(rng, items_per_note):
+    """[(note_name, rows)] 和抽样的 (note_index, barcode)"""
+    notes = []
+    samples = []
+    for start in range(0, ITEMS, items_per_note):
+        rows = []
+        for i in range(start, min(start + items_per_note, ITEMS)):
+            barcode = _random_ean(rng)
+            rows.append((barcode, f"item {i}", 1.0, 1))
+            if rng.random() < 0.01:
+                samples.append((len(notes) + 1, barcode))
+        notes.append((f"note {len(notes)}", rows))
+    return notes, samples
+
+
+def _populate(db, notes):
+    for name, rows in notes:
+        db.add_items(db.create_delivery_note(name), rows)
+
+
+def _populate_baseline(conn, notes):
+    conn.executescript(BASELINE_SCHEMA)
+    with conn:
+        for name, rows in notes:
+            note_id = conn.execute("INSERT INTO delivery_notes (name) VALUES (?)", (name,)).lastrowid
+            conn.executemany(
+                "INSERT INTO items (delivery_note_id, barcode, name, unit_price, quantity) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(note_id, *row) for row in rows]
+            )
+
+
+def _queries(samples, rng):
+    queries = []
+    for _ in range(QUERIES):
+        note_id, barcode = rng.choice(samples)
+        kind = rng.choice(['exact', 'inner', 'truncated', 'extended'])
+        if kind == 'exact':
+            queries.append((note_id, barcode))
+        elif kind == 'inner':
+            queries.append((note_id, barcode[3:10]))
+        elif kind == 'truncated':
+            queries.append((note_id, barcode[:-2]))
+        else:
+            queries.append((note_id, '00' + barcode + '17'))
+    return queries
+
+
+def _time(func, queries):
+    start = time.perf_counter()
+    hits = 0
+    for note_id, barcode in queries:
+        hits += len(func(note_id, barcode))
+    return (time.perf_counter() - start) / len(queries) * 1e6, hits
+
+
+def _check_plans(db, conn, queries):
+    """EXPLAIN 搜索实际执行的语句，走了整个送货单的扫描时返回问题列表"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        for note_id, barcode in queries[:20]:
+            db.search_items_by_barcode(note_id, barcode)
+    finally:
+        conn.set_trace_callback(None)
+    problems = set()
+    for sql in statements:
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+            if any(bad in row[-1] for bad in FORBIDDEN_PLANS):
+                problems.add(row[-1])
+    return sorted(problems)
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(name, items_per_note, tmp):
+    rng = random.Random(42)
+    notes, samples = _notes(rng, items_per_note)
+    queries = _queries(samples, rng)
+
+    baseline = sqlite3.connect(os.path.join(tmp, f'baseline_{items_per_note}.db'))
+    baseline_import = _timed(_populate_baseline, baseline, notes)
+    db = DatabaseManager(os.path.join(tmp, f'bench_{items_per_note}.db'))
+    indexed_import = _timed(_populate, db, notes)
+
+    def legacy(note_id, barcode):
+        return baseline.execute(LEGACY_SQL, (note_id, barcode, barcode, barcode, barcode)).fetchall()
+
+    conn = db._get_connection()
+
+    def legacy_indexed(note_id, barcode):
+        # Same LIKE query, but only scanning one note through idx_items_note
+        return conn.execute(LEGACY_SQL, (note_id, barcode, barcode, barcode, barcode)).fetchall()
+
+    legacy_us, legacy_hits = _time(legacy, queries)
+    note_scan_us, note_scan_hits = _time(legacy_indexed, queries)
+    indexed_us, indexed_hits = _time(db.search_items_by_barcode, queries)
+    problems = _check_plans(db, conn, queries)
+    baseline.close()
+    db.close()
+
+    print(f"{name} ({ITEMS} 个商品, 每个送货单 {items_per_note} 个, {QUERIES} 次查询)")
+    print(f"  baseline LIKE '%..%'  {legacy_us:10.1f} µs/query  ({legacy_hits} hits)"
+          f"   import {baseline_import:6.2f}s")
+    print(f"  LIKE per-note index   {note_scan_us:10.1f} µs/query  ({note_scan_hits} hits)")
+    print(f"  trigram               {indexed_us:10.1f} µs/query  ({indexed_hits} hits)"
+          f"   import {indexed_import:6.2f}s")
+    print(f"  plan problems: {problems or 'none'}")
+    return problems
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        problems = run("多个小送货单", ITEMS_PER_NOTE, tmp)
+        problems += run("单个大送货单", ITEMS, tmp)
+    assert not problems
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+数据库连接基准测试
+对比旧的"每次调用新建连接"方式与 DatabaseManager 的长连接 (WAL) 方式
+
+运行: python benchmarks/bench_db_connections.py
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+ITEMS = 2000
+CALLS = 500
+
+
+class LegacyCalls:
+    """旧实现: 每次调用都 sqlite3.connect() + commit + close"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def add_item(self, delivery_note_id, barcode, name, unit_price, quantity):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO items (delivery_note_id, barcode, name, unit_price, quantity)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (delivery_note_id, barcode, name, unit_price, quantity))
+            conn.commit()
+            return cursor.lastrowid
+
+    def get_item_status(self, item_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status FROM items WHERE id = ?", (item_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 'unchecked'
+
+    def update_item_status(self, item_id, status):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE items SET status = ? WHERE id = ?", (status, item_id))
+            conn.commit()
+
+
+def _time_per_call(func, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def _run(label, api, note_id, item_ids):
+    results = {}
+    results['add_item'] = _time_per_call(
+        api.add_item,
+        [(note_id, f"84{i:011d}", f"bench {i}", 1.5, 2) for i in range(CALLS)],
+    )
+    results['get_item_status'] = _time_per_call(
+        api.get_item_status, [(item_ids[i % len(item_ids)],) for i in range(CALLS)]
+    )
+    results['update_item_status'] = _time_per_call(
+        api.update_item_status,
+        [(item_ids[i % len(item_ids)], 'correct') for i in range(CALLS)],
+    )
+    for name, micros in results.items():
+        print(f"  {label:<8} {name:<20} {micros:10.1f} µs/call")
+    return results
+
+
+def _populate(db_path):
+    db = DatabaseManager(db_path)
+    note_id = db.create_delivery_note("benchmark")
+    item_ids = [
+        db.add_item(note_id, f"69{i:011d}", f"item {i}", 9.9, 1)
+        for i in range(ITEMS)
+    ]
+    return db, note_id, item_ids
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        # Legacy database keeps the default rollback journal, as before
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        legacy_db, note_id, item_ids = _populate(legacy_path)
+        legacy_db.close()
+        with sqlite3.connect(legacy_path) as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+
+        db, _, _ = _populate(os.path.join(tmp, 'bench.db'))
+
+        print(f"每次调用平均延迟 ({CALLS} 次调用, {ITEMS} 个商品)")
+        before = _run("before", LegacyCalls(legacy_path), note_id, item_ids)
+        after = _run("after", db, note_id, item_ids)
+        for name in before:
+            print(f"  speedup  {name:<20} {before[name] / after[name]:10.1f}x")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+提示词缓存基准测试
+本地模拟服务器检查请求头和 system 块的 cache_control，像API一样缓存 tools + system 前缀
+(写入慢、读取快，不足 MIN_CACHEABLE_TOKENS 的前缀不缓存，写入完成前同时到达的请求各自写入)
+并在 usage 中返回缓存token数。
+比较同一份多页送货单第一次处理 (冷) 和换一个处理器再处理 (热) 的首行时间和token用量，
+分别用现在的提示词和一个加长到缓存下限以上的提示词
+
+运行: python benchmarks/bench_prompt_cache.py
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_retry import RetryScheduler, TokenBucket
+from ocr_cache import OCRCache
+import ocr_processor_direct
+from ocr_processor_direct import OCRProcessor
+
+PAGES = 6
+# The API's minimum cacheable prefix on Sonnet; shorter prefixes are neither written nor read
+MIN_CACHEABLE_TOKENS = 1024
+# Simulated time to first token: processing the whole prefix vs reading it from cache
+WRITE_DELAY = 0.4
+READ_DELAY = 0.1
+IMAGE_TOKENS = 1500
+# 1x1 white PNG
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP4DwABAQEAG7buVgAAAABJRU5ErkJggg=="
+)
+TABLE = json.dumps({"headers": ["条码", "名称"], "rows": [["8412345678901", "商品"]]},
+                   ensure_ascii=False)
+
+
+class CachingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    # prefix -> time its cache write finishes
+    prefixes = {}
+    problems = []
+    prefix_tokens = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.check(body)
+        prefix = json.dumps([body.get('tools'), body['system']], sort_keys=True, ensure_ascii=False)
+        # One token per character: generous for Chinese, so the minimum is not reached too late
+        prefix_tokens = len(prefix)
+        cacheable = prefix_tokens >= MIN_CACHEABLE_TOKENS
+        now = time.monotonic()
+        with self.lock:
+            cached = cacheable and self.prefixes.get(prefix, now + 1) <= now
+            if cacheable and not cached:
+                self.prefixes.setdefault(prefix, now + WRITE_DELAY)
+            self.prefix_tokens.append(prefix_tokens)
+        usage = {
+            "input_tokens": IMAGE_TOKENS + (0 if cacheable else prefix_tokens),
+            "cache_creation_input_tokens": prefix_tokens if cacheable and not cached else 0,
+            "cache_read_input_tokens": prefix_tokens if cached else 0,
+            "output_tokens": 1,
+        }
+        time.sleep(READ_DELAY if cached else WRITE_DELAY)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.event('message_start', {"type": "message_start", "message": {"usage": usage}})
+        if 'tools' in body:
+            delta = {"type": "input_json_delta", "partial_json": TABLE}
+        else:
+            delta = {"type": "text_delta", "text": TABLE}
+        self.event('content_block_delta', {"type": "content_block_delta", "index": 0, "delta": delta})
+        self.event('message_delta', {"type": "message_delta", "delta": {"stop_reason": "tool_use"},
+                                     "usage": {"output_tokens": 40}})
+        self.event('message_stop', {"type": "message_stop"})
+        self.wfile.write(b'0\r\n\r\n')
+
+    def check(self, body):
+        expected = {'x-api-key': 'sk-ant-stub', 'anthropic-version': '2023-06-01',
+                    'Content-Type': 'application/json'}
+        for name, value in expected.items():
+            if self.headers.get(name) != value:
+                self.problems.append(f"header {name}: {self.headers.get(name)!r}")
+        if self.headers.get('Transfer-Encoding'):
+            self.problems.append("request body sent chunked")
+        system = body.get('system') or [{}]
+        if system[-1].get('cache_control') != {"type": "ephemeral"}:
+            self.problems.append("system block without cache_control")
+        if any(block.get('type') == 'image' for block in system):
+            self.problems.append("image inside the cached prefix")
+
+    def event(self, name, data):
+        chunk = f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+        self.wfile.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def run(image_paths, cache_dir, api_url):
+    # Generous bucket: measure the cache, not the rate limiter
+    processor = OCRProcessor(
+        'sk-ant-stub',
+        cache=OCRCache(cache_dir),
+        retry=RetryScheduler(bucket=TokenBucket(rate=100, capacity=PAGES)),
+        api_url=api_url,
+    )
+    first_rows = {}
+    start = time.perf_counter()
+
+    def on_rows(page, headers, rows):
+        first_rows.setdefault(page, time.perf_counter() - start)
+
+    tables = processor.stream_delivery_note_data(image_paths, row_callback=on_rows)
+    elapsed = time.perf_counter() - start
+    processor.close()
+    assert len(tables) == len(image_paths)
+    return elapsed, first_rows, processor.usage_stats
+
+
+def scenario(image_paths, tmp, api_url, name):
+    """冷、热两次，每次用单独的OCR缓存: 每页两次都真的发到服务器"""
+    return [
+        ("冷 (新会话)", run(image_paths, os.path.join(tmp, name, 'cold'), api_url)),
+        ("热 (重复会话)", run(image_paths, os.path.join(tmp, name, 'warm'), api_url)),
+    ]
+
+
+def report(title, runs):
+    print(title)
+    print(f"{'':16}{'elapsed':>9}{'1st row':>9}{'last 1st':>9}{'cache write':>13}{'cache read':>12}")
+    for name, (elapsed, first_rows, usage) in runs:
+        print(f"{name:16}{elapsed:8.2f}s{first_rows[1]:8.2f}s{max(first_rows.values()):8.2f}s"
+              f"{usage['cache_creation_input_tokens']:13}{usage['cache_read_input_tokens']:12}")
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CachingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+    with tempfile.TemporaryDirectory() as tmp:
+        image_paths = []
+        for page in range(PAGES):
+            image_path = os.path.join(tmp, f'page{page}.png')
+            with open(image_path, 'wb') as image_file:
+                image_file.write(PNG + bytes([page]))
+            image_paths.append(image_path)
+
+        current = scenario(image_paths, tmp, api_url, 'current')
+        current_tokens = max(CachingHandler.prefix_tokens)
+        prompt = ocr_processor_direct.TOOL_PROMPT
+        ocr_processor_direct.TOOL_PROMPT = prompt + "\n" + "Check every row twice. " * 40
+        try:
+            padded = scenario(image_paths, tmp, api_url, 'padded')
+        finally:
+            ocr_processor_direct.TOOL_PROMPT = prompt
+        padded_tokens = max(CachingHandler.prefix_tokens)
+    server.shutdown()
+
+    print(f"提示词缓存 ({PAGES} 页, 写入 {WRITE_DELAY}s / 读取 {READ_DELAY}s, "
+          f"缓存下限 {MIN_CACHEABLE_TOKENS} tokens)")
+    report(f"现在的提示词 (前缀约 {current_tokens} tokens)", current)
+    report(f"加长的提示词 (前缀约 {padded_tokens} tokens)", padded)
+    print(f"  header/body problems: {CachingHandler.problems or 'none'}")
+    assert not CachingHandler.problems
+    assert current_tokens < MIN_CACHEABLE_TOKENS <= padded_tokens
+    # Below the minimum nothing is written or read, however the requests are ordered
+    for _, (_, _, usage) in current:
+        assert usage['cache_creation_input_tokens'] == usage['cache_read_input_tokens'] == 0
+    # Above it the cold run's concurrent first pages each write; the warm run only reads
+    assert padded[0][1][2]['cache_creation_input_tokens'] > 0
+    assert padded[1][1][2]['cache_creation_input_tokens'] == 0
+
+
+if __name__ == '__main__':
+    main()
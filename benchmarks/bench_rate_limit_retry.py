@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+限流重试基准测试
+本地模拟服务器按脚本返回 429 (带 retry-after) / 529，检查多页送货单的所有页面最终都被处理，
+统计请求次数和总耗时
+
+运行: python benchmarks/bench_rate_limit_retry.py
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_retry import RetryScheduler, TokenBucket
+from ocr_cache import OCRCache
+from ocr_processor_direct import OCRProcessor
+
+PAGES = 6
+# Scripted status for each incoming request, then 200 for everything after
+SCRIPT = [429, 429, 429, 200, 529, 429]
+RETRY_AFTER = "1"
+# 1x1 white PNG
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP4DwABAQEAG7buVgAAAABJRU5ErkJggg=="
+)
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    script = list(SCRIPT)
+    lock = threading.Lock()
+    requests = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.lock:
+            ScriptedHandler.requests += 1
+            status = self.script.pop(0) if self.script else 200
+        if status == 200:
+            table = {"headers": ["条码", "名称"], "rows": [["8412345678901", "商品"]]}
+            body = {"content": [{"type": "text", "text": json.dumps(table, ensure_ascii=False)}]}
+        else:
+            body = {"type": "error", "error": {"type": "rate_limit_error", "message": "scripted"}}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        if status == 429:
+            self.send_header('retry-after', RETRY_AFTER)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        image_paths = []
+        for page in range(PAGES):
+            # Trailing bytes after IEND keep every page's cache key distinct
+            image_path = os.path.join(tmp, f'page{page}.png')
+            with open(image_path, 'wb') as image_file:
+                image_file.write(PNG + bytes([page]))
+            image_paths.append(image_path)
+
+        retries = []
+        processor = OCRProcessor(
+            'sk-ant-stub',
+            cache=OCRCache(os.path.join(tmp, 'cache')),
+            retry=RetryScheduler(bucket=TokenBucket(rate=20, capacity=3), base_delay=0.2),
+            api_url=f"http://127.0.0.1:{server.server_address[1]}/v1/messages",
+        )
+
+        def progress(current, total, message):
+            if message.startswith("⏳"):
+                retries.append(message)
+
+        start = time.perf_counter()
+        tables = processor.extract_delivery_note_data(image_paths, progress)
+        elapsed = time.perf_counter() - start
+        processor.close()
+    server.shutdown()
+
+    print(f"限流重试 ({PAGES} 页, 脚本 {SCRIPT}, retry-after {RETRY_AFTER}s)")
+    print(f"  pages ok   {len(tables)}/{PAGES}")
+    print(f"  requests   {ScriptedHandler.requests}")
+    print(f"  retries    {len(retries)}")
+    print(f"  elapsed    {elapsed:.2f} s")
+    assert len(tables) == PAGES
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+行规范化基准测试
+10k 行合成送货单表格 (欧式小数逗号、千位分隔符、货币符号、无效值、短行)，
+比较逐格解析 (parse_number) 和 pandas 向量化版本 (normalize_table) 的耗时，并检查结果完全相同。
+先检查 PARSE_CASES 中逗号/点号分隔符的解析结果。
+"唯一" 每行价格都不同 (最坏情况)；"目录" 的商品来自同一供应商的 CATALOGUE 种商品，像真实的批量导入
+
+运行: python benchmarks/bench_row_normalization.py  (需要pandas)
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import column_mapping
+from column_mapping import build_items
+
+ROWS = 10000
+ROUNDS = 5
+SEED = 7
+CATALOGUE = 400
+MAPPING = {'barcode': 0, 'name': 1, 'unit_price': 2, 'quantity': 3}
+# parse_number 的分隔符规则: (单元格, 结果)
+PARSE_CASES = [
+    ("1,5", 1.5), ("12,50", 12.5), ("1,234", 1234.0), ("1,234,567", 1234567.0),
+    ("1.234,56", 1234.56), ("1,234.56", 1234.56), ("0,500", 0.5), ("-0,500", -0.5),
+    ("-1,234", -1234.0), ("1.000", 1.0), ("12,500 €", 12500.0),
+]
+
+
+def _price(rng):
+    value = rng.uniform(0.05, 5000)
+    style = rng.random()
+    if style < 0.35:
+        # 1.234,56 €
+        whole, cents = f"{value:,.2f}".split('.')
+        return f"{whole.replace(',', '.')},{cents} €"
+    if style < 0.6:
+        return f"{value:.2f}".replace('.', ',')
+    if style < 0.8:
+        return f"${value:,.2f}"
+    if style < 0.95:
+        return f"{value:.3f}"
+    return rng.choice(['', 'N/A', '-', '12,50 EUR', None])
+
+
+def _quantity(rng):
+    style = rng.random()
+    if style < 0.8:
+        return str(rng.randint(1, 48))
+    if style < 0.9:
+        return f"{rng.randint(1, 20)},5"
+    return rng.choice(['', '3 uds', '1.000', None, 6])
+
+
+def _product(rng, index):
+    return f"84{rng.randrange(10 ** 11):011d}", f"Producto {index}", _price(rng)
+
+
+def synthetic_rows(count, catalogue=None, seed=SEED):
+    rng = random.Random(seed)
+    products = [_product(rng, index) for index in range(catalogue or 0)]
+    rows = []
+    for index in range(count):
+        product = rng.choice(products) if products else _product(rng, index)
+        row = [*product, _quantity(rng)]
+        if rng.random() < 0.02:
+            row = row[:rng.randint(0, 3)]  # cut-off line at the bottom of a photo
+        elif rng.random() < 0.02:
+            row[1] = ''  # subtotal line without a name
+        rows.append(row)
+    return rows
+
+
+def _best(build, rows):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = build(rows, MAPPING)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def compare(rows):
+    """(逐格耗时, 向量化耗时, 逐格结果)，两种结果 (包括类型) 不同时断言失败"""
+    vectorized_time, vectorized = _best(build_items, rows)
+    pandas = column_mapping.pd
+    column_mapping.pd = None
+    try:
+        scalar_time, scalar = _best(build_items, rows)
+    finally:
+        column_mapping.pd = pandas
+    assert vectorized == scalar
+    assert all(type(a) is type(b) for left, right in zip(vectorized[0], scalar[0])
+               for a, b in zip(left, right))
+    return scalar_time, vectorized_time, scalar
+
+
+def check_parse_cases():
+    """逐格和向量化解析都要得到 PARSE_CASES 中的结果"""
+    problems = [(text, column_mapping.parse_number(text)) for text, expected in PARSE_CASES
+                if column_mapping.parse_number(text) != expected]
+    if column_mapping.pd is not None:
+        numbers, _ = column_mapping._parse_numbers(
+            column_mapping.pd.Series([text for text, _ in PARSE_CASES], dtype=object))
+        problems += [(text, number) for (text, expected), number in zip(PARSE_CASES, numbers)
+                     if number != expected]
+    return problems
+
+
+def main():
+    problems = check_parse_cases()
+    print(f"分隔符规则 ({len(PARSE_CASES)} 个): {problems or 'ok'}")
+    assert not problems
+    if column_mapping.pd is None:
+        print("pandas not installed: only the per-cell parser is available")
+        return
+    print(f"行规范化 ({ROWS} 行, 最好的 {ROUNDS} 次)")
+    print(f"{'':14}{'items':>7}{'invalid':>9}{'per-cell':>11}{'vectorized':>12}")
+    for name, catalogue in (("唯一", None), (f"目录 ({CATALOGUE})", CATALOGUE)):
+        scalar_time, vectorized_time, (items, invalid_rows) = compare(synthetic_rows(ROWS, catalogue))
+        print(f"{name:14}{len(items):7}{len(invalid_rows):9}{scalar_time * 1000:9.1f}ms"
+              f"{vectorized_time * 1000:9.1f}ms  ({scalar_time / vectorized_time:.1f}x)")
+    print("  results identical: yes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+行对象基准测试
+对比 SELECT * 返回的元组与 Item (__slots__) 记录的创建耗时和内存 (50k 商品)
+
+运行: python benchmarks/bench_row_objects.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager, Item
+
+ITEMS = 50000
+ROUNDS = 5
+
+
+def _measure(label, fetch):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        rows = fetch()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del rows
+
+    tracemalloc.start()
+    rows = fetch()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<14} {best * 1000:8.1f} ms  {best / len(rows) * 1e9:7.0f} ns/row"
+          f"  {current / len(rows):7.0f} B/row")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        note_id = db.create_delivery_note("benchmark")
+        db.add_items(note_id, [
+            (f"84{i:011d}", f"商品名称 {i}", 1.25 + i % 100, i % 12 + 1)
+            for i in range(ITEMS)
+        ])
+        conn = db._get_connection()
+
+        def tuples():
+            return conn.execute(
+                "SELECT * FROM items WHERE delivery_note_id = ? ORDER BY id", (note_id,)
+            ).fetchall()
+
+        def records():
+            return db.get_items_by_delivery_note(note_id)
+
+        print(f"行对象创建 ({ITEMS} 个商品, 取 {ROUNDS} 次中最快)")
+        _measure("SELECT * tuple", tuples)
+        _measure("Item record", records)
+
+        # Sanity check: the same data either way
+        assert [row[3] for row in tuples()] == [item.name for item in records()]
+        assert isinstance(records()[0], Item)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+表格解析基准测试
+用固定种子生成的模糊语料 (截断、尾随逗号、单元格内的 ] 和转义引号、换行、前后说明文字等)
+对比旧的 正则 + 清理 + 修复 解析方式与单遍容错解析器的速度和正确恢复的行数。
+被截断的响应旧代码找不到 "}" 就直接放弃，所以那一类旧代码更快，但一行也没有恢复
+先检查 EDGE_CASES 中的特殊输入 (前导零的条码、".5"、"1e"、错误的 rows 容器) 不会让解析器出错
+
+运行: python benchmarks/bench_table_parser.py
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from table_parser import IncrementalTableParser, parse_table
+
+SEED = 7
+CASES_PER_KIND = 200
+LARGE_ROWS = 2000
+HEADERS = ["条码", "商品名称", "单价", "数量"]
+NAME_PARTS = ["苹果", "Leche", "Aceite [1L]", 'Tornillo 3/4"', "纸巾, 大包", "caja (12)", "米"]
+# (响应, 应得到的行): unquoted numbers the model sometimes writes, and a broken "rows" container
+EDGE_CASES = [
+    ('{"headers":["a"],"rows":[[0841234567890]]}', [["0841234567890"]]),
+    ('{"headers":["a"],"rows":[[00]]}', [["00"]]),
+    ('{"headers":["a","b"],"rows":[[.5, 1e], [-0.5, 12.5e3]]}', [[".5", "1e"], [-0.5, 12500.0]]),
+    ('{"headers":["a"],"rows"{ [["x"]]}', [[["x"]]]),
+]
+
+
+class LegacyParser:
+    """旧实现: ocr_processor_direct 中的 _parse_response / _clean_json / _salvage_data"""
+
+    def parse(self, response_text):
+        try:
+            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+            if json_match:
+                json_text = self._clean_json(json_match.group())
+                try:
+                    json_data = json.loads(json_text)
+                    if 'headers' in json_data and 'rows' in json_data:
+                        return json_data
+                except json.JSONDecodeError:
+                    salvaged_data = self._salvage_data(response_text)
+                    if salvaged_data:
+                        return salvaged_data
+            return None
+        except Exception:
+            return None
+
+    def _clean_json(self, json_text):
+        json_text = re.sub(r',(\s*[}\]])', r'\1', json_text)
+        json_text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', json_text)
+        return json_text
+
+    def _salvage_data(self, response_text):
+        try:
+            headers_match = re.search(r'"headers":\s*\[(.*?)\]', response_text, re.DOTALL)
+            rows_match = re.search(r'"rows":\s*\[(.*?)\]\s*\}', response_text, re.DOTALL)
+            if headers_match and rows_match:
+                headers = re.findall(r'"([^"]*)"', headers_match.group(1))
+                rows = []
+                for row_match in re.findall(r'\[(.*?)\]', rows_match.group(1)):
+                    values = re.findall(r'"([^"]*)"', row_match)
+                    if values:
+                        rows.append(values)
+                if headers and rows:
+                    return {"headers": headers, "rows": rows}
+        except Exception:
+            pass
+        return None
+
+
+def _random_row(rng, multiline=False):
+    name = " ".join(rng.sample(NAME_PARTS, rng.randint(1, 2)))
+    if multiline and rng.random() < 0.5:
+        name += "\n第二行"
+    return [
+        f"84{rng.randint(0, 10 ** 11 - 1):011d}",
+        name,
+        f"{rng.randint(1, 9999) / 100:.2f}",
+        str(rng.randint(1, 48)),
+    ]
+
+
+def _serialize(rows, trailing_commas=False, raw_newlines=False):
+    """返回 (文本, 每行最后一个单元格结束的位置)"""
+    parts = ['{\n  "headers": ', json.dumps(HEADERS, ensure_ascii=False), ',\n  "rows": [\n']
+    offset = sum(len(part) for part in parts)
+    ends = []
+    for index, row in enumerate(rows):
+        cell = json.dumps(row, ensure_ascii=False)
+        if raw_newlines:
+            cell = cell.replace("\\n", "\n")
+        separator = ",\n" if index < len(rows) - 1 or trailing_commas else "\n"
+        parts.append("    " + cell + separator)
+        offset += 4 + len(cell)
+        # Cut right before "]" still leaves every cell of the row
+        ends.append(offset - 1)
+        offset += len(separator)
+    parts.append("  ]\n}")
+    return "".join(parts), ends
+
+
+def build_corpus(rng):
+    """(类型, 文本, 应恢复的行)"""
+    corpus = []
+    for _ in range(CASES_PER_KIND):
+        rows = [_random_row(rng) for _ in range(rng.randint(3, 40))]
+        text, ends = _serialize(rows)
+        corpus.append(("clean", text, rows))
+        corpus.append(("prose+fence", f"以下是提取的数据：\n```json\n{text}\n```\n如有疑问请告知。", rows))
+        corpus.append(("trailing-comma", _serialize(rows, trailing_commas=True)[0], rows))
+        cut = rng.randint(ends[0], len(text) - 1)
+        corpus.append(("truncated", text[:cut], [row for row, end in zip(rows, ends) if end <= cut]))
+
+        multiline_rows = [_random_row(rng, multiline=True) for _ in range(rng.randint(3, 40))]
+        corpus.append(("raw-newline", _serialize(multiline_rows, raw_newlines=True)[0], multiline_rows))
+    return corpus
+
+
+def _score(parser, corpus):
+    """{类型: [正确的行, 应恢复的行, 错误的行, 耗时]}"""
+    kinds = {}
+    for kind, text, expected in corpus:
+        start = time.perf_counter()
+        table = parser(text)
+        elapsed = time.perf_counter() - start
+        got = [[str(cell) for cell in row] for row in table["rows"]] if table else []
+        correct = sum(1 for row in got if row in expected)
+        totals = kinds.setdefault(kind, [0, 0, 0, 0.0])
+        totals[0] += correct
+        totals[1] += len(expected)
+        totals[2] += len(got) - correct
+        totals[3] += elapsed
+    return kinds
+
+
+def _correct_rows(table, expected):
+    rows = [[str(cell) for cell in row] for row in table["rows"]] if table else []
+    return sum(1 for row, truth in zip(rows, expected) if row == truth)
+
+
+def _time_large(parser, text):
+    start = time.perf_counter()
+    for _ in range(5):
+        parser(text)
+    return (time.perf_counter() - start) / 5
+
+
+def check_edge_cases():
+    """每个特殊输入一次性解析和逐字符 feed() 都不能出错，结果都要等于预期"""
+    problems = []
+    for text, expected in EDGE_CASES:
+        parser = IncrementalTableParser()
+        for char in text:
+            parser.feed(char)
+        for table in (parse_table(text), parser.finish()):
+            if table is None or table["rows"] != expected:
+                problems.append((text, table))
+    return problems
+
+
+def main():
+    problems = check_edge_cases()
+    print(f"特殊输入 ({len(EDGE_CASES)} 个): {problems or 'ok'}")
+    assert not problems
+
+    rng = random.Random(SEED)
+    corpus = build_corpus(rng)
+    legacy = LegacyParser().parse
+
+    print(f"模糊语料 ({len(corpus)} 个响应, 种子 {SEED}): 正确恢复的行 / 应恢复的行 (错误的行)")
+    legacy_kinds = _score(legacy, corpus)
+    new_kinds = _score(parse_table, corpus)
+    for kind in legacy_kinds:
+        before, after = legacy_kinds[kind], new_kinds[kind]
+        print(f"  {kind:<15} legacy {before[0]:6}/{before[1]:<6} ({before[2]:4}) {before[3] * 1000:6.1f} ms"
+              f"   single-pass {after[0]:6}/{after[1]:<6} ({after[2]:4}) {after[3] * 1000:6.1f} ms")
+    legacy_time = sum(totals[3] for totals in legacy_kinds.values())
+    new_time = sum(totals[3] for totals in new_kinds.values())
+    print(f"  总耗时        legacy {legacy_time * 1000:8.1f} ms   single-pass {new_time * 1000:8.1f} ms")
+
+    large_rows = [_random_row(rng) for _ in range(LARGE_ROWS)]
+    large_text = _serialize(large_rows)[0]
+    # One bad escape forces the legacy path into its regex salvage
+    broken_text = large_text.replace('"Leche', '"Le\\che', 1)
+    print(f"大表 ({LARGE_ROWS} 行, {len(large_text) // 1024} KB)")
+    for label, text in (("valid", large_text), ("bad escape", broken_text)):
+        before, after = _time_large(legacy, text), _time_large(parse_table, text)
+        before_rows = _correct_rows(legacy(text), large_rows)
+        after_rows = _correct_rows(parse_table(text), large_rows)
+        print(f"  {label:<11} legacy {before * 1000:8.1f} ms ({before_rows} 行正确)"
+              f"   single-pass {after * 1000:8.1f} ms ({after_rows} 行正确)")
+
+
+if __name__ == '__main__':
+    main()
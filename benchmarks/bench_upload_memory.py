@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+上传内存基准测试
+对比旧的"整图读入 + base64 + JSON序列化"方式与 StreamingJSONBody 的峰值内存 (合成的 24 MB 图像)
+
+运行: python benchmarks/bench_upload_memory.py
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming_body import IMAGE_PLACEHOLDER, StreamingJSONBody
+
+IMAGE_BYTES = 24 * 1024 * 1024
+
+
+def _payload(data):
+    return {
+        "model": "claude-sonnet-4-6",
+        "max_tokens": 3000,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "image",
+                 "source": {"type": "base64", "media_type": "image/jpeg", "data": data}},
+                {"type": "text", "text": "extract the table"},
+            ],
+        }],
+    }
+
+
+def legacy(image_path):
+    # Same copies as the old encode_image_to_base64 + requests.post(json=...)
+    with open(image_path, "rb") as image_file:
+        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+    body = json.dumps(_payload(base64_image)).encode('utf-8')
+    return len(body)
+
+
+def streaming(image_path):
+    # Iterating is what the HTTP adapter does while writing to the socket.
+    # The mmap'd file pages are page cache, not heap, so tracemalloc rightly skips them.
+    sent = 0
+    for chunk in StreamingJSONBody(_payload(IMAGE_PLACEHOLDER), image_path):
+        sent += len(chunk)
+    return sent
+
+
+def _measure(label, func, image_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    sent = func(image_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<10} peak {peak / 1024 / 1024:8.1f} MB  "
+          f"{elapsed * 1000:8.1f} ms  body {sent / 1024 / 1024:.1f} MB")
+    return sent
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        # Random data behind a JPEG SOI marker: incompressible, like a camera photo
+        image_path = os.path.join(tmp, 'synthetic.jpg')
+        with open(image_path, 'wb') as image_file:
+            image_file.write(b'\xff\xd8\xff\xe0' + os.urandom(IMAGE_BYTES - 4))
+
+        print(f"单张图像上传的峰值内存 ({IMAGE_BYTES // 1024 // 1024} MB 图像, tracemalloc)")
+        before = _measure("legacy", legacy, image_path)
+        after = _measure("streaming", streaming, image_path)
+        # Same body length either way
+        assert before == after
+
+
+if __name__ == '__main__':
+    main()
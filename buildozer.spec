@@ -15,6 +15,9 @@ source.dir = .
 # (list) Source files to include (let empty to include all the files)
 source.include_exts = py,png,jpg,kv,atlas,txt,json
 
+# (list) List of directory to exclude (let empty to not exclude anything)
+source.exclude_dirs = benchmarks
+
 # (str) Application versioning (method 1)
 version = 1.0
 
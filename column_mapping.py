@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+列映射
+表头 -> 商品字段 (条码/名称/单价/数量) 的自动识别、按表头签名保存的映射方案，
+以及按映射把表格行转换为商品
+"""
+
+import hashlib
+import re
+try:
+    import numpy as np
+    import pandas as pd
+except Exception:
+    # Not packaged for Android: there every import uses the per-cell parser
+    np = None
+    pd = None
+from table_merge import normalize_cell
+
+FIELDS = ('barcode', 'name', 'unit_price', 'quantity')
+
+# Matched against normalize_cell(header): no accents, no case, no spaces or punctuation.
+# Checked in FIELDS order, so "codigo articulo" is a barcode column, not a name column.
+_FIELD_KEYWORDS = {
+    'barcode': ['codigo', 'cod', 'code', 'barcode', 'ean', 'upc', 'gtin', 'sku', 'referencia', 'ref',
+                '条码', '条形码', '编码', '货号'],
+    'name': ['nombre', 'name', 'product', 'producto', 'descripcion', 'description', 'designacion',
+             'denominacion', 'concepto', 'articulo', 'article', 'produit', 'libelle', 'bezeichnung',
+             'artikel', '产品', '商品', '品名', '名称', '描述'],
+    'unit_price': ['precio', 'price', 'cost', 'coste', 'pvp', 'prix', 'preco', 'preis', 'tarifa',
+                   '价格', '单价'],
+    'quantity': ['cantidad', 'cant', 'quantity', 'qty', 'uds', 'unidades', 'units', 'quantite',
+                 'quantidade', 'menge', 'pcs', '数量', '件数'],
+}
+_FIELD_PATTERNS = [
+    (field, re.compile('|'.join(sorted(map(re.escape, keywords), key=len, reverse=True))))
+    for field, keywords in _FIELD_KEYWORDS.items()
+]
+
+# Column used when a field has no mapped header (the order the prompt usually produces)
+DEFAULT_COLUMNS = {'barcode': 0, 'name': 1, 'unit_price': 2, 'quantity': 3}
+# Placeholder for rows without a name; such rows are not imported
+UNKNOWN_NAME = '未知商品'
+# Below this many rows building a DataFrame costs more than the per-cell loop saves.
+# Above it the vectorized path only pays off when cell texts repeat (a supplier catalogue).
+VECTORIZE_MIN_ROWS = 500
+
+
+def guess_field(header):
+    """按关键词猜测表头对应的字段，无法识别时返回None"""
+    text = normalize_cell(header)
+    for field, pattern in _FIELD_PATTERNS:
+        if pattern.search(text):
+            return field
+    return None
+
+
+def guess_mapping(headers):
+    """{field: 列号}，每个字段取第一个匹配的表头"""
+    mapping = {}
+    for column, header in enumerate(headers):
+        field = guess_field(header)
+        if field is not None and field not in mapping:
+            mapping[field] = column
+    return mapping
+
+
+def header_signature(headers):
+    """表头列表的签名 (大小写、重音、空格和标点不同的同一格式签名相同)"""
+    key = '\x1f'.join(normalize_cell(header) for header in headers)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Currency symbols/codes and whitespace (incl. no-break spaces) around or inside amounts
+_CURRENCY_NOISE = re.compile(r'[€$¥£￥\s\u00a0\u202f]|EUR|USD|RMB|CNY', re.IGNORECASE)
+# What is left must be a plain decimal number (no exponents, "inf" or "nan")
+_NUMBER = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)')
+
+
+def parse_number(value):
+    """把单元格解析为数字，空单元格返回None，无法识别时抛出ValueError
+
+    "1.234,56" / "1,234.56": 最后出现的分隔符是小数点，另一个是千位分隔符。
+    只有一种分隔符时: 出现多次是千位分隔符；出现一次是小数点 ("1,5" = 1.5)，
+    但逗号后正好三位数字时是千位分隔符 ("1,234" = 1234，和以前去掉所有逗号的结果一样)，
+    整数部分为0时除外 ("0,500" = 0.5)。
+    """
+    if value is None or value != value:
+        return None
+    text = _CURRENCY_NOISE.sub('', str(value))
+    if not text:
+        return None
+    last_comma = text.rfind(',')
+    last_dot = text.rfind('.')
+    if last_comma >= 0 and last_dot >= 0:
+        thousands, decimal = ('.', ',') if last_comma > last_dot else (',', '.')
+        text = text.replace(thousands, '').replace(decimal, '.')
+    elif last_comma >= 0:
+        # "0,500" / "-0,500": a thousands group never follows a zero integer part
+        zero_integer = not text[:last_comma].lstrip('+-').strip('0')
+        lone_decimal = text.count(',') == 1 and (len(text) - last_comma - 1 != 3 or zero_integer)
+        text = text.replace(',', '.') if lone_decimal else text.replace(',', '')
+    elif last_dot >= 0 and text.count('.') > 1:
+        text = text.replace('.', '')
+    if not _NUMBER.fullmatch(text):
+        raise ValueError(f"not a number: {value!r}")
+    return float(text)
+
+
+def parse_price(price):
+    """解析价格 (空或无法识别时为0.0)"""
+    try:
+        number = parse_number(price)
+    except ValueError:
+        return 0.0
+    return 0.0 if number is None else number
+
+
+def parse_quantity(quantity):
+    """解析数量 (取整；空或无法识别时为1)"""
+    try:
+        number = parse_number(quantity)
+    except ValueError:
+        return 1
+    return 1 if number is None else int(number)
+
+
+def build_items(rows, mapping):
+    """按 {field: 列号} 把表格行转换为 (barcode, name, unit_price, quantity) 元组
+
+    未映射的字段使用 DEFAULT_COLUMNS 中的列；没有名称的行被跳过。
+    Returns:
+        (items, invalid_rows) — invalid_rows 是价格或数量无法识别的行号 (按默认值导入)
+    """
+    if pd is not None and len(rows) >= VECTORIZE_MIN_ROWS:
+        frame = normalize_table(rows, mapping)
+        items = list(zip(frame['barcode'].tolist(), frame['name'].tolist(),
+                         frame['unit_price'].tolist(), frame['quantity'].tolist()))
+        return items, frame.index[frame['invalid']].tolist()
+
+    columns = {field: mapping.get(field, DEFAULT_COLUMNS[field]) for field in FIELDS}
+    items = []
+    invalid_rows = []
+    for index, row in enumerate(rows):
+        if len(row) > 0:
+            def cell(field, default):
+                column = columns[field]
+                return row[column] if column < len(row) else default
+
+            name = cell('name', UNKNOWN_NAME)
+            # Only add items with valid names
+            if name and name != UNKNOWN_NAME:
+                price, price_ok = _parse_cell(cell('unit_price', 0), 0.0)
+                quantity, quantity_ok = _parse_cell(cell('quantity', 1), 1)
+                items.append((cell('barcode', ''), name, price, int(quantity)))
+                if not (price_ok and quantity_ok):
+                    invalid_rows.append(index)
+    return items, invalid_rows
+
+
+def _parse_cell(value, default):
+    """(数字或default, 是否可识别)"""
+    try:
+        number = parse_number(value)
+    except ValueError:
+        return default, False
+    return (default if number is None else number), True
+
+
+def normalize_table(rows, mapping):
+    """build_items 的向量化版本 (需要pandas)，结果与逐格解析相同
+
+    只有单元格文本大量重复 (同一供应商的目录) 时更快；每行都不同的表格和逐格解析一样快或更慢。
+    Android 上没有pandas，这条路径只在桌面版运行。
+    Returns:
+        以原始行号为索引的DataFrame: barcode, name, unit_price (float), quantity (int), invalid (bool)；
+        没有名称的行已去掉
+    """
+    frame = pd.DataFrame(rows, dtype=object)
+    lengths = pd.Series([len(row) for row in rows], dtype='int64')
+    columns = {field: mapping.get(field, DEFAULT_COLUMNS[field]) for field in FIELDS}
+
+    def column(field, default):
+        # Short rows behave like the scalar path: the default, not the None DataFrame pads with
+        index = columns[field]
+        if index >= frame.shape[1]:
+            return pd.Series(default, index=frame.index, dtype=object)
+        return frame[index].where(lengths > index, default)
+
+    name = column('name', UNKNOWN_NAME)
+    keep = (lengths > 0) & name.astype(bool) & (name != UNKNOWN_NAME)
+    price, price_ok = _parse_numbers(column('unit_price', 0)[keep])
+    quantity, quantity_ok = _parse_numbers(column('quantity', 1)[keep])
+    return pd.DataFrame({
+        'barcode': column('barcode', '')[keep],
+        'name': name[keep],
+        'unit_price': price.fillna(0.0),
+        # int() truncates toward zero, like np.trunc
+        'quantity': np.trunc(quantity).fillna(1).astype('int64'),
+        'invalid': ~(price_ok & quantity_ok),
+    })
+
+
+def _parse_numbers(series):
+    """parse_number 的向量化版本: 返回 (float Series，空或无法识别为NaN; 是否可识别)
+
+    每个不同的单元格文本只解析一次，再按 factorize 的编码映射回所有行。
+    """
+    missing = series.isna()
+    # parse_number works on str(value) anyway: 6 and "6" share one parse
+    codes, uniques = pd.factorize(series[~missing].astype(str))
+    parsed = np.full(len(uniques), np.nan)
+    parsed_ok = np.zeros(len(uniques), dtype=bool)
+    for position, text in enumerate(uniques.tolist()):
+        try:
+            number = parse_number(text)
+        except ValueError:
+            continue
+        parsed_ok[position] = True
+        if number is not None:
+            parsed[position] = number
+    numbers = pd.Series(np.nan, index=series.index)
+    numbers[~missing] = parsed[codes]
+    valid = missing.copy()
+    valid[~missing] = parsed_ok[codes]
+    return numbers, valid
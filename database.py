@@ -1,9 +1,343 @@
 # -*- coding: utf-8 -*-
+import base64
+import bisect
+import json
+import re
 import sqlite3
+import threading
+import zlib
 from datetime import datetime
 import os
 
+# Separators and whitespace that OCR or manual entry leave inside barcodes
+_BARCODE_NOISE = re.compile(r'[\s\-_.,;:*/\\]+')
+# Letters that OCR commonly reads instead of digits
+_OCR_DIGIT_FIXES = str.maketrans({'O': '0', 'o': '0', 'I': '1', 'l': '1', '|': '1'})
+
+
+def barcode_search_key(barcode):
+    """条码的紧凑形式，用于部分匹配
+
+    去除空白和分隔符并转为大写；数字码中的 O/I/l 视为 0/1。
+    不补零，保留用户实际看到的数字序列。
+    """
+    if barcode is None:
+        return ''
+    code = _BARCODE_NOISE.sub('', str(barcode))
+    if not code:
+        return ''
+
+    # Only treat O/I/l as digits when the code is otherwise numeric
+    fixed = code.translate(_OCR_DIGIT_FIXES)
+    if fixed.isdigit() and sum(not c.isdigit() for c in code) <= 2:
+        return fixed
+    return code.upper()
+
+
+def normalize_barcode(barcode):
+    """将条码转换为规范形式，用于精确匹配
+
+    在 barcode_search_key 的基础上，纯数字的 GTIN-8/UPC-A/EAN-13/GTIN-14
+    统一补零为14位，使带或不带前导零的同一商品码相等。
+    """
+    code = barcode_search_key(barcode)
+    if code.isdigit() and 8 <= len(code) <= 14:
+        return code.zfill(14)
+    return code
+
+
+class Item:
+    """商品记录
+
+    紧凑的 __slots__ 对象，只包含界面和导出用到的列，
+    由 DatabaseManager 的 row_factory 直接从查询结果创建。
+    """
+    __slots__ = ('id', 'delivery_note_id', 'barcode', 'name', 'unit_price', 'quantity', 'status')
+    # Column list for SELECT, in constructor order
+    COLUMNS = ', '.join(__slots__)
+
+    def __init__(self, id, delivery_note_id, barcode, name, unit_price, quantity, status):
+        self.id = id
+        self.delivery_note_id = delivery_note_id
+        self.barcode = barcode
+        self.name = name
+        self.unit_price = unit_price
+        self.quantity = quantity
+        self.status = status
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """sqlite3 row_factory"""
+        return cls(*row)
+
+    def __repr__(self):
+        return f"Item(id={self.id}, barcode={self.barcode!r}, name={self.name!r}, status={self.status!r})"
+
+
+class DeliveryNote:
+    """送货单记录，计数列由触发器维护"""
+    __slots__ = ('id', 'name', 'date_created', 'total_items',
+                 'checked_correct', 'checked_incorrect', 'unchecked')
+    COLUMNS = ', '.join(__slots__)
+
+    def __init__(self, id, name, date_created, total_items,
+                 checked_correct, checked_incorrect, unchecked):
+        self.id = id
+        self.name = name
+        self.date_created = date_created
+        self.total_items = total_items
+        self.checked_correct = checked_correct
+        self.checked_incorrect = checked_incorrect
+        self.unchecked = unchecked
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """sqlite3 row_factory"""
+        return cls(*row)
+
+    def __repr__(self):
+        return f"DeliveryNote(id={self.id}, name={self.name!r}, total_items={self.total_items})"
+
+
+class OCRJob:
+    """OCR队列中的一张图像 (一批 = 一次拍照/选图)"""
+    __slots__ = ('id', 'batch_id', 'delivery_note_id', 'page', 'image_path',
+                 'state', 'attempts', 'error')
+    COLUMNS = ', '.join(__slots__)
+
+    def __init__(self, id, batch_id, delivery_note_id, page, image_path, state, attempts, error):
+        self.id = id
+        self.batch_id = batch_id
+        self.delivery_note_id = delivery_note_id
+        self.page = page
+        self.image_path = image_path
+        self.state = state
+        self.attempts = attempts
+        self.error = error
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """sqlite3 row_factory"""
+        return cls(*row)
+
+    def __repr__(self):
+        return f"OCRJob(id={self.id}, batch_id={self.batch_id}, page={self.page}, state={self.state!r})"
+
+
+class BarcodeIndex:
+    """单个送货单的内存条码索引
+
+    精确匹配: barcode_norm -> 商品ID 的字典；
+    部分匹配: 所有 barcode_key 后缀的有序列表 (已存条码包含扫描码)
+    以及 barcode_key -> 商品ID 的字典 (扫描码包含已存条码)。
+    结果顺序与 DatabaseManager 的SQL搜索一致: 精确匹配在前，各自按名称排序。
+    """
+
+    def __init__(self, delivery_note_id, entries):
+        """
+        Args:
+            delivery_note_id: 送货单ID
+            entries: 该送货单商品的 (Item, barcode_norm, barcode_key) 列表
+        """
+        self.delivery_note_id = delivery_note_id
+        self.stale = False
+
+        self.items = {}
+        self._norm_of = {}
+        self._by_norm = {}
+        self._by_key = {}
+        suffixes = []
+        for item, norm, key in entries:
+            self.items[item.id] = item
+            self._norm_of[item.id] = norm
+            if norm:
+                self._by_norm.setdefault(norm, []).append(item.id)
+            if key:
+                self._by_key.setdefault(key, []).append(item.id)
+                suffixes.extend((key[start:], item.id) for start in range(len(key)))
+        self._suffixes = sorted(suffixes)
+
+    def search(self, barcode_norm, barcode_key):
+        """返回匹配的商品，精确匹配在前"""
+        exact_ids = set(self._by_norm.get(barcode_norm, ()))
+
+        partial_ids = set()
+        # Stored code contains the scanned code: suffixes starting with it
+        position = bisect.bisect_left(self._suffixes, (barcode_key,))
+        while position < len(self._suffixes) and self._suffixes[position][0].startswith(barcode_key):
+            partial_ids.add(self._suffixes[position][1])
+            position += 1
+        # Scanned code contains the stored code
+        length = len(barcode_key)
+        for start in range(length):
+            for end in range(start + 1, length + 1):
+                partial_ids.update(self._by_key.get(barcode_key[start:end], ()))
+        partial_ids = {
+            item_id for item_id in partial_ids if self._norm_of[item_id] != barcode_norm
+        }
+        return self._sorted_items(exact_ids) + self._sorted_items(partial_ids)
+
+    def update_status(self, item_id, status):
+        """Patch the cached item after a status change"""
+        item = self.items.get(item_id)
+        if item is not None:
+            item.status = status
+
+    def _sorted_items(self, item_ids):
+        items = sorted((self.items[item_id] for item_id in item_ids), key=lambda item: item.id)
+        return sorted(items, key=lambda item: item.name)
+
+
+class WriteBehindQueue:
+    """商品状态/条码的后台写入队列
+
+    UI线程只把修改放入内存队列并立即返回；一个写线程批量提交。
+    同一商品同一字段的多次修改 (快速连续切换状态) 合并为最后一次。
+    """
+    # Seconds the writer waits after a mutation so rapid toggles coalesce
+    COALESCE_DELAY = 0.05
+    # Mutations committed per transaction
+    BATCH_SIZE = 100
+    # Seconds before retrying a batch that failed to commit
+    RETRY_DELAY = 1.0
+
+    def __init__(self, apply_batch):
+        """
+        Args:
+            apply_batch: 在写线程中调用 apply_batch([(item_id, field, value), ...])，
+                         在单个事务中提交这些修改
+        """
+        self._apply_batch = apply_batch
+        # (item_id, field) -> value, in mutation order
+        self._pending = {}
+        self._in_flight = {}
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self.last_error = None
+        # True from a failed commit until a batch commits again
+        self.failing = False
+
+    def put(self, item_id, field, value):
+        """排队一个修改 (立即返回)"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            key = (item_id, field)
+            # Re-insert so a coalesced mutation keeps its latest position
+            self._pending.pop(key, None)
+            self._pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='db-write-behind', daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def pending_value(self, item_id, field, default=None):
+        """返回尚未提交的值 (包括正在提交的批次)"""
+        key = (item_id, field)
+        with self._cond:
+            if key in self._pending:
+                return self._pending[key]
+            return self._in_flight.get(key, default)
+
+    def has_pending(self):
+        with self._cond:
+            return bool(self._pending or self._in_flight)
+
+    def flush(self, timeout=None, stop_on_failure=False):
+        """等待所有已排队的修改提交完成
+
+        Args:
+            stop_on_failure: 提交失败 (写线程将重试) 时立即返回，不等到超时
+        Returns:
+            True 表示全部已提交，False 表示超时或提交失败
+        """
+        if threading.current_thread() is self._thread:
+            return not self._pending
+        with self._cond:
+            if not (self._pending or self._in_flight):
+                return True
+            if stop_on_failure and self.failing:
+                return False
+            self._flush_requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(
+                lambda: not (self._pending or self._in_flight)
+                or (stop_on_failure and self.failing),
+                timeout
+            )
+            return not (self._pending or self._in_flight)
+
+    def close(self, timeout=None):
+        """提交剩余修改并停止写线程"""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return flushed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                if not self._flush_requested:
+                    # Give rapid repeated toggles a moment to coalesce
+                    self._cond.wait(self.COALESCE_DELAY)
+                keys = list(self._pending)[:self.BATCH_SIZE]
+                self._in_flight = {key: self._pending.pop(key) for key in keys}
+                batch = [(item_id, field, value)
+                         for (item_id, field), value in self._in_flight.items()]
+
+            failed = False
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                print(f"Write-behind commit failed, retrying: {e}")
+                self.last_error = e
+                failed = True
+
+            with self._cond:
+                self.failing = failed
+                if failed:
+                    # Requeue unless a newer value arrived meanwhile
+                    for key, value in self._in_flight.items():
+                        self._pending.setdefault(key, value)
+                self._in_flight = {}
+                if not self._pending:
+                    self._flush_requested = False
+                self._cond.notify_all()
+                if failed:
+                    self._cond.wait(self.RETRY_DELAY)
+
+
 class DatabaseManager:
+    # sqlite3 caches prepared statements per connection, keyed by SQL text
+    STATEMENT_CACHE_SIZE = 128
+    # Seconds a writer waits for a lock held by another thread before failing
+    BUSY_TIMEOUT = 10.0
+    # Seconds a read waits for queued writes to commit (reads run on the Kivy thread)
+    READ_FLUSH_TIMEOUT = 2.0
+    # Stored in PRAGMA user_version; bump when _migrate gains a step
+    SCHEMA_VERSION = 4
+    # Barcode keys are indexed as trigrams starting at positions 1..N
+    MAX_GRAM_OFFSET = 128
+    # Above this many substrings, "scanned code contains stored code" scans the note
+    MAX_CONTAINED_SUBSTRINGS = 900
+    # Notes archived per transaction by archive_delivery_notes
+    ARCHIVE_BATCH_SIZE = 20
+    # Orderings accepted by get_items_page -> sort column (ties broken by id)
+    ITEM_ORDERINGS = {
+        'id': None,
+        'name': 'name',
+        'status': 'status',
+        'barcode': 'barcode_key',
+    }
+
     def __init__(self, db_path=None):
         if db_path is None:
             try:
@@ -16,12 +350,90 @@ class DatabaseManager:
             except Exception:
                 db_path = 'inventory.db'
         self.db_path = db_path
+        # Cold storage for completed/old notes, attached to every connection as "archive"
+        self.archive_path = os.path.join(os.path.dirname(db_path), 'archive.db')
+        # One long-lived connection per thread (UI thread, OCR import thread...)
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self.write_queue = WriteBehindQueue(self._apply_item_mutations)
+        # In-memory barcode index of the delivery note being received
+        self._barcode_index = None
+        self._barcode_index_lock = threading.Lock()
+        self.barcode_index_stats = {'hits': 0, 'misses': 0}
         self.init_database()
+
+    def _get_connection(self):
+        """获取当前线程的长连接 (首次调用时创建)
+
+        WAL模式允许一个线程写入的同时其他线程继续读取，
+        synchronous=NORMAL 在WAL下只在检查点时fsync。
+        """
+        thread_id = threading.get_ident()
+        conn = self._connections.get(thread_id)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.BUSY_TIMEOUT,
+                cached_statements=self.STATEMENT_CACHE_SIZE,
+                # close() may run on a different thread than the owner
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            conn.execute("PRAGMA archive.journal_mode=WAL")
+            conn.execute("PRAGMA archive.synchronous=NORMAL")
+            with self._connections_lock:
+                self._connections[thread_id] = conn
+        return conn
+
+    def flush(self, timeout=None):
+        """等待后台写入队列中的修改全部提交
+
+        timeout=None 时一直等待；读取方法用 _flush_for_read 有上限地等待。
+        """
+        return self.write_queue.flush(timeout)
+    
+    def _flush_for_read(self):
+        """读取前等待排队的修改提交，最多 READ_FLUSH_TIMEOUT 秒
+
+        提交失败 (磁盘已满、锁被长时间占用) 时不再等待:
+        记录错误并读取已提交的数据，未提交的修改留在队列中继续重试。
+        """
+        if not self.write_queue.flush(self.READ_FLUSH_TIMEOUT, stop_on_failure=True):
+            print(f"Reading before queued writes committed: {self.write_queue.last_error}")
+    
+    def _flush_for_write(self):
+        """写入前提交排队的修改，无法提交时抛出 sqlite3.OperationalError 而不是一直等待"""
+        if not self.write_queue.flush(self.READ_FLUSH_TIMEOUT, stop_on_failure=True):
+            raise sqlite3.OperationalError(
+                f"Queued item writes are not committed: {self.write_queue.last_error}"
+            )
+    
+    def checkpoint(self):
+        """将WAL内容写回主数据库文件并同步到存储"""
+        conn = self._get_connection()
+        conn.execute("PRAGMA wal_checkpoint(FULL)")
+    
+    def close(self, timeout=None):
+        """提交排队的修改并关闭所有线程的数据库连接"""
+        if not self.write_queue.close(timeout):
+            print("Database closed with uncommitted queued writes")
+        with self._connections_lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error closing database connection: {e}")
     
     def init_database(self):
         """Initialize database tables"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            conn = self._get_connection()
+            with conn:
                 cursor = conn.cursor()
                 
                 # Create delivery notes table
@@ -30,7 +442,10 @@ class DatabaseManager:
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         name TEXT NOT NULL,
                         date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        total_items INTEGER DEFAULT 0
+                        total_items INTEGER DEFAULT 0,
+                        checked_correct INTEGER DEFAULT 0,
+                        checked_incorrect INTEGER DEFAULT 0,
+                        unchecked INTEGER DEFAULT 0
                     )
                 ''')
                 
@@ -44,140 +459,653 @@ class DatabaseManager:
                         unit_price REAL,
                         quantity INTEGER,
                         status TEXT DEFAULT 'unchecked',
+                        barcode_norm TEXT,
+                        barcode_key TEXT,
                         FOREIGN KEY (delivery_note_id) REFERENCES delivery_notes (id)
                     )
                 ''')
                 
-                conn.commit()
-                print("Database initialized successfully")
+                # Trigram side table for substring barcode search, scoped per delivery note
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS item_barcode_grams (
+                        delivery_note_id INTEGER,
+                        gram TEXT,
+                        item_id INTEGER,
+                        PRIMARY KEY (delivery_note_id, gram, item_id)
+                    ) WITHOUT ROWID
+                ''')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS barcode_gram_offsets (
+                        pos INTEGER PRIMARY KEY
+                    )
+                ''')
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO barcode_gram_offsets (pos) VALUES (?)",
+                    [(pos,) for pos in range(1, self.MAX_GRAM_OFFSET + 1)]
+                )
+                
+                # Durable OCR queue: pending -> in_flight -> done / failed, one row per image
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS ocr_jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        batch_id INTEGER NOT NULL,
+                        delivery_note_id INTEGER NOT NULL,
+                        page INTEGER NOT NULL,
+                        image_path TEXT NOT NULL,
+                        state TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER DEFAULT 0,
+                        error TEXT,
+                        retry_after TIMESTAMP,
+                        result TEXT,
+                        date_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                # Raw OCR tables per note and page (zlib-compressed JSON), for re-mapping
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS ocr_tables (
+                        delivery_note_id INTEGER NOT NULL,
+                        page INTEGER NOT NULL,
+                        data BLOB NOT NULL,
+                        date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (delivery_note_id, page)
+                    ) WITHOUT ROWID
+                ''')
+                
+                # Column mapping confirmed for a header layout, keyed by header_signature()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS mapping_profiles (
+                        signature TEXT PRIMARY KEY,
+                        headers TEXT NOT NULL,
+                        mapping TEXT NOT NULL,
+                        use_count INTEGER DEFAULT 1,
+                        date_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                self._migrate(cursor)
+                
+                # Exact barcode lookups within a delivery note
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_items_note_barcode_norm
+                    ON items (delivery_note_id, barcode_norm)
+                ''')
+                # "Scanned code contains stored code" lookups
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_items_note_barcode_key
+                    ON items (delivery_note_id, barcode_key)
+                ''')
+                # Keyset pagination, one index per supported ordering
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_items_note
+                    ON items (delivery_note_id)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_items_note_name
+                    ON items (delivery_note_id, name)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_items_note_status
+                    ON items (delivery_note_id, status)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_ocr_jobs_state
+                    ON ocr_jobs (state, batch_id, page)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_ocr_jobs_note
+                    ON ocr_jobs (delivery_note_id, batch_id)
+                ''')
+                # Hot list screen: newest notes first
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_delivery_notes_date_created
+                    ON delivery_notes (date_created)
+                ''')
+                self._create_barcode_gram_triggers(cursor)
+                self._create_delivery_note_counter_triggers(cursor)
+                self._create_archive_tables(cursor)
+                
+            print("Database initialized successfully")
         except Exception as e:
             print(f"Database initialization error: {e}")
             raise RuntimeError(f"No se pudo inicializar la base de datos: {e}")
     
+    def _migrate(self, cursor):
+        """升级旧版本创建的数据库"""
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        
+        if version < 1:
+            # v1: normalized barcode column, backfilled from existing rows
+            self._add_column(cursor, 'items', 'barcode_norm', 'TEXT')
+            rows = cursor.execute("SELECT id, barcode FROM items").fetchall()
+            cursor.executemany(
+                "UPDATE items SET barcode_norm = ? WHERE id = ?",
+                [(normalize_barcode(barcode), item_id) for item_id, barcode in rows]
+            )
+        
+        if version < 2:
+            # v2: compact barcode key and its trigrams
+            self._add_column(cursor, 'items', 'barcode_key', 'TEXT')
+            rows = cursor.execute("SELECT id, barcode FROM items").fetchall()
+            cursor.executemany(
+                "UPDATE items SET barcode_key = ? WHERE id = ?",
+                [(barcode_search_key(barcode), item_id) for item_id, barcode in rows]
+            )
+            cursor.execute('''
+                INSERT OR IGNORE INTO item_barcode_grams (delivery_note_id, gram, item_id)
+                SELECT items.delivery_note_id, substr(items.barcode_key, o.pos, 3), items.id
+                FROM items JOIN barcode_gram_offsets o
+                  ON o.pos <= length(items.barcode_key) - 2
+            ''')
+        
+        if version < 3:
+            # v3: per-status counters on delivery_notes
+            for column in ('checked_correct', 'checked_incorrect', 'unchecked'):
+                self._add_column(cursor, 'delivery_notes', column, 'INTEGER DEFAULT 0')
+            self._recount_delivery_notes(cursor)
+        
+        if version < 4:
+            # v4: failed OCR pages wait before they are claimed again
+            self._add_column(cursor, 'ocr_jobs', 'retry_after', 'TIMESTAMP')
+        
+        if version < self.SCHEMA_VERSION:
+            cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    def _create_barcode_gram_triggers(self, cursor):
+        """Keep item_barcode_grams in sync with items.barcode_key"""
+        insert_grams = '''
+            INSERT OR IGNORE INTO item_barcode_grams (delivery_note_id, gram, item_id)
+            SELECT new.delivery_note_id, substr(new.barcode_key, pos, 3), new.id
+            FROM barcode_gram_offsets WHERE pos <= length(new.barcode_key) - 2;
+        '''
+        delete_grams = '''
+            DELETE FROM item_barcode_grams
+            WHERE delivery_note_id = old.delivery_note_id
+              AND item_id = old.id
+              AND gram IN (
+                  SELECT substr(old.barcode_key, pos, 3)
+                  FROM barcode_gram_offsets WHERE pos <= length(old.barcode_key) - 2
+              );
+        '''
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS items_barcode_grams_insert
+            AFTER INSERT ON items BEGIN {insert_grams} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS items_barcode_grams_delete
+            AFTER DELETE ON items BEGIN {delete_grams} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS items_barcode_grams_update
+            AFTER UPDATE OF barcode_key, delivery_note_id ON items BEGIN
+                {delete_grams}
+                {insert_grams}
+            END
+        ''')
+    
+    def _create_delivery_note_counter_triggers(self, cursor):
+        """Keep delivery_notes item and status counters exact as items change"""
+        def adjust(row, sign):
+            return f'''
+                UPDATE delivery_notes SET
+                    total_items = total_items {sign} 1,
+                    checked_correct = checked_correct {sign} ({row}.status = 'correct'),
+                    checked_incorrect = checked_incorrect {sign} ({row}.status = 'incorrect'),
+                    unchecked = unchecked {sign} ({row}.status IS NOT 'correct'
+                                                  AND {row}.status IS NOT 'incorrect')
+                WHERE id = {row}.delivery_note_id;
+            '''
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS items_note_counters_insert
+            AFTER INSERT ON items BEGIN {adjust('new', '+')} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS items_note_counters_delete
+            AFTER DELETE ON items BEGIN {adjust('old', '-')} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS items_note_counters_update
+            AFTER UPDATE OF status, delivery_note_id ON items BEGIN
+                {adjust('old', '-')}
+                {adjust('new', '+')}
+            END
+        ''')
+    
+    def _create_archive_tables(self, cursor):
+        """归档库中的冷数据表 (与主库同结构, 无触发器, 计数保持归档时的值)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive.delivery_notes (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                date_created TIMESTAMP,
+                total_items INTEGER DEFAULT 0,
+                checked_correct INTEGER DEFAULT 0,
+                checked_incorrect INTEGER DEFAULT 0,
+                unchecked INTEGER DEFAULT 0,
+                date_archived TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive.items (
+                id INTEGER PRIMARY KEY,
+                delivery_note_id INTEGER,
+                barcode TEXT,
+                name TEXT NOT NULL,
+                unit_price REAL,
+                quantity INTEGER,
+                status TEXT DEFAULT 'unchecked',
+                barcode_norm TEXT,
+                barcode_key TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS archive.idx_archive_items_note
+            ON items (delivery_note_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS archive.idx_archive_items_barcode_norm
+            ON items (barcode_norm)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS archive.idx_archive_delivery_notes_date_created
+            ON delivery_notes (date_created)
+        ''')
+    
+    def _add_column(self, cursor, table, column, definition):
+        """Add a column unless the table already has it"""
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
     def create_delivery_note(self, name):
         """创建新的送货单"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT INTO delivery_notes (name) VALUES (?)",
                 (name,)
             )
-            conn.commit()
             return cursor.lastrowid
     
     def add_item(self, delivery_note_id, barcode, name, unit_price, quantity):
         """添加商品到送货单"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO items (delivery_note_id, barcode, name, unit_price, quantity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (delivery_note_id, barcode, name, unit_price, quantity))
+                INSERT INTO items (delivery_note_id, barcode, name, unit_price, quantity,
+                                   barcode_norm, barcode_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (delivery_note_id, barcode, name, unit_price, quantity,
+                  normalize_barcode(barcode), barcode_search_key(barcode)))
             
             item_id = cursor.lastrowid
-            conn.commit()
-            return item_id
+        self._invalidate_barcode_index(delivery_note_id)
+        return item_id
     
-    def update_delivery_note_count(self, delivery_note_id):
-        """Update the total items count for a delivery note"""
-        with sqlite3.connect(self.db_path) as conn:
+    def add_items(self, delivery_note_id, rows):
+        """批量添加商品到送货单 (单个事务，计数由触发器维护)
+
+        Args:
+            delivery_note_id: 送货单ID
+            rows: (barcode, name, unit_price, quantity) 元组的可迭代对象
+        Returns:
+            新商品ID列表，顺序与 rows 相同
+        """
+        params = self._item_params(delivery_note_id, rows)
+        if not params:
+            return []
+        conn = self._get_connection()
+        with conn:
+            item_ids = self._insert_items(conn.cursor(), params)
+        self._invalidate_barcode_index(delivery_note_id)
+        return item_ids
+    
+    def import_ocr_batch(self, delivery_note_id, rows, batch_id=None, replace=False, profile=None):
+        """导入映射后的识别结果 (单个事务)
+
+        添加 (replace=True 时替换全部) 商品、保存这批的原始表格、从OCR队列删除这批、记住列映射。
+        应用在导入中途被杀时要么全部生效、要么都没有，这批不会被再次提示而重复导入。
+        Args:
+            rows: (barcode, name, unit_price, quantity) 元组的可迭代对象
+            batch_id: OCR队列批次 (None: 重新映射已保存的表格)
+            profile: (signature, headers, mapping)，None 时不保存列映射
+        Returns:
+            (新商品ID列表, 这批图像的路径) — 图像文件由调用者删除
+        """
+        params = self._item_params(delivery_note_id, rows)
+        if replace:
+            # Queued status toggles would otherwise land on deleted ids
+            self._flush_for_write()
+        image_paths = []
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE delivery_notes 
-                SET total_items = (
-                    SELECT COUNT(*) FROM items WHERE delivery_note_id = ?
-                )
-                WHERE id = ?
-            ''', (delivery_note_id, delivery_note_id))
-            
-            conn.commit()
+            if replace:
+                cursor.execute("DELETE FROM items WHERE delivery_note_id = ?", (delivery_note_id,))
+            item_ids = self._insert_items(cursor, params) if params else []
+            if batch_id is not None:
+                # Keep the raw pages so the note can be re-mapped without another API call
+                self._insert_ocr_tables(cursor, delivery_note_id, self._ocr_batch_tables(cursor, batch_id))
+                image_paths = self._delete_ocr_batch(cursor, batch_id)
+            if profile is not None:
+                self._save_mapping_profile(cursor, *profile)
+        self._invalidate_barcode_index(delivery_note_id)
+        return item_ids, image_paths
+    
+    @staticmethod
+    def _item_params(delivery_note_id, rows):
+        return [
+            (delivery_note_id, barcode, name, unit_price, quantity,
+             normalize_barcode(barcode), barcode_search_key(barcode))
+            for barcode, name, unit_price, quantity in rows
+        ]
+    
+    @staticmethod
+    def _insert_items(cursor, params):
+        cursor.executemany('''
+            INSERT INTO items (delivery_note_id, barcode, name, unit_price, quantity,
+                               barcode_norm, barcode_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', params)
+        
+        # AUTOINCREMENT ids are consecutive while this transaction holds the write lock
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'items'")
+        last_id = cursor.fetchone()[0]
+        return list(range(last_id - len(params) + 1, last_id + 1))
+    
+    def update_delivery_note_count(self, delivery_note_id):
+        """Recompute the item and status counters of one delivery note
+
+        The counters are maintained by triggers; this is only a repair tool.
+        """
+        conn = self._get_connection()
+        with conn:
+            self._recount_delivery_notes(conn.cursor(), delivery_note_id)
     
     def fix_all_delivery_note_counts(self):
-        """Fix the item count for all delivery notes"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Get all delivery notes
-            cursor.execute("SELECT id FROM delivery_notes")
-            delivery_notes = cursor.fetchall()
-            
-            for note in delivery_notes:
-                delivery_note_id = note[0]
-                
-                # Count items for this delivery note
-                cursor.execute("SELECT COUNT(*) FROM items WHERE delivery_note_id = ?", (delivery_note_id,))
-                actual_count = cursor.fetchone()[0]
-                
-                # Update count for this delivery note
-                cursor.execute('''
-                    UPDATE delivery_notes 
-                    SET total_items = ?
-                    WHERE id = ?
-                ''', (actual_count, delivery_note_id))
-            
-            conn.commit()
+        """Fix the item and status counters for all delivery notes"""
+        conn = self._get_connection()
+        with conn:
+            self._recount_delivery_notes(conn.cursor())
+    
+    def _recount_delivery_notes(self, cursor, delivery_note_id=None):
+        """Set-based recount: one grouped pass over items instead of a query per note"""
+        note_filter = "WHERE n.id = ?" if delivery_note_id is not None else ""
+        params = (delivery_note_id,) if delivery_note_id is not None else ()
+        cursor.execute(f'''
+            UPDATE delivery_notes SET
+                total_items = c.total,
+                checked_correct = c.correct,
+                checked_incorrect = c.incorrect,
+                unchecked = c.total - c.correct - c.incorrect
+            FROM (
+                SELECT n.id AS note_id,
+                       COUNT(i.id) AS total,
+                       COALESCE(SUM(i.status = 'correct'), 0) AS correct,
+                       COALESCE(SUM(i.status = 'incorrect'), 0) AS incorrect
+                FROM delivery_notes n
+                LEFT JOIN items i ON i.delivery_note_id = n.id
+                {note_filter}
+                GROUP BY n.id
+            ) AS c
+            WHERE delivery_notes.id = c.note_id
+        ''', params)
+    
+    def _select(self, record, sql, params=()):
+        """Run a query whose rows are built as `record` objects (Item, DeliveryNote)"""
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = record.from_row
+        return cursor.execute(sql, params)
     
     def get_delivery_notes(self):
-        """获取所有送货单"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM delivery_notes ORDER BY date_created DESC")
-            return cursor.fetchall()
+        """获取所有未归档的送货单"""
+        self._flush_for_read()
+        return self._select(
+            DeliveryNote,
+            f"SELECT {DeliveryNote.COLUMNS} FROM main.delivery_notes ORDER BY date_created DESC"
+        ).fetchall()
     
-    def get_items_by_delivery_note(self, delivery_note_id):
-        """根据送货单ID获取商品"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT * FROM items WHERE delivery_note_id = ?",
-                (delivery_note_id,)
-            )
-            return cursor.fetchall()
+    def get_items_by_delivery_note(self, delivery_note_id, archived=False):
+        """根据送货单ID获取商品 (archived=True 时从归档库读取)"""
+        self._flush_for_read()
+        table = 'archive.items' if archived else 'main.items'
+        # Explicit order: the barcode indexes would otherwise decide it
+        return self._select(
+            Item,
+            f"SELECT {Item.COLUMNS} FROM {table} WHERE delivery_note_id = ? ORDER BY id",
+            (delivery_note_id,)
+        ).fetchall()
+    
+    def get_items_page(self, delivery_note_id, order_by='id', page_size=50, cursor=None):
+        """按页获取送货单商品 (键集分页)
+
+        Args:
+            delivery_note_id: 送货单ID
+            order_by: 'id' (导入顺序), 'name', 'status' 或 'barcode'
+            page_size: 每页商品数
+            cursor: 上一页返回的游标，None 表示第一页
+        Returns:
+            (商品列表, 下一页游标)，没有更多数据时游标为 None
+        """
+        if order_by not in self.ITEM_ORDERINGS:
+            raise ValueError(f"Unsupported item ordering: {order_by}")
+        column = self.ITEM_ORDERINGS[order_by]
+        
+        where = "delivery_note_id = ?"
+        params = [delivery_note_id]
+        if cursor is not None:
+            cursor_order, last_value, last_id = self._decode_page_cursor(cursor)
+            if cursor_order != order_by:
+                raise ValueError("Page cursor was created for a different ordering")
+            if column is None:
+                where += " AND id > ?"
+                params.append(last_id)
+            else:
+                where += f" AND ({column}, id) > (?, ?)"
+                params += [last_value, last_id]
+        order = "id" if column is None else f"{column}, id"
+        
+        self._flush_for_read()
+        items = self._select(
+            Item,
+            f"SELECT {Item.COLUMNS} FROM items WHERE {where} ORDER BY {order} LIMIT ?",
+            (*params, page_size + 1)
+        ).fetchall()
+        
+        if len(items) <= page_size:
+            return items, None
+        items = items[:page_size]
+        last = items[-1]
+        if column is None:
+            last_value = None
+        elif column == 'barcode_key':
+            # Same function that filled the stored column
+            last_value = barcode_search_key(last.barcode)
+        else:
+            last_value = getattr(last, column)
+        return items, self._encode_page_cursor(order_by, last_value, last.id)
+    
+    def iter_items_by_delivery_note(self, delivery_note_id, order_by='id', page_size=200):
+        """逐个产出送货单商品，按页从数据库读取"""
+        cursor = None
+        while True:
+            rows, cursor = self.get_items_page(delivery_note_id, order_by, page_size, cursor)
+            yield from rows
+            if cursor is None:
+                return
+    
+    @staticmethod
+    def _encode_page_cursor(order_by, last_value, last_id):
+        payload = json.dumps([order_by, last_value, last_id], ensure_ascii=False)
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def _decode_page_cursor(cursor):
+        try:
+            order_by, last_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid page cursor: {e}")
+        return order_by, last_value, last_id
+    
+    def _partial_barcode_ids_sql(self, delivery_note_id, barcode_key):
+        """构建部分匹配的子查询 (返回商品ID)
+
+        两个方向都走索引:
+        - 已存条码包含扫描码: 在 item_barcode_grams 中取扫描码末尾两个三元组的交集，再用 instr() 校验
+        - 扫描码包含已存条码 (OCR截断): 扫描码的每个子串都是 idx_items_note_barcode_key 的一次探测
+        """
+        if len(barcode_key) >= 6:
+            # The item-reference end is the selective part of a GTIN; the leading grams are the
+            # country/company prefix shared by most of a supplier's note. Both probes are PK
+            # ranges ordered by item_id, so ORDER BY lets SQLite merge them without a temp b-tree
+            contains_sql = '''
+                SELECT id FROM items WHERE id IN (
+                    SELECT item_id FROM item_barcode_grams WHERE delivery_note_id = ? AND gram = ?
+                    INTERSECT
+                    SELECT item_id FROM item_barcode_grams WHERE delivery_note_id = ? AND gram = ?
+                    ORDER BY 1
+                ) AND instr(barcode_key, ?) > 0
+            '''
+            params = [delivery_note_id, barcode_key[-3:], delivery_note_id, barcode_key[-6:-3],
+                      barcode_key]
+        elif len(barcode_key) >= 3:
+            contains_sql = '''
+                SELECT g.item_id FROM item_barcode_grams g
+                JOIN items i ON i.id = g.item_id
+                WHERE g.delivery_note_id = ? AND g.gram = ? AND instr(i.barcode_key, ?) > 0
+            '''
+            params = [delivery_note_id, barcode_key[-3:], barcode_key]
+        else:
+            contains_sql = '''
+                SELECT id FROM items WHERE delivery_note_id = ? AND instr(barcode_key, ?) > 0
+            '''
+            params = [delivery_note_id, barcode_key]
+        
+        substrings = {
+            barcode_key[start:end]
+            for start in range(len(barcode_key))
+            for end in range(start + 1, len(barcode_key) + 1)
+        }
+        if len(substrings) <= self.MAX_CONTAINED_SUBSTRINGS:
+            placeholders = ', '.join('?' * len(substrings))
+            contained_sql = f'''
+                SELECT id FROM items WHERE delivery_note_id = ? AND barcode_key IN ({placeholders})
+            '''
+            params += [delivery_note_id, *substrings]
+        else:
+            contained_sql = '''
+                SELECT id FROM items
+                WHERE delivery_note_id = ? AND barcode_key != '' AND instr(?, barcode_key) > 0
+            '''
+            params += [delivery_note_id, barcode_key]
+        
+        return f"{contains_sql} UNION {contained_sql}", params
+    
+    def open_barcode_index(self, delivery_note_id):
+        """为送货单建立内存条码索引 (打开送货单时调用)
+
+        之后对该送货单的条码搜索直接查内存，直到另一个送货单被打开。
+        已有该送货单的有效索引时直接返回。
+        """
+        index = self._barcode_index
+        if index is not None and index.delivery_note_id == delivery_note_id and not index.stale:
+            return index
+        self._flush_for_read()
+        conn = self._get_connection()
+        rows = conn.execute(
+            f"SELECT {Item.COLUMNS}, barcode_norm, barcode_key FROM items WHERE delivery_note_id = ?",
+            (delivery_note_id,)
+        ).fetchall()
+        index = BarcodeIndex(
+            delivery_note_id, [(Item(*row[:-2]), row[-2], row[-1]) for row in rows]
+        )
+        with self._barcode_index_lock:
+            self._barcode_index = index
+        return index
+    
+    def close_barcode_index(self):
+        with self._barcode_index_lock:
+            self._barcode_index = None
+    
+    def _invalidate_barcode_index(self, delivery_note_id=None):
+        """Mark the in-memory index stale after items or barcodes changed"""
+        with self._barcode_index_lock:
+            index = self._barcode_index
+            if index is not None and delivery_note_id in (None, index.delivery_note_id):
+                index.stale = True
+    
+    def _patch_barcode_index_status(self, item_id, status):
+        with self._barcode_index_lock:
+            if self._barcode_index is not None:
+                self._barcode_index.update_status(item_id, status)
     
     def search_items_by_barcode(self, delivery_note_id, barcode):
         """Devuelve TODAS las coincidencias (exactas y parciales), ordenadas exactas primero."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM items
-                WHERE delivery_note_id = ?
-                  AND barcode IS NOT NULL
-                  AND barcode != ''
-                  AND (
-                      barcode = ?
-                      OR barcode LIKE '%' || ? || '%'
-                      OR ? LIKE '%' || barcode || '%'
-                  )
-                ORDER BY
-                    CASE WHEN barcode = ? THEN 0 ELSE 1 END,
-                    name
-            ''', (delivery_note_id, barcode, barcode, barcode, barcode))
-            return cursor.fetchall()
+        barcode_norm = normalize_barcode(barcode)
+        barcode_key = barcode_search_key(barcode)
+        if not barcode_key:
+            return []
+        self._flush_for_read()
+        
+        index = self._barcode_index
+        if index is not None and index.delivery_note_id == delivery_note_id:
+            if index.stale:
+                self.barcode_index_stats['misses'] += 1
+                index = self.open_barcode_index(delivery_note_id)
+            else:
+                self.barcode_index_stats['hits'] += 1
+            return index.search(barcode_norm, barcode_key)
+        self.barcode_index_stats['misses'] += 1
+        
+        # Exact matches: one probe of idx_items_note_barcode_norm. The unary + keeps the
+        # planner from walking idx_items_note_name over the whole note to skip a tiny sort
+        exact = self._select(Item, f'''
+            SELECT {Item.COLUMNS} FROM items
+            WHERE delivery_note_id = ? AND barcode_norm = ?
+            ORDER BY +name
+        ''', (delivery_note_id, barcode_norm)).fetchall()
+        
+        partial_sql, params = self._partial_barcode_ids_sql(delivery_note_id, barcode_key)
+        partial = self._select(Item, f'''
+            SELECT {Item.COLUMNS} FROM items
+            WHERE id IN ({partial_sql}) AND barcode_norm != ?
+            ORDER BY +name
+        ''', (*params, barcode_norm)).fetchall()
+        return exact + partial
 
     def search_item_by_barcode(self, delivery_note_id, barcode):
         """根据条形码搜索商品，支持完整匹配和部分匹配"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            # Exact match first, then partial (barcode contains search term
-            # OR search term contains stored barcode)
-            cursor.execute('''
-                SELECT * FROM items
-                WHERE delivery_note_id = ?
-                  AND barcode IS NOT NULL
-                  AND (
-                      barcode = ?
-                      OR barcode LIKE '%' || ? || '%'
-                      OR ? LIKE '%' || barcode || '%'
-                  )
-                ORDER BY
-                    CASE WHEN barcode = ? THEN 0 ELSE 1 END
-                LIMIT 1
-            ''', (delivery_note_id, barcode, barcode, barcode, barcode))
-            return cursor.fetchone()
+        barcode_norm = normalize_barcode(barcode)
+        barcode_key = barcode_search_key(barcode)
+        if not barcode_key:
+            return None
+        index = self._barcode_index
+        if index is not None and index.delivery_note_id == delivery_note_id:
+            matches = self.search_items_by_barcode(delivery_note_id, barcode)
+            return matches[0] if matches else None
+        self._flush_for_read()
+        item = self._select(
+            Item,
+            f"SELECT {Item.COLUMNS} FROM items WHERE delivery_note_id = ? AND barcode_norm = ? LIMIT 1",
+            (delivery_note_id, barcode_norm)
+        ).fetchone()
+        if item:
+            return item
+        
+        partial_sql, params = self._partial_barcode_ids_sql(delivery_note_id, barcode_key)
+        return self._select(
+            Item, f"SELECT {Item.COLUMNS} FROM items WHERE id IN ({partial_sql}) LIMIT 1", params
+        ).fetchone()
     
     def get_item_status(self, item_id):
-        """获取商品状态"""
-        with sqlite3.connect(self.db_path) as conn:
+        """获取商品状态 (包括尚未提交的排队修改)"""
+        status = self.write_queue.pending_value(item_id, 'status')
+        if status is not None:
+            return status
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute("SELECT status FROM items WHERE id = ?", (item_id,))
             row = cursor.fetchone()
@@ -185,52 +1113,446 @@ class DatabaseManager:
 
     def update_item_barcode(self, item_id, barcode):
         """更新商品条码"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute(
-                "UPDATE items SET barcode = ? WHERE id = ?",
-                (barcode, item_id)
+                "UPDATE items SET barcode = ?, barcode_norm = ?, barcode_key = ? WHERE id = ?",
+                (barcode, normalize_barcode(barcode), barcode_search_key(barcode), item_id)
             )
-            conn.commit()
+        self._invalidate_barcode_index()
 
     def update_item_status(self, item_id, status):
         """更新商品状态 (unchecked, correct, incorrect)"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE items SET status = ? WHERE id = ?",
                 (status, item_id)
             )
-            conn.commit()
+        self._patch_barcode_index_status(item_id, status)
+    
+    def queue_item_status(self, item_id, status):
+        """排队更新商品状态，由后台写线程提交"""
+        self.write_queue.put(item_id, 'status', status)
+        self._patch_barcode_index_status(item_id, status)
+    
+    def queue_item_barcode(self, item_id, barcode):
+        """排队更新商品条码，由后台写线程提交"""
+        self.write_queue.put(item_id, 'barcode', barcode)
+    
+    def _apply_item_mutations(self, mutations):
+        """Commit a batch of queued (item_id, field, value) mutations in one transaction"""
+        statuses = [(value, item_id) for item_id, field, value in mutations if field == 'status']
+        barcodes = [
+            (value, normalize_barcode(value), barcode_search_key(value), item_id)
+            for item_id, field, value in mutations if field == 'barcode'
+        ]
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.cursor()
+            if statuses:
+                cursor.executemany("UPDATE items SET status = ? WHERE id = ?", statuses)
+            if barcodes:
+                cursor.executemany(
+                    "UPDATE items SET barcode = ?, barcode_norm = ?, barcode_key = ? WHERE id = ?",
+                    barcodes
+                )
+        if barcodes:
+            self._invalidate_barcode_index()
     
     def export_delivery_note_to_excel(self, delivery_note_id):
         """导出送货单到CSV (Android兼容)"""
         try:
             from simple_export import export_to_csv
             
+            self._flush_for_read()
             delivery_note = self.get_delivery_note_by_id(delivery_note_id)
-            items = self.get_items_by_delivery_note(delivery_note_id)
-            
             if not delivery_note:
                 return None
+            items = self.get_items_by_delivery_note(
+                delivery_note_id, archived=self.is_archived(delivery_note_id)
+            )
             
-            return export_to_csv(delivery_note[1], items)
+            return export_to_csv(delivery_note.name, items)
             
         except Exception as e:
             print(f"Export error: {e}")
             return None
     
     def get_delivery_note_by_id(self, delivery_note_id):
-        """Obtener una nota de entrega por su ID"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM delivery_notes WHERE id = ?", (delivery_note_id,))
-            return cursor.fetchone()
+        """Obtener una nota de entrega por su ID (también las archivadas)"""
+        self._flush_for_read()
+        # AUTOINCREMENT never reuses ids, so an archived id cannot clash with a hot one
+        return self._select(
+            DeliveryNote,
+            f'''
+            SELECT {DeliveryNote.COLUMNS} FROM main.delivery_notes WHERE id = ?
+            UNION ALL
+            SELECT {DeliveryNote.COLUMNS} FROM archive.delivery_notes WHERE id = ?
+            LIMIT 1
+            ''',
+            (delivery_note_id, delivery_note_id)
+        ).fetchone()
+    
+    def is_archived(self, delivery_note_id):
+        """送货单是否只存在于归档库"""
+        conn = self._get_connection()
+        row = conn.execute('''
+            SELECT NOT EXISTS (SELECT 1 FROM main.delivery_notes WHERE id = ?)
+               AND EXISTS (SELECT 1 FROM archive.delivery_notes WHERE id = ?)
+        ''', (delivery_note_id, delivery_note_id)).fetchone()
+        return bool(row[0])
+    
+    def archive_delivery_notes(self, completed_after_days=1, max_age_days=90, batch_size=None):
+        """把已全部核对或过旧的送货单连同商品移入归档库
+        
+        已核对完的送货单在 completed_after_days 天后归档，其余在 max_age_days 天后归档。
+        每批 batch_size 张单据: 先在一个事务中复制到归档库，再在另一个事务中从主库删除。
+        返回归档的单据数。
+        """
+        self._flush_for_write()
+        batch_size = batch_size or self.ARCHIVE_BATCH_SIZE
+        columns = f"{Item.COLUMNS}, barcode_norm, barcode_key"
+        conn = self._get_connection()
+        archived = 0
+        while True:
+            note_ids = [row[0] for row in conn.execute('''
+                SELECT id FROM main.delivery_notes
+                WHERE (total_items > 0 AND unchecked = 0
+                       AND date_created <= datetime('now', ?))
+                   OR date_created <= datetime('now', ?)
+                ORDER BY date_created
+                LIMIT ?
+            ''', (f'-{completed_after_days} days', f'-{max_age_days} days', batch_size))]
+            if not note_ids:
+                break
+            placeholders = ', '.join('?' * len(note_ids))
+            # A WAL commit is atomic per database file only, and a transaction writing both
+            # files may land in either order. So the copy commits on its own first (it only
+            # writes archive.db) and main.db is changed in a second transaction: a batch
+            # interrupted in between exists in both and is simply copied again next time.
+            with conn:
+                conn.execute(
+                    f"DELETE FROM archive.items WHERE delivery_note_id IN ({placeholders})", note_ids
+                )
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO archive.delivery_notes ({DeliveryNote.COLUMNS})
+                    SELECT {DeliveryNote.COLUMNS} FROM main.delivery_notes
+                    WHERE id IN ({placeholders})
+                ''', note_ids)
+                conn.execute(f'''
+                    INSERT INTO archive.items ({columns})
+                    SELECT {columns} FROM main.items
+                    WHERE delivery_note_id IN ({placeholders})
+                ''', note_ids)
+            # Notes whose items changed after the copy (a queued status or barcode, an import)
+            # stay in main.db whole and are copied again on the next run
+            changed_sql = f'''
+                SELECT m.delivery_note_id FROM main.items m
+                LEFT JOIN archive.items a ON a.id = m.id
+                WHERE m.delivery_note_id IN ({placeholders})
+                  AND (a.id IS NULL OR a.status IS NOT m.status OR a.barcode IS NOT m.barcode)
+                UNION
+                SELECT a.delivery_note_id FROM archive.items a
+                LEFT JOIN main.items m ON m.id = a.id
+                WHERE a.delivery_note_id IN ({placeholders}) AND m.id IS NULL
+            '''
+            with conn:
+                # Notes go first so the counter triggers find nothing to update
+                moved = conn.execute(
+                    f"DELETE FROM main.delivery_notes WHERE id IN ({placeholders}) "
+                    f"AND id NOT IN ({changed_sql})",
+                    note_ids * 3
+                ).rowcount
+                conn.execute(f'''
+                    DELETE FROM main.items
+                    WHERE delivery_note_id IN ({placeholders})
+                      AND delivery_note_id NOT IN (SELECT id FROM main.delivery_notes)
+                ''', note_ids)
+            for note_id in note_ids:
+                self._invalidate_barcode_index(note_id)
+            archived += moved
+            if moved == 0:
+                # Items keep changing under us: leave these notes for the next run
+                break
+        return archived
+    
+    def count_archived_delivery_notes(self):
+        """归档库中的送货单数量"""
+        conn = self._get_connection()
+        return conn.execute(
+            "SELECT COUNT(*) FROM archive.delivery_notes WHERE id NOT IN (SELECT id FROM main.delivery_notes)"
+        ).fetchone()[0]
+    
+    def get_archived_delivery_notes(self, name_query=None, limit=100):
+        """按日期倒序列出归档的送货单, 可按名称过滤"""
+        # A note copied by an interrupted archive run is still live until it is deleted from main
+        sql = f'''
+            SELECT {DeliveryNote.COLUMNS} FROM archive.delivery_notes
+            WHERE id NOT IN (SELECT id FROM main.delivery_notes)
+        '''
+        params = []
+        if name_query:
+            sql += " AND name LIKE '%' || ? || '%'"
+            params.append(name_query)
+        sql += " ORDER BY date_created DESC LIMIT ?"
+        params.append(limit)
+        return self._select(DeliveryNote, sql, params).fetchall()
+    
+    def search_archived_items_by_barcode(self, barcode):
+        """在所有归档送货单中按条码精确查找商品"""
+        barcode_norm = normalize_barcode(barcode)
+        if not barcode_norm:
+            return []
+        return self._select(
+            Item,
+            f'''
+            SELECT {Item.COLUMNS} FROM archive.items
+            WHERE barcode_norm = ?
+              AND delivery_note_id NOT IN (SELECT id FROM main.delivery_notes)
+            ORDER BY delivery_note_id DESC, id
+            ''',
+            (barcode_norm,)
+        ).fetchall()
 
     def delete_delivery_note(self, delivery_note_id):
         """删除送货单及其所有商品"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_connection()
+        with conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM items WHERE delivery_note_id = ?", (delivery_note_id,))
             cursor.execute("DELETE FROM delivery_notes WHERE id = ?", (delivery_note_id,))
-            conn.commit()
\ No newline at end of file
+            cursor.execute("DELETE FROM archive.items WHERE delivery_note_id = ?", (delivery_note_id,))
+            cursor.execute("DELETE FROM archive.delivery_notes WHERE id = ?", (delivery_note_id,))
+            cursor.execute("DELETE FROM ocr_jobs WHERE delivery_note_id = ?", (delivery_note_id,))
+            cursor.execute("DELETE FROM ocr_tables WHERE delivery_note_id = ?", (delivery_note_id,))
+        self._invalidate_barcode_index(delivery_note_id)
+    
+    def enqueue_ocr_batch(self, delivery_note_id, image_paths):
+        """把一组图像加入OCR队列 (每张一行, 状态 pending)，返回批次ID"""
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.cursor()
+            rows = [(delivery_note_id, page, image_path)
+                    for page, image_path in enumerate(image_paths, 1)]
+            # The batch is named after its first job: AUTOINCREMENT ids are never reused
+            cursor.execute('''
+                INSERT INTO ocr_jobs (batch_id, delivery_note_id, page, image_path)
+                VALUES (0, ?, ?, ?)
+            ''', rows[0])
+            batch_id = cursor.lastrowid
+            cursor.execute("UPDATE ocr_jobs SET batch_id = ? WHERE id = ?", (batch_id, batch_id))
+            cursor.executemany('''
+                INSERT INTO ocr_jobs (batch_id, delivery_note_id, page, image_path)
+                VALUES (?, ?, ?, ?)
+            ''', [(batch_id,) + row for row in rows[1:]])
+        return batch_id
+    
+    def claim_ocr_batch(self):
+        """把最早一批中所有 pending 的图像标记为 in_flight 并返回 (队列为空时返回[])"""
+        conn = self._get_connection()
+        with conn:
+            cursor = conn.cursor()
+            # Pages backing off after an error are left until retry_after
+            cursor.execute('''
+                UPDATE ocr_jobs SET state = 'in_flight', date_updated = CURRENT_TIMESTAMP
+                WHERE state = 'pending'
+                  AND (retry_after IS NULL OR retry_after <= CURRENT_TIMESTAMP)
+                  AND batch_id = (
+                    SELECT MIN(batch_id) FROM ocr_jobs
+                    WHERE state = 'pending'
+                      AND (retry_after IS NULL OR retry_after <= CURRENT_TIMESTAMP)
+                  )
+            ''')
+            if not cursor.rowcount:
+                return []
+        # The worker is the only claimer, so every in_flight row is ours
+        return self._select(
+            OCRJob,
+            f"SELECT {OCRJob.COLUMNS} FROM ocr_jobs WHERE state = 'in_flight' ORDER BY batch_id, page"
+        ).fetchall()
+    
+    def complete_ocr_job(self, job_id, table_data):
+        """保存一页的识别结果 (table_data 为None表示该页没有表格)"""
+        result = None if table_data is None else json.dumps(table_data, ensure_ascii=False)
+        conn = self._get_connection()
+        with conn:
+            conn.execute('''
+                UPDATE ocr_jobs SET state = 'done', result = ?, error = NULL,
+                                    date_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (result, job_id))
+    
+    def retry_ocr_job(self, job_id, error, max_attempts, retry_delay=0):
+        """记录一次失败: 还有重试次数时回到 pending，否则标记为 failed。返回新状态
+
+        回到 pending 的图像 retry_delay * 2^(已失败次数) 秒后才会再被领取。
+        """
+        conn = self._get_connection()
+        with conn:
+            conn.execute('''
+                UPDATE ocr_jobs SET
+                    attempts = attempts + 1,
+                    error = ?,
+                    state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    retry_after = datetime('now', '+' || CAST(? * (1 << attempts) AS INTEGER) || ' seconds'),
+                    date_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (error, max_attempts, retry_delay, job_id))
+            row = conn.execute("SELECT state FROM ocr_jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+    
+    def next_ocr_retry_delay(self):
+        """距离最早一张等待重试的图像可以领取还有几秒，没有等待重试的图像时返回None"""
+        row = self._get_connection().execute('''
+            SELECT (julianday(MIN(retry_after)) - julianday('now')) * 86400 FROM ocr_jobs
+            WHERE state = 'pending' AND retry_after > CURRENT_TIMESTAMP
+        ''').fetchone()
+        if row[0] is None:
+            return None
+        # retry_after has whole seconds: wake just after it
+        return max(0.0, row[0]) + 1
+    
+    def release_ocr_jobs(self, job_ids=None):
+        """把 in_flight 的图像放回 pending (不计失败次数)
+
+        job_ids=None 时释放全部 — 应用启动时用来恢复上次被中断的任务。
+        Returns:
+            放回的图像数
+        """
+        conn = self._get_connection()
+        with conn:
+            if job_ids is None:
+                cursor = conn.execute("UPDATE ocr_jobs SET state = 'pending' WHERE state = 'in_flight'")
+            else:
+                cursor = conn.executemany(
+                    "UPDATE ocr_jobs SET state = 'pending' WHERE id = ? AND state = 'in_flight'",
+                    [(job_id,) for job_id in job_ids]
+                )
+        return cursor.rowcount
+    
+    def get_ocr_batch(self, batch_id):
+        """一批中的所有图像，按页码排序"""
+        return self._select(
+            OCRJob,
+            f"SELECT {OCRJob.COLUMNS} FROM ocr_jobs WHERE batch_id = ? ORDER BY page",
+            (batch_id,)
+        ).fetchall()
+    
+    def get_ocr_batch_tables(self, batch_id):
+        """一批中已完成页面的表格，按页码排序"""
+        return self._ocr_batch_tables(self._get_connection().cursor(), batch_id)
+    
+    @staticmethod
+    def _ocr_batch_tables(cursor, batch_id):
+        rows = cursor.execute('''
+            SELECT result FROM ocr_jobs
+            WHERE batch_id = ? AND state = 'done' AND result IS NOT NULL
+            ORDER BY page
+        ''', (batch_id,)).fetchall()
+        return [json.loads(result) for (result,) in rows]
+    
+    def is_ocr_batch_finished(self, batch_id):
+        """一批中没有等待或正在处理的图像"""
+        conn = self._get_connection()
+        row = conn.execute('''
+            SELECT NOT EXISTS (
+                SELECT 1 FROM ocr_jobs
+                WHERE batch_id = ? AND state IN ('pending', 'in_flight')
+            )
+        ''', (batch_id,)).fetchone()
+        return bool(row[0])
+    
+    def get_finished_ocr_batches(self, delivery_note_id):
+        """送货单中已识别完但尚未导入 (未删除) 的批次ID"""
+        conn = self._get_connection()
+        rows = conn.execute('''
+            SELECT batch_id FROM ocr_jobs
+            WHERE delivery_note_id = ?
+            GROUP BY batch_id
+            HAVING SUM(state IN ('pending', 'in_flight')) = 0
+            ORDER BY batch_id
+        ''', (delivery_note_id,)).fetchall()
+        return [batch_id for (batch_id,) in rows]
+    
+    def count_queued_ocr_jobs(self, delivery_note_id=None):
+        """等待或正在处理的图像数"""
+        sql = "SELECT COUNT(*) FROM ocr_jobs WHERE state IN ('pending', 'in_flight')"
+        params = ()
+        if delivery_note_id is not None:
+            sql += " AND delivery_note_id = ?"
+            params = (delivery_note_id,)
+        return self._get_connection().execute(sql, params).fetchone()[0]
+    
+    def get_ocr_image_paths(self):
+        """队列中所有图像文件的路径"""
+        conn = self._get_connection()
+        return {path for (path,) in conn.execute("SELECT image_path FROM ocr_jobs")}
+    
+    def delete_ocr_batch(self, batch_id):
+        """删除一批 (放弃后)，返回这批图像的路径"""
+        conn = self._get_connection()
+        with conn:
+            return self._delete_ocr_batch(conn.cursor(), batch_id)
+    
+    @staticmethod
+    def _delete_ocr_batch(cursor, batch_id):
+        paths = [path for (path,) in cursor.execute(
+            "SELECT image_path FROM ocr_jobs WHERE batch_id = ?", (batch_id,)
+        ).fetchall()]
+        cursor.execute("DELETE FROM ocr_jobs WHERE batch_id = ?", (batch_id,))
+        return paths
+    
+    @staticmethod
+    def _insert_ocr_tables(cursor, delivery_note_id, tables):
+        """保存识别出的原始表格 (每页一行，压缩)，页码接在已有页面之后"""
+        blobs = [
+            zlib.compress(json.dumps(table, ensure_ascii=False).encode('utf-8'))
+            for table in tables
+        ]
+        if not blobs:
+            return
+        first_page = cursor.execute(
+            "SELECT COALESCE(MAX(page), 0) + 1 FROM ocr_tables WHERE delivery_note_id = ?",
+            (delivery_note_id,)
+        ).fetchone()[0]
+        cursor.executemany(
+            "INSERT INTO ocr_tables (delivery_note_id, page, data) VALUES (?, ?, ?)",
+            [(delivery_note_id, page, blob) for page, blob in enumerate(blobs, first_page)]
+        )
+    
+    def get_ocr_tables(self, delivery_note_id):
+        """送货单保存的原始表格，按页码排序"""
+        conn = self._get_connection()
+        rows = conn.execute(
+            "SELECT data FROM ocr_tables WHERE delivery_note_id = ? ORDER BY page",
+            (delivery_note_id,)
+        ).fetchall()
+        return [json.loads(zlib.decompress(data).decode('utf-8')) for (data,) in rows]
+    
+    def get_mapping_profile(self, signature):
+        """按表头签名返回保存的列映射 {field: 列号}，没有时返回None"""
+        conn = self._get_connection()
+        row = conn.execute(
+            "SELECT mapping FROM mapping_profiles WHERE signature = ?", (signature,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    @staticmethod
+    def _save_mapping_profile(cursor, signature, headers, mapping):
+        """保存 (或更新) 一个表头格式的列映射"""
+        cursor.execute('''
+            INSERT INTO mapping_profiles (signature, headers, mapping) VALUES (?, ?, ?)
+            ON CONFLICT (signature) DO UPDATE SET
+                mapping = excluded.mapping,
+                use_count = use_count + 1,
+                date_updated = CURRENT_TIMESTAMP
+        ''', (signature, json.dumps(list(headers), ensure_ascii=False), json.dumps(mapping)))
+    
+    def delete_mapping_profile(self, signature):
+        """删除一个列映射方案 (下次重新手动映射)"""
+        conn = self._get_connection()
+        with conn:
+            conn.execute("DELETE FROM mapping_profiles WHERE signature = ?", (signature,))
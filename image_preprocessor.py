@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+上传前的图像预处理
+按EXIF方向旋转、缩小长边、可选灰度/自动对比度，再重新编码为JPEG或WebP
+"""
+
+import io
+import os
+import threading
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
+    ImageOps = None
+
+# Claude downsizes anything with a longer edge than this before reading it
+DEFAULT_MAX_LONG_EDGE = 1568
+
+MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+
+
+def detect_media_type(image_bytes):
+    """根据文件头判断图像类型 (无法识别时按JPEG处理)"""
+    if image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    if image_bytes[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'image/jpeg'
+
+
+class ImagePreprocessor:
+    """把相机照片压缩成适合OCR上传的大小
+
+    Pillow不可用或图像无法解码时原样上传。
+    """
+
+    def __init__(self, max_long_edge=DEFAULT_MAX_LONG_EDGE, grayscale=False,
+                 autocontrast=False, output_format='JPEG', quality=85):
+        self.max_long_edge = max_long_edge
+        self.grayscale = grayscale
+        self.autocontrast = autocontrast
+        self.output_format = output_format.upper()
+        self.quality = quality
+        self.stats = {'images': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def signature(self):
+        """影响输出的设置, 用于OCR缓存键"""
+        return (f"{self.max_long_edge}:{int(self.grayscale)}:{int(self.autocontrast)}"
+                f":{self.output_format}:{self.quality}")
+
+    def process(self, image_bytes):
+        """返回 (上传用的字节, media_type)"""
+        data, media_type = self._process(io.BytesIO(image_bytes), len(image_bytes))
+        if data is None:
+            data = image_bytes
+        if media_type is None:
+            media_type = detect_media_type(image_bytes)
+        return data, media_type
+
+    def process_file(self, image_path):
+        """返回 (重新编码的字节或None, media_type)
+
+        None 表示应直接上传原文件 (可按块流式读取, 不必整个载入内存)。
+        """
+        data, media_type = self._process(image_path, os.path.getsize(image_path))
+        if media_type is None:
+            with open(image_path, 'rb') as image_file:
+                media_type = detect_media_type(image_file.read(16))
+        return data, media_type
+
+    def _process(self, source, original_size):
+        processed = None
+        if Image is not None:
+            try:
+                processed = self._reencode(source, original_size)
+            except Exception as e:
+                print(f"⚠️ 图像预处理失败，使用原图: {e}")
+        data, media_type = processed or (None, None)
+
+        with self._stats_lock:
+            self.stats['images'] += 1
+            self.stats['bytes_in'] += original_size
+            self.stats['bytes_out'] += original_size if data is None else len(data)
+        return data, media_type
+
+    def _reencode(self, source, original_size):
+        with Image.open(source) as original:
+            # 0x0112 = EXIF Orientation, 1 = already upright
+            changed = original.getexif().get(0x0112, 1) != 1
+            width, height = original.size
+            scale = self.max_long_edge / max(width, height)
+            if scale < 1:
+                # Let the JPEG decoder skip detail we would throw away (1/2..1/8 DCT scaling)
+                original.draft(original.mode, (int(width * scale) + 1, int(height * scale) + 1))
+            image = ImageOps.exif_transpose(original)
+            if max(image.size) > self.max_long_edge:
+                image.thumbnail((self.max_long_edge, self.max_long_edge), Image.LANCZOS)
+                changed = True
+            elif scale < 1:
+                changed = True
+
+            if self.grayscale:
+                image = image.convert('L')
+                changed = True
+            elif image.mode not in ('RGB', 'L'):
+                # JPEG has no alpha: flatten transparent scans onto white paper
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                rgba = image.convert('RGBA')
+                background.paste(rgba, mask=rgba.split()[-1])
+                image = background
+            if self.autocontrast:
+                image = ImageOps.autocontrast(image, cutoff=1)
+                changed = True
+
+            output = io.BytesIO()
+            image.save(output, format=self.output_format, quality=self.quality, optimize=True)
+            data = output.getvalue()
+
+        # Re-encoding an already small, upright photo can make it bigger
+        if not changed and len(data) >= original_size:
+            return None
+        return data, MEDIA_TYPES[self.output_format]
@@ -43,9 +43,11 @@ except Exception:
     camera = None
     filechooser = None
 import os
-import threading
-import sqlite3
 from database import DatabaseManager
+from table_merge import merge_tables
+from column_mapping import (FIELDS, build_items, guess_mapping, header_signature,
+                            parse_price, parse_quantity)
+from ocr_queue import OCRJobQueue
 try:
     # Usar la versión directa HTTP (compatible con Android)
     from ocr_processor_direct import OCRProcessor, OCRConfig
@@ -145,11 +147,22 @@ class DeliveryNotesScreen(MDScreen):
         toolbar = MDTopAppBar(
             title="送货单管理",
             left_action_items=[["arrow-left", lambda x: self.go_back()]],
-            right_action_items=[["plus", lambda x: self.create_new_delivery_note()]],
+            right_action_items=[
+                ["archive-arrow-down", lambda x: self.archive_delivery_notes()],
+                ["plus", lambda x: self.create_new_delivery_note()]
+            ],
             elevation=2,
         )
         main_layout.add_widget(toolbar)
         
+        # Archived notes live in archive.db; the list below only shows hot ones
+        self.archived_button = MDFlatButton(
+            text="已归档: 0",
+            size_hint_x=1,
+        )
+        self.archived_button.bind(on_release=lambda x: self.show_archived_delivery_notes())
+        main_layout.add_widget(self.archived_button)
+        
         # Delivery note list
         self.delivery_list = MDList()
         scroll = MDScrollView()
@@ -202,6 +215,7 @@ class DeliveryNotesScreen(MDScreen):
     def refresh_delivery_notes(self):
         self.delivery_list.clear_widgets()
         notes = self.db.get_delivery_notes()
+        self.archived_button.text = f"已归档: {self.db.count_archived_delivery_notes()}"
         
         for note in notes:
             # Create a card with delivery note info and delete button
@@ -212,7 +226,7 @@ class DeliveryNotesScreen(MDScreen):
                 spacing=10,
                 elevation=2
             )
-            card.bind(on_release=lambda x, note_id=note[0]: self.open_delivery_note(note_id))
+            card.bind(on_release=lambda x, note_id=note.id: self.open_delivery_note(note_id))
             
             # Horizontal layout for content and delete button
             content_layout = MDBoxLayout(orientation='horizontal', spacing=10)
@@ -220,19 +234,19 @@ class DeliveryNotesScreen(MDScreen):
             # Info layout (left side)
             info_layout = MDBoxLayout(orientation='vertical', size_hint_x=0.85)
             info_layout.add_widget(MDLabel(
-                text=note[1], 
+                text=note.name, 
                 theme_text_color="Primary",
                 font_style="H6",
                 size_hint_y=0.4
             ))
             info_layout.add_widget(MDLabel(
-                text=f"创建时间: {note[2]}",
+                text=f"创建时间: {note.date_created}",
                 theme_text_color="Secondary", 
                 font_style="Caption",
                 size_hint_y=0.3
             ))
             info_layout.add_widget(MDLabel(
-                text=f"商品数量: {note[3]}",
+                text=f"商品数量: {note.total_items} | 已检查: {note.checked_correct + note.checked_incorrect}/{note.total_items} (错误 {note.checked_incorrect})",
                 theme_text_color="Secondary",
                 font_style="Caption", 
                 size_hint_y=0.3
@@ -245,13 +259,101 @@ class DeliveryNotesScreen(MDScreen):
                 theme_icon_color="Custom",
                 icon_color=[1, 0.2, 0.2, 1]
             )
-            delete_btn.bind(on_release=lambda x, note_id=note[0]: self.delete_delivery_note(note_id))
+            delete_btn.bind(on_release=lambda x, note_id=note.id: self.delete_delivery_note(note_id))
             
             content_layout.add_widget(info_layout)
             content_layout.add_widget(delete_btn)
             card.add_widget(content_layout)
             self.delivery_list.add_widget(card)
     
+    def archive_delivery_notes(self):
+        """把已核对完或过旧的送货单移入归档库"""
+        try:
+            count = self.db.archive_delivery_notes()
+        except Exception as e:
+            print(f"归档送货单时出错: {e}")
+            return
+        self.refresh_delivery_notes()
+        
+        dialog = MDDialog(
+            title="归档完成",
+            text=f"已归档 {count} 张送货单",
+            buttons=[MDFlatButton(text="确定")],
+        )
+        dialog.buttons[0].bind(on_release=lambda x: dialog.dismiss())
+        dialog.open()
+    
+    def show_archived_delivery_notes(self):
+        """列出归档的送货单, 可按名称或条码搜索, 点击导出"""
+        content = MDBoxLayout(orientation='vertical', size_hint_y=None, height=460)
+        search_field = MDTextField(
+            hint_text="按名称或条码搜索",
+            helper_text="输入后按回车",
+            helper_text_mode="on_focus",
+            size_hint_y=None,
+            height=60,
+        )
+        archived_list = MDList()
+        scroll = MDScrollView()
+        scroll.add_widget(archived_list)
+        content.add_widget(search_field)
+        content.add_widget(scroll)
+        
+        dialog = MDDialog(
+            title="已归档送货单",
+            type="custom",
+            content_cls=content,
+            buttons=[MDFlatButton(text="关闭")],
+        )
+        search_field.bind(
+            on_text_validate=lambda x: self.fill_archived_list(archived_list, x.text.strip(), dialog)
+        )
+        self.fill_archived_list(archived_list, '', dialog)
+        dialog.buttons[0].bind(on_release=lambda x: dialog.dismiss())
+        dialog.open()
+    
+    def fill_archived_list(self, archived_list, query, dialog):
+        """名称包含 query 的归档送货单，以及条码为 query 的归档商品"""
+        archived_list.clear_widgets()
+        notes = self.db.get_archived_delivery_notes(name_query=query or None)
+        for note in notes:
+            archived_list.add_widget(ThreeLineListItem(
+                text=note.name,
+                secondary_text=f"创建时间: {note.date_created}",
+                tertiary_text=f"商品数量: {note.total_items} | 错误 {note.checked_incorrect} | 点击导出",
+                on_release=lambda x, note_id=note.id: self.export_archived_delivery_note(note_id, dialog)
+            ))
+        
+        items = self.db.search_archived_items_by_barcode(query) if query else []
+        note_names = {}
+        status_map = {'correct': '正确', 'incorrect': '错误', 'unchecked': '未检查'}
+        for item in items:
+            if item.delivery_note_id not in note_names:
+                note = self.db.get_delivery_note_by_id(item.delivery_note_id)
+                note_names[item.delivery_note_id] = note.name if note else str(item.delivery_note_id)
+            archived_list.add_widget(ThreeLineListItem(
+                text=item.name,
+                secondary_text=f"条码: {item.barcode} | 送货单: {note_names[item.delivery_note_id]}",
+                tertiary_text=f"状态: {status_map.get(item.status, item.status)} | 点击导出送货单",
+                on_release=lambda x, note_id=item.delivery_note_id:
+                    self.export_archived_delivery_note(note_id, dialog)
+            ))
+        
+        if not notes and not items:
+            archived_list.add_widget(OneLineListItem(text="没有匹配的归档送货单"))
+    
+    def export_archived_delivery_note(self, note_id, dialog):
+        dialog.dismiss()
+        filename = self.db.export_delivery_note_to_excel(note_id)
+        
+        result_dialog = MDDialog(
+            title="导出成功" if filename else "导出失败",
+            text=f"送货单已导出到: {filename}" if filename else "无法导出此送货单",
+            buttons=[MDFlatButton(text="确定")],
+        )
+        result_dialog.buttons[0].bind(on_release=lambda x: result_dialog.dismiss())
+        result_dialog.open()
+    
     def open_delivery_note(self, note_id):
         app = App.get_running_app()
         app.current_delivery_note_id = note_id
@@ -282,12 +384,8 @@ class DeliveryNotesScreen(MDScreen):
     def confirm_delete(self, note_id, dialog):
         """执行实际删除"""
         try:
-            # Delete associated items first
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM items WHERE delivery_note_id = ?", (note_id,))
-                cursor.execute("DELETE FROM delivery_notes WHERE id = ?", (note_id,))
-                conn.commit()
+            # Deletes associated items and the note in one transaction
+            self.db.delete_delivery_note(note_id)
             
             self.refresh_delivery_notes()
             dialog.dismiss()
@@ -296,6 +394,9 @@ class DeliveryNotesScreen(MDScreen):
             dialog.dismiss()
 
 class DeliveryDetailScreen(MDScreen):
+    # Items rendered per page of the keyset-paginated list
+    ITEMS_PAGE_SIZE = 50
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = 'delivery_detail'
@@ -309,6 +410,7 @@ class DeliveryDetailScreen(MDScreen):
             left_action_items=[["arrow-left", lambda x: self.go_back()]],
             right_action_items=[
                 ["camera", lambda x: self.scan_delivery_note()],
+                ["table-edit", lambda x: self.remap_columns()],
                 ["file-excel", lambda x: self.export_to_excel()]
             ],
             elevation=2,
@@ -339,6 +441,8 @@ class DeliveryDetailScreen(MDScreen):
         self.items_list = MDList(padding=[0, 0, 0, 70])
         scroll = MDScrollView(size_hint=(1, 1))
         scroll.add_widget(self.items_list)
+        # Load the next page of items when the list nears the bottom
+        scroll.bind(scroll_y=self.on_items_scroll)
 
         # Floating scan button overlaid at the bottom of the list
         from kivy.uix.floatlayout import FloatLayout
@@ -361,6 +465,11 @@ class DeliveryDetailScreen(MDScreen):
         # Initialize variables
         self.photo_count = 0
         self.collected_images = []
+        # Keyset pagination state for the items list
+        self.items_cursor = None
+        self.highlight_item_id = None
+        # item_id -> status button, so toggles update in place
+        self.item_status_buttons = {}
     
     @property
     def db(self):
@@ -372,8 +481,16 @@ class DeliveryDetailScreen(MDScreen):
         self.photo_count = 0
         self.collected_images = []
         self.refresh_items()
+        
+        # Barcode scans of this note are answered from memory
+        delivery_note_id = getattr(App.get_running_app(), 'current_delivery_note_id', None)
+        if delivery_note_id:
+            self.db.open_barcode_index(delivery_note_id)
+            # OCR that finished while the clerk was elsewhere (or before a restart)
+            self.offer_ocr_results(delivery_note_id)
     
     def go_back(self):
+        self.db.close_barcode_index()
         self.manager.current = 'delivery_notes'
     
     def show_loading(self, show=True):
@@ -386,6 +503,11 @@ class DeliveryDetailScreen(MDScreen):
             self.loading_spinner.active = False
     
     def scan_delivery_note(self):
+        # Open the API connection while the user takes photos
+        processor = App.get_running_app().image_processor
+        if processor is not None and hasattr(processor, 'warm_up'):
+            processor.warm_up()
+        
         # Select image source
         content = MDBoxLayout(
             orientation='vertical',
@@ -534,6 +656,9 @@ class DeliveryDetailScreen(MDScreen):
             dialog.open()
             return
         
+        delivery_note_id = app.current_delivery_note_id
+        # A new batch may open the mapping screen again
+        app.root.get_screen('column_mapping').streaming_abandoned = False
         self.show_loading(True)
         
         def progress_callback(current, total, message):
@@ -542,30 +667,256 @@ class DeliveryDetailScreen(MDScreen):
                 self.loading_label.text = f"{message}\n({current}/{total})"
             Clock.schedule_once(update_ui, 0)
         
-        def process_ocr():
-            try:
-                extracted_data = app.image_processor.extract_delivery_note_data(
-                    image_paths, 
-                    progress_callback=progress_callback
-                )
-                
-                # Schedule UI update on main thread
-                Clock.schedule_once(lambda dt: self.show_column_mapping(extracted_data), 0)
-                Clock.schedule_once(lambda dt: self.show_loading(False), 0)
-                
-            except Exception as e:
-                print(f"OCR处理错误: {e}")
-                Clock.schedule_once(lambda dt: self.show_loading(False), 0)
-                # Mostrar error en la UI
-                def show_error(dt):
-                    self.loading_label.text = f"处理失败: {str(e)}"
-                Clock.schedule_once(show_error, 0)
-        
-        threading.Thread(target=process_ocr).start()
-    
-    def show_column_mapping(self, extracted_data):
-        """显示列映射对话框"""
-        if not extracted_data:
+        def row_callback(page, headers, rows):
+            """新识别出的行 - 第一页的行立即显示在列映射界面"""
+            if page == 1:
+                rows = list(rows)
+                def show_rows(dt):
+                    if self.is_showing_note(delivery_note_id):
+                        self.show_streaming_rows(headers, rows)
+                Clock.schedule_once(show_rows, 0)
+        
+        def done_callback(batch_id, tables):
+            Clock.schedule_once(lambda dt: self.on_ocr_done(delivery_note_id, batch_id, tables), 0)
+        
+        # Queued in SQLite: survives network loss and the app being killed
+        try:
+            app.ocr_queue.enqueue(
+                delivery_note_id,
+                image_paths,
+                progress_callback=progress_callback,
+                row_callback=row_callback,
+                done_callback=done_callback
+            )
+        except Exception as e:
+            print(f"OCR处理错误: {e}")
+            self.show_loading(False)
+            self.loading_label.text = f"处理失败: {str(e)}"
+    
+    def is_showing_note(self, delivery_note_id):
+        """用户是否仍在查看这个送货单 (详情或列映射界面)"""
+        app = App.get_running_app()
+        return (getattr(app, 'current_delivery_note_id', None) == delivery_note_id
+                and self.manager.current in ('delivery_detail', 'column_mapping'))
+    
+    def on_ocr_done(self, delivery_note_id, batch_id, tables):
+        """队列处理完一批: 用户还在这个送货单时直接打开列映射，否则下次进入时再提示
+
+        用户在识别过程中离开了列映射界面时，改为提示导入或丢弃。
+        """
+        self.show_loading(False)
+        mapping_screen = App.get_running_app().root.get_screen('column_mapping')
+        abandoned = mapping_screen.streaming_abandoned
+        mapping_screen.streaming_abandoned = False
+        if not self.is_showing_note(delivery_note_id):
+            return
+        if abandoned:
+            self.offer_ocr_results(delivery_note_id)
+        elif not tables and not mapping_screen.streaming:
+            self.report_failed_batches([batch_id])
+        else:
+            self.show_column_mapping(tables, batch_id)
+    
+    def offer_ocr_results(self, delivery_note_id):
+        """提示导入已识别完但尚未导入的批次"""
+        app = App.get_running_app()
+        queue = getattr(app, 'ocr_queue', None)
+        if queue is None:
+            return
+        batch_ids = self.db.get_finished_ocr_batches(delivery_note_id)
+        queued = self.db.count_queued_ocr_jobs(delivery_note_id)
+        if queued:
+            self.loading_label.text = f"OCR队列中还有 {queued} 张图像"
+        if not batch_ids:
+            return
+        # Every page failed or had no table: nothing to import, say why and drop it
+        failed = [batch_id for batch_id in batch_ids if not self.db.get_ocr_batch_tables(batch_id)]
+        if failed:
+            self.report_failed_batches(failed, then=lambda: self.offer_ocr_results(delivery_note_id))
+            return
+        batch_id = batch_ids[0]
+        jobs = self.db.get_ocr_batch(batch_id)
+        recognized = sum(1 for job in jobs if job.state == 'done')
+        
+        dialog = MDDialog(
+            title="识别结果待导入",
+            text=f"{len(jobs)} 张图像中有 {recognized} 张已识别完成，是否现在导入？",
+            buttons=[
+                MDFlatButton(text="丢弃"),
+                MDRaisedButton(text="导入"),
+            ],
+        )
+        
+        def discard(*args):
+            dialog.dismiss()
+            queue.discard_batch(batch_id)
+        
+        def open_mapping(*args):
+            dialog.dismiss()
+            self.show_column_mapping(self.db.get_ocr_batch_tables(batch_id), batch_id)
+        
+        dialog.buttons[0].bind(on_release=discard)
+        dialog.buttons[1].bind(on_release=open_mapping)
+        dialog.open()
+    
+    def report_failed_batches(self, batch_ids, then=None):
+        """没有识别出任何表格的批次: 显示失败原因并从队列中删除，关闭提示后调用 then()"""
+        app = App.get_running_app()
+        pages = 0
+        errors = []
+        for batch_id in batch_ids:
+            for job in self.db.get_ocr_batch(batch_id):
+                pages += 1
+                if job.error and job.error not in errors:
+                    errors.append(job.error)
+            app.ocr_queue.discard_batch(batch_id)
+        
+        text = f"{pages} 张图像都没有识别出表格，请重新拍照。"
+        if errors:
+            text += "\n" + "\n".join(error[:120] for error in errors[:3])
+        dialog = MDDialog(
+            title="识别失败",
+            text=text,
+            buttons=[
+                MDFlatButton(text="确定"),
+            ],
+        )
+        
+        def close(*args):
+            dialog.dismiss()
+            if then:
+                then()
+        
+        dialog.buttons[0].bind(on_release=close)
+        dialog.open()
+    
+    def show_streaming_rows(self, headers, rows):
+        """在识别过程中打开列映射界面并追加新行"""
+        app = App.get_running_app()
+        mapping_screen = app.root.get_screen('column_mapping')
+        if mapping_screen.streaming:
+            mapping_screen.append_rows(rows)
+            return
+        if mapping_screen.streaming_abandoned:
+            # The clerk left the mapping screen: the result is offered when OCR finishes
+            return
+        if self.db.get_mapping_profile(header_signature(headers)) is not None:
+            # Known supplier layout: it will be imported without the mapping screen
+            return
+        # First rows of the page: start mapping while the rest is still arriving
+        self.show_loading(False)
+        mapping_screen.setup_mapping(headers, rows, streaming=True)
+        self.manager.current = 'column_mapping'
+    
+    def auto_import(self, table_data, ocr_batch_id=None):
+        """表头格式已有保存的映射时直接导入，返回是否已导入"""
+        app = App.get_running_app()
+        delivery_note_id = getattr(app, 'current_delivery_note_id', None)
+        headers = table_data['headers']
+        signature = header_signature(headers)
+        mapping = self.db.get_mapping_profile(signature)
+        if not delivery_note_id or mapping is None:
+            return False
+        
+        items, invalid_rows = build_items(table_data['rows'], mapping)
+        item_ids, image_paths = self.db.import_ocr_batch(
+            delivery_note_id, items, ocr_batch_id, profile=(signature, headers, mapping)
+        )
+        imported_count = len(item_ids)
+        if ocr_batch_id is not None:
+            app.ocr_queue.forget_batch(ocr_batch_id, image_paths)
+        self.refresh_items()
+        
+        dialog = MDDialog(
+            title="导入成功",
+            text="已按保存的列映射自动导入。\n" + import_summary(imported_count, invalid_rows),
+            buttons=[
+                MDFlatButton(text="忘记此格式"),
+                MDFlatButton(text="修改映射"),
+                MDRaisedButton(text="确定"),
+            ],
+        )
+        
+        def forget_layout(*args):
+            # A wrongly learned layout: stop auto-importing it, even if the clerk backs out below
+            self.db.delete_mapping_profile(signature)
+            change_mapping()
+        
+        def change_mapping(*args):
+            dialog.dismiss()
+            # The layout stays remembered until the clerk confirms a different mapping
+            self.remap_columns()
+        
+        dialog.buttons[0].bind(on_release=forget_layout)
+        dialog.buttons[1].bind(on_release=change_mapping)
+        dialog.buttons[2].bind(on_release=lambda x: dialog.dismiss())
+        dialog.open()
+        return True
+    
+    def remap_columns(self):
+        """用保存的原始识别表格重新映射列 (不再调用API)，替换送货单的全部商品"""
+        app = App.get_running_app()
+        delivery_note_id = getattr(app, 'current_delivery_note_id', None)
+        if not delivery_note_id:
+            return
+        tables = self.db.get_ocr_tables(delivery_note_id)
+        if not tables:
+            dialog = MDDialog(
+                title="无法重新映射",
+                text="此送货单没有保存的识别结果。",
+                buttons=[MDFlatButton(text="确定")],
+            )
+            dialog.buttons[0].bind(on_release=lambda x: dialog.dismiss())
+            dialog.open()
+            return
+        
+        note = self.db.get_delivery_note_by_id(delivery_note_id)
+        dialog = MDDialog(
+            title="重新映射列",
+            text=f"将用 {len(tables)} 页识别结果重新导入，替换此送货单现有的 "
+                 f"{note.total_items if note else 0} 个商品 (核对状态会被清除)。",
+            buttons=[
+                MDFlatButton(text="取消"),
+                MDRaisedButton(text="重新映射"),
+            ],
+        )
+        
+        def open_mapping(*args):
+            dialog.dismiss()
+            self.show_column_mapping(tables, replace_items=True)
+        
+        dialog.buttons[0].bind(on_release=lambda x: dialog.dismiss())
+        dialog.buttons[1].bind(on_release=open_mapping)
+        dialog.open()
+    
+    def show_column_mapping(self, extracted_data, ocr_batch_id=None, replace_items=False):
+        """显示列映射对话框 (所有页合并为一个表格)
+
+        replace_items=True 时导入替换送货单的全部商品 (重新映射)。
+        """
+        app = App.get_running_app()
+        mapping_screen = app.root.get_screen('column_mapping')
+        # Deleted from the OCR queue once its rows are imported
+        mapping_screen.ocr_batch_id = ocr_batch_id
+        mapping_screen.replace_items = replace_items
+        table_data = merge_tables(extracted_data or [])
+        if table_data and table_data['pages'] > 1:
+            print(f"📄 合并 {table_data['pages']} 页: {len(table_data['rows'])} 行，"
+                  f"去掉表头行 {table_data['dropped_header_rows']} 个、"
+                  f"重复行 {table_data['dropped_duplicates']} 个")
+        # Known layout and the clerk is not already mapping it by hand: import straight away
+        if (table_data and table_data['rows'] and not replace_items and not mapping_screen.streaming
+                and self.auto_import(table_data, ocr_batch_id)):
+            return
+        if mapping_screen.streaming:
+            # Keep the clerk's column choices, just swap in the final rows
+            if table_data:
+                mapping_screen.finish_streaming(table_data['headers'], table_data['rows'])
+            else:
+                mapping_screen.finish_streaming()
+            return
+        
+        if not table_data:
             dialog = MDDialog(
                 title="未找到数据",
                 text="无法从图像中提取表格数据。",
@@ -579,10 +930,8 @@ class DeliveryDetailScreen(MDScreen):
             dialog.open()
             return
         
-        # Use first extracted table
-        table_data = extracted_data[0]
-        headers = table_data.get('headers', [])
-        rows = table_data.get('rows', [])
+        headers = table_data['headers']
+        rows = table_data['rows']
         
         if not headers or not rows:
             dialog = MDDialog(
@@ -599,87 +948,107 @@ class DeliveryDetailScreen(MDScreen):
             return
         
         # Show column mapping screen
-        app = App.get_running_app()
-        mapping_screen = app.root.get_screen('column_mapping')
         mapping_screen.setup_mapping(headers, rows)
         self.manager.current = 'column_mapping'
     
     def refresh_items(self, highlight_item_id=None):
+        """重新加载商品列表的第一页"""
         self.items_list.clear_widgets()
+        self.item_status_buttons = {}
+        self.items_cursor = None
+        self.highlight_item_id = highlight_item_id
+        self.load_more_items()
+    
+    def load_more_items(self):
+        """加载下一页商品"""
         app = App.get_running_app()
         delivery_note_id = getattr(app, 'current_delivery_note_id', None)
         
         if delivery_note_id:
             try:
-                items = self.db.get_items_by_delivery_note(delivery_note_id)
-                
+                items, self.items_cursor = self.db.get_items_page(
+                    delivery_note_id,
+                    page_size=self.ITEMS_PAGE_SIZE,
+                    cursor=self.items_cursor
+                )
                 for item in items:
-                    # Create item card
-                    card = MDCard(
-                        padding=10,
-                        size_hint_y=None,
-                        height=100,
-                        spacing=5,
-                        elevation=1 if item[0] == highlight_item_id else 0,
-                    )
-                    if item[0] == highlight_item_id:
-                        card.md_bg_color = [0.9, 1, 0.9, 1]
-                    
-                    content = MDBoxLayout(
-                        orientation='horizontal',
-                        spacing=10
-                    )
-                    
-                    # Item info
-                    info_layout = MDBoxLayout(orientation='vertical', size_hint_x=0.7)
-                    info_layout.add_widget(MDLabel(
-                        text=f"商品: {item[3]}", 
-                        theme_text_color="Primary",
-                        font_style="Subtitle2"
-                    ))
-                    info_layout.add_widget(MDLabel(
-                        text=f"条码: {item[2] or '未知'}", 
-                        theme_text_color="Secondary",
-                        font_style="Caption"
-                    ))
-                    info_layout.add_widget(MDLabel(
-                        text=f"数量: {item[5]} | 价格: ¥{item[4]:.2f}",
-                        theme_text_color="Secondary",
-                        font_style="Caption"
-                    ))
-                    
-                    # Status and actions
-                    actions_layout = MDBoxLayout(orientation='vertical', size_hint_x=0.3, spacing=5)
-                    
-                    status_color = [0, 0.8, 0, 1] if item[6] == 'correct' else ([0.8, 0, 0, 1] if item[6] == 'incorrect' else [0.5, 0.5, 0.5, 1])
-                    status_text = "正确" if item[6] == 'correct' else ("错误" if item[6] == 'incorrect' else "未检查")
-                    
-                    status_btn = MDRaisedButton(
-                        text=status_text,
-                        size_hint_y=None,
-                        height=30,
-                        md_bg_color=status_color
-                    )
-                    status_btn.bind(on_release=lambda x, item_id=item[0]: self.toggle_item_status(item_id))
-                    
-                    scan_btn = MDIconButton(
-                        icon="barcode-scan",
-                        size_hint_y=None,
-                        height=30
-                    )
-                    scan_btn.bind(on_release=lambda x, item_id=item[0]: self.scan_item_barcode(item_id))
-                    
-                    actions_layout.add_widget(status_btn)
-                    actions_layout.add_widget(scan_btn)
-                    
-                    content.add_widget(info_layout)
-                    content.add_widget(actions_layout)
-                    card.add_widget(content)
-                    self.items_list.add_widget(card)
+                    self.items_list.add_widget(self.build_item_card(item))
                     
             except Exception as e:
                 print(f"刷新商品列表时出错: {e}")
     
+    def on_items_scroll(self, scroll, scroll_y):
+        # scroll_y is 1 at the top and 0 at the bottom
+        if self.items_cursor is not None and scroll_y <= 0.1:
+            self.load_more_items()
+    
+    def build_item_card(self, item):
+        """创建商品卡片"""
+        highlight_item_id = self.highlight_item_id
+        card = MDCard(
+            padding=10,
+            size_hint_y=None,
+            height=100,
+            spacing=5,
+            elevation=1 if item.id == highlight_item_id else 0,
+        )
+        if item.id == highlight_item_id:
+            card.md_bg_color = [0.9, 1, 0.9, 1]
+        
+        content = MDBoxLayout(
+            orientation='horizontal',
+            spacing=10
+        )
+        
+        # Item info
+        info_layout = MDBoxLayout(orientation='vertical', size_hint_x=0.7)
+        info_layout.add_widget(MDLabel(
+            text=f"商品: {item.name}", 
+            theme_text_color="Primary",
+            font_style="Subtitle2"
+        ))
+        info_layout.add_widget(MDLabel(
+            text=f"条码: {item.barcode or '未知'}", 
+            theme_text_color="Secondary",
+            font_style="Caption"
+        ))
+        info_layout.add_widget(MDLabel(
+            text=f"数量: {item.quantity} | 价格: ¥{item.unit_price:.2f}",
+            theme_text_color="Secondary",
+            font_style="Caption"
+        ))
+        
+        # Status and actions
+        actions_layout = MDBoxLayout(orientation='vertical', size_hint_x=0.3, spacing=5)
+        
+        status_btn = MDRaisedButton(
+            size_hint_y=None,
+            height=30
+        )
+        self.apply_status_style(status_btn, item.status)
+        status_btn.bind(on_release=lambda x, item_id=item.id: self.toggle_item_status(item_id))
+        self.item_status_buttons[item.id] = status_btn
+        
+        scan_btn = MDIconButton(
+            icon="barcode-scan",
+            size_hint_y=None,
+            height=30
+        )
+        scan_btn.bind(on_release=lambda x, item_id=item.id: self.scan_item_barcode(item_id))
+        
+        actions_layout.add_widget(status_btn)
+        actions_layout.add_widget(scan_btn)
+        
+        content.add_widget(info_layout)
+        content.add_widget(actions_layout)
+        card.add_widget(content)
+        return card
+    
+    def apply_status_style(self, status_btn, status):
+        """按状态设置按钮文字和颜色"""
+        status_btn.md_bg_color = [0, 0.8, 0, 1] if status == 'correct' else ([0.8, 0, 0, 1] if status == 'incorrect' else [0.5, 0.5, 0.5, 1])
+        status_btn.text = "正确" if status == 'correct' else ("错误" if status == 'incorrect' else "未检查")
+    
     def toggle_item_status(self, item_id):
         """切换商品状态"""
         current_status = self.db.get_item_status(item_id)
@@ -691,8 +1060,13 @@ class DeliveryDetailScreen(MDScreen):
         else:
             new_status = 'unchecked'
         
-        self.db.update_item_status(item_id, new_status)
-        self.refresh_items()
+        # Committed by the background writer; only this card needs redrawing
+        self.db.queue_item_status(item_id, new_status)
+        status_btn = self.item_status_buttons.get(item_id)
+        if status_btn is not None:
+            self.apply_status_style(status_btn, new_status)
+        else:
+            self.refresh_items()
     
     def scan_item_barcode(self, item_id):
         """扫描商品条码 (per-item: assigns barcode to a specific item)"""
@@ -732,12 +1106,33 @@ class DeliveryDetailScreen(MDScreen):
         except Exception as e:
             print(f"导出失败: {e}")
 
+# Spinner labels of the item fields
+FIELD_LABELS = {'barcode': '条码', 'name': '商品名称', 'unit_price': '单价', 'quantity': '数量'}
+LABEL_FIELDS = {label: field for field, label in FIELD_LABELS.items()}
+
+
+def import_summary(imported_count, invalid_rows):
+    """导入成功对话框的文字"""
+    text = f"成功导入 {imported_count} 个商品。"
+    if invalid_rows:
+        text += f"\n{len(invalid_rows)} 行的价格或数量无法识别，已按 0 / 1 导入，请核对。"
+    return text
+
+
 class ColumnMappingScreen(MDScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = 'column_mapping'
         self.headers = []
         self.rows = []
+        # True while OCR is still streaming rows into this screen
+        self.streaming = False
+        # OCR queue batch these rows came from
+        self.ocr_batch_id = None
+        # Re-mapping stored tables: import replaces the note's items
+        self.replace_items = False
+        # Left while rows were still streaming: later rows are not shown here
+        self.streaming_abandoned = False
         
         # Main layout
         main_layout = MDBoxLayout(orientation='vertical')
@@ -761,16 +1156,26 @@ class ColumnMappingScreen(MDScreen):
         pass
     
     def go_back(self):
+        abandoned = self.streaming
+        # Nothing of this mapping carries over to the next table shown here
+        self.streaming = False
+        self.ocr_batch_id = None
+        self.replace_items = False
         self.manager.current = 'delivery_detail'
+        if abandoned:
+            self.streaming_abandoned = True
+            # OCR is still running: keep its progress visible until on_ocr_done
+            self.manager.get_screen('delivery_detail').show_loading(True)
     
-    def setup_mapping(self, headers, rows):
-        """设置列映射界面"""
+    def setup_mapping(self, headers, rows, streaming=False):
+        """设置列映射界面 (streaming=True 时导入按钮在识别结束前不可用)"""
         # Clear previous data to avoid persistence
         self.headers = []
         self.rows = []
         
         self.headers = headers
-        self.rows = rows
+        self.rows = list(rows)
+        self.streaming = streaming
         
         layout = MDBoxLayout(
             orientation='vertical',
@@ -796,18 +1201,22 @@ class ColumnMappingScreen(MDScreen):
             font_style="Caption"
         ))
         
-        if rows:
-            sample_text = " | ".join(str(cell)[:20] for cell in rows[0][:3])
-            sample_layout.add_widget(MDLabel(
-                text=sample_text,
-                theme_text_color="Secondary",
-                font_style="Caption"
-            ))
+        sample_text = " | ".join(str(cell)[:20] for cell in rows[0][:3]) if rows else ""
+        self.sample_label = MDLabel(
+            text=sample_text,
+            theme_text_color="Secondary",
+            font_style="Caption"
+        )
+        sample_layout.add_widget(self.sample_label)
         
         layout.add_widget(sample_layout)
         
         # Mapping controls
         self.mapping_controls = {}
+        mapping = App.get_running_app().db.get_mapping_profile(header_signature(headers))
+        if mapping is None:
+            mapping = guess_mapping(headers)
+        column_fields = {column: field for field, column in mapping.items()}
         
         for i, header in enumerate(headers):
             control_layout = MDBoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height=60)
@@ -822,21 +1231,15 @@ class ColumnMappingScreen(MDScreen):
             # Mapping dropdown
             mapping_spinner = Spinner(
                 text='选择字段',
-                values=['条码', '商品名称', '单价', '数量', '忽略'],
+                values=[FIELD_LABELS[field] for field in FIELDS] + ['忽略'],
                 size_hint_x=0.6,
                 height=40
             )
             
-            # Auto-detect mapping based on header content
-            header_lower = header.lower()
-            if any(keyword in header_lower for keyword in ['código', 'code', 'barcode', '条码', 'referencia']):
-                mapping_spinner.text = '条码'
-            elif any(keyword in header_lower for keyword in ['nombre', 'name', 'product', '产品', '商品', 'producto']):
-                mapping_spinner.text = '商品名称'
-            elif any(keyword in header_lower for keyword in ['precio', 'price', 'cost', '价格']):
-                mapping_spinner.text = '单价'
-            elif any(keyword in header_lower for keyword in ['cantidad', 'quantity', 'qty', '数量']):
-                mapping_spinner.text = '数量'
+            # Saved profile for this layout, otherwise the keyword guess
+            field = column_fields.get(i)
+            if field is not None:
+                mapping_spinner.text = FIELD_LABELS[field]
             
             self.mapping_controls[i] = mapping_spinner
             
@@ -845,17 +1248,44 @@ class ColumnMappingScreen(MDScreen):
             layout.add_widget(control_layout)
         
         # Import button
-        import_btn = MDRaisedButton(
+        self.import_btn = MDRaisedButton(
             text="导入数据",
             size_hint_y=None,
             height=50
         )
-        import_btn.bind(on_release=self.import_mapped_data)
-        layout.add_widget(import_btn)
+        self.import_btn.bind(on_release=self.import_mapped_data)
+        self._update_import_button()
+        layout.add_widget(self.import_btn)
         
         self.content.clear_widgets()
         self.content.add_widget(layout)
     
+    def append_rows(self, rows):
+        """识别过程中追加新到达的行"""
+        if not self.rows and rows:
+            self.sample_label.text = " | ".join(str(cell)[:20] for cell in rows[0][:3])
+        self.rows.extend(rows)
+        self._update_import_button()
+    
+    def finish_streaming(self, headers=None, rows=None):
+        """识别结束: 用最终结果替换行并启用导入 (headers=None 保留已收到的行)"""
+        if headers is not None and list(headers) != list(self.headers):
+            # The final parse disagrees on the columns: rebuild the mapping
+            self.setup_mapping(headers, rows or [])
+            return
+        if rows is not None:
+            self.rows = list(rows)
+        self.streaming = False
+        self._update_import_button()
+    
+    def _update_import_button(self):
+        if self.streaming:
+            self.import_btn.text = f"识别中... 已收到 {len(self.rows)} 行"
+            self.import_btn.disabled = True
+        else:
+            self.import_btn.text = "导入数据"
+            self.import_btn.disabled = False
+    
     def import_mapped_data(self, instance):
         """导入映射的数据"""
         try:
@@ -868,46 +1298,29 @@ class ColumnMappingScreen(MDScreen):
             # Build mapping
             field_mapping = {}
             for col_index, spinner in self.mapping_controls.items():
-                field_name = spinner.text
-                if field_name != '忽略' and field_name != '选择字段':
-                    if field_name == '条码':
-                        field_mapping['barcode'] = col_index
-                    elif field_name == '商品名称':
-                        field_mapping['name'] = col_index
-                    elif field_name == '单价':
-                        field_mapping['unit_price'] = col_index
-                    elif field_name == '数量':
-                        field_mapping['quantity'] = col_index
+                field = LABEL_FIELDS.get(spinner.text)
+                if field is not None:
+                    field_mapping[field] = col_index
             
-            # Process rows
-            imported_count = 0
-            for row in self.rows:
-                if len(row) > 0:
-                    item_data = {
-                        'barcode': row[field_mapping.get('barcode', 0)] if field_mapping.get('barcode', 0) < len(row) else '',
-                        'name': row[field_mapping.get('name', 1)] if field_mapping.get('name', 1) < len(row) else '未知商品',
-                        'unit_price': self._parse_price(row[field_mapping.get('unit_price', 2)] if field_mapping.get('unit_price', 2) < len(row) else 0),
-                        'quantity': self._parse_quantity(row[field_mapping.get('quantity', 3)] if field_mapping.get('quantity', 3) < len(row) else 1)
-                    }
-                    
-                    # Only add items with valid names
-                    if item_data['name'] and item_data['name'] != '未知商品':
-                        app.db.add_item(
-                            delivery_note_id,
-                            item_data['barcode'],
-                            item_data['name'],
-                            item_data['unit_price'],
-                            item_data['quantity']
-                        )
-                        imported_count += 1
+            items, invalid_rows = build_items(self.rows, field_mapping)
             
-            # Update delivery note item count
-            app.db.update_delivery_note_count(delivery_note_id)
+            # Items, raw pages, the queued batch and the remembered mapping commit together:
+            # killed halfway, the batch is neither lost nor offered and imported twice.
+            # Next note with the same columns is imported without this screen.
+            item_ids, image_paths = app.db.import_ocr_batch(
+                delivery_note_id, items, self.ocr_batch_id, replace=self.replace_items,
+                profile=(header_signature(self.headers), self.headers, field_mapping)
+            )
+            imported_count = len(item_ids)
+            if self.ocr_batch_id is not None:
+                app.ocr_queue.forget_batch(self.ocr_batch_id, image_paths)
+                self.ocr_batch_id = None
+            self.replace_items = False
             
             # Show success message
             dialog = MDDialog(
                 title="导入成功",
-                text=f"成功导入 {imported_count} 个商品。",
+                text=import_summary(imported_count, invalid_rows),
                 buttons=[
                     MDFlatButton(
                         text="确定"
@@ -922,25 +1335,11 @@ class ColumnMappingScreen(MDScreen):
     
     def _parse_price(self, price):
         """解析价格"""
-        if price is None:
-            return 0.0
-        
-        try:
-            # Remove currency symbols and spaces
-            price_str = str(price).replace('¥', '').replace('$', '').replace(',', '').strip()
-            return float(price_str)
-        except (ValueError, TypeError):
-            return 0.0
+        return parse_price(price)
     
     def _parse_quantity(self, quantity):
         """解析数量"""
-        if quantity is None:
-            return 1
-        
-        try:
-            return int(float(str(quantity)))
-        except (ValueError, TypeError):
-            return 1
+        return parse_quantity(quantity)
     
     def finish_import(self, dialog):
         dialog.dismiss()
@@ -1101,7 +1500,7 @@ class BarcodeScanScreen(MDScreen):
 
             if item_id:
                 # Per-item mode: assign barcode to a specific item
-                app.db.update_item_barcode(item_id, barcode)
+                app.db.queue_item_barcode(item_id, barcode)
                 dialog = MDDialog(
                     title="扫描成功",
                     text=f"条码 {barcode} 已保存。",
@@ -1121,7 +1520,13 @@ class BarcodeScanScreen(MDScreen):
                     self._match_index = 0
                     self._show_match_dialog()
                 else:
-                    self._show_error_dialog("未找到商品", f"条码 {barcode} 未在此送货单中找到")
+                    message = f"条码 {barcode} 未在此送货单中找到"
+                    archived = app.db.search_archived_items_by_barcode(barcode)
+                    if archived:
+                        note = app.db.get_delivery_note_by_id(archived[0].delivery_note_id)
+                        if note:
+                            message += f"\n已归档送货单 {note.name} 中有此商品: {archived[0].name}"
+                    self._show_error_dialog("未找到商品", message)
         except Exception as e:
             print(f"处理条码时出错: {e}")
 
@@ -1245,12 +1650,12 @@ class BarcodeScanScreen(MDScreen):
         total = len(self._match_results)
         status_map = {'correct': '正确 ✓', 'incorrect': '错误 ✗', 'unchecked': '未检查'}
         self._dlg_counter.text = f"{self._match_index + 1}/{total}"
-        self._dlg_name_val.text = item[3]
-        self._dlg_barcode_val.text = item[2] or '-'
-        self._dlg_price_val.text = f"€ {item[4]:.2f}"
-        self._dlg_qty_val.text = str(item[5])
-        self._dlg_total_val.text = f"€ {item[4] * item[5]:.2f}"
-        self._dlg_status_val.text = status_map.get(item[6], item[6])
+        self._dlg_name_val.text = item.name
+        self._dlg_barcode_val.text = item.barcode or '-'
+        self._dlg_price_val.text = f"€ {item.unit_price:.2f}"
+        self._dlg_qty_val.text = str(item.quantity)
+        self._dlg_total_val.text = f"€ {item.unit_price * item.quantity:.2f}"
+        self._dlg_status_val.text = status_map.get(item.status, item.status)
         self._dlg_next_btn.disabled = (total <= 1)
 
     def _show_match_dialog(self):
@@ -1262,18 +1667,18 @@ class BarcodeScanScreen(MDScreen):
 
     def _match_confirm(self):
         item = self._match_results[self._match_index]
-        App.get_running_app().db.update_item_status(item[0], 'correct')
+        App.get_running_app().db.queue_item_status(item.id, 'correct')
         self._match_close()
         detail = self.manager.get_screen('delivery_detail')
-        detail.refresh_items(highlight_item_id=item[0])
+        detail.refresh_items(highlight_item_id=item.id)
         self.manager.current = 'delivery_detail'
 
     def _match_error(self):
         item = self._match_results[self._match_index]
-        App.get_running_app().db.update_item_status(item[0], 'incorrect')
+        App.get_running_app().db.queue_item_status(item.id, 'incorrect')
         self._match_close()
         detail = self.manager.get_screen('delivery_detail')
-        detail.refresh_items(highlight_item_id=item[0])
+        detail.refresh_items(highlight_item_id=item.id)
         self.manager.current = 'delivery_detail'
 
     def _match_close(self):
@@ -1326,6 +1731,10 @@ class InventoryManagementApp(MDApp):
         try:
             # Initialize database
             self.db = DatabaseManager()
+            # Photos waiting for OCR; drained in the background, resumed in on_start
+            self.ocr_queue = OCRJobQueue(
+                self.db, lambda: self.image_processor, on_batch_done=self.on_ocr_batch_done
+            )
             
             # Initialize image processor with API key check
             self.image_processor = None
@@ -1354,8 +1763,9 @@ class InventoryManagementApp(MDApp):
             if api_key:
                 try:
                     model = self.ocr_config.get_model()
-                    self.image_processor = OCRProcessor(api_key, model)
-                    print(f"OCR processor initialized (model: {model})")
+                    mode = self.ocr_config.get_extraction_mode()
+                    self.image_processor = OCRProcessor(api_key, model, extraction_mode=mode)
+                    print(f"OCR processor initialized (model: {model}, mode: {mode})")
                     return self.build_main_screens()
                 except Exception as e:
                     print(f"Error initializing OCR processor: {e}")
@@ -1387,10 +1797,12 @@ class InventoryManagementApp(MDApp):
         # Load current saved values (if any)
         saved_key = ''
         saved_model = 'claude-sonnet-4-6'
+        saved_mode = 'tool'
         if OCRConfig:
             try:
                 saved_key = self.ocr_config.get_api_key() or ''
                 saved_model = self.ocr_config.get_model() or 'claude-sonnet-4-6'
+                saved_mode = self.ocr_config.get_extraction_mode()
             except Exception:
                 pass
 
@@ -1398,7 +1810,7 @@ class InventoryManagementApp(MDApp):
             orientation='vertical',
             spacing=12,
             size_hint_y=None,
-            height=160,
+            height=210,
         )
 
         self.api_key_field = MDTextField(
@@ -1415,8 +1827,17 @@ class InventoryManagementApp(MDApp):
             helper_text_mode="on_focus",
         )
 
+        # tool = structured table via tool call, prompt = legacy JSON prompt
+        self.api_mode_spinner = Spinner(
+            text=saved_mode,
+            values=['tool', 'prompt'],
+            size_hint_y=None,
+            height=40
+        )
+
         form.add_widget(self.api_key_field)
         form.add_widget(self.api_model_field)
+        form.add_widget(self.api_mode_spinner)
 
         self.api_dialog = MDDialog(
             title="API 设置",
@@ -1453,19 +1874,26 @@ class InventoryManagementApp(MDApp):
         model = model.text.strip() if model else ''
         if not model:
             model = 'claude-sonnet-4-6'
+        mode_spinner = getattr(self, 'api_mode_spinner', None)
+        mode = mode_spinner.text if mode_spinner else 'tool'
         if api_key:
             try:
                 # Save using new config system if available
                 if OCRConfig:
-                    self.ocr_config.save_config(api_key, model)
+                    self.ocr_config.save_config(api_key, model, mode)
                 else:
                     # Fallback to file
                     with open('config.txt', 'w', encoding='utf-8') as f:
                         f.write(api_key)
 
                 # Create OCRProcessor if available
+                old_processor = getattr(self, 'image_processor', None)
+                if old_processor is not None and hasattr(old_processor, 'close'):
+                    old_processor.close()
                 if OCRProcessor is not None:
-                    self.image_processor = OCRProcessor(api_key, model)
+                    self.image_processor = OCRProcessor(api_key, model, extraction_mode=mode)
+                    # Photos queued while no key was set can go now
+                    self.ocr_queue.wake()
                 else:
                     self.image_processor = None
                     
@@ -1506,6 +1934,49 @@ class InventoryManagementApp(MDApp):
             error_dialog.buttons[0].bind(on_release=lambda x: error_dialog.dismiss())
             error_dialog.open()
     
+    def on_start(self):
+        """Resume the OCR jobs left over from the last run"""
+        queue = getattr(self, 'ocr_queue', None)
+        if queue is not None:
+            queue.start()
+    
+    def on_resume(self):
+        """Back from the background: the network may be up again"""
+        queue = getattr(self, 'ocr_queue', None)
+        if queue is not None:
+            queue.wake()
+    
+    def on_ocr_batch_done(self, batch_id, delivery_note_id, tables):
+        """A resumed OCR batch finished (worker thread): offer it if its note is open"""
+        def offer(dt):
+            detail_screen = self.root.get_screen('delivery_detail')
+            if detail_screen.is_showing_note(delivery_note_id):
+                detail_screen.offer_ocr_results(delivery_note_id)
+        Clock.schedule_once(offer, 0)
+    
+    def on_pause(self):
+        """Android may kill a paused app: commit queued writes and checkpoint the WAL"""
+        db = getattr(self, 'db', None)
+        if db is not None:
+            try:
+                db.flush(timeout=5)
+                db.checkpoint()
+            except Exception as e:
+                print(f"Error flushing database on pause: {e}")
+        return True
+
+    def on_stop(self):
+        """Commit queued writes and release the per-thread database connections"""
+        queue = getattr(self, 'ocr_queue', None)
+        if queue is not None:
+            queue.stop(timeout=5)
+        db = getattr(self, 'db', None)
+        if db is not None:
+            db.close(timeout=5)
+        processor = getattr(self, 'image_processor', None)
+        if processor is not None and hasattr(processor, 'close'):
+            processor.close()
+
     def build_main_screens(self):
         """Build the main application screens"""
         try:
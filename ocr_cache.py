@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+OCR结果缓存
+按图像内容 (SHA-256) + 模型 + 提示词版本缓存解析后的表格，超出容量时按LRU淘汰
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+HASH_CHUNK_SIZE = 256 * 1024
+
+
+class OCRCache:
+    """磁盘上的内容寻址缓存，每个条目一个 <sha256>.json 文件
+
+    文件的修改时间即最近使用时间，命中时刷新。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        if cache_dir is None:
+            try:
+                from kivy.app import App
+                app = App.get_running_app()
+                if app and hasattr(app, 'user_data_dir'):
+                    cache_dir = os.path.join(app.user_data_dir, 'ocr_cache')
+                else:
+                    cache_dir = 'ocr_cache'
+            except Exception:
+                cache_dir = 'ocr_cache'
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # key -> file size, so eviction does not have to stat the directory on every put
+        self._sizes = {}
+        for filename in os.listdir(cache_dir):
+            if filename.endswith('.json'):
+                path = os.path.join(cache_dir, filename)
+                self._sizes[filename[:-5]] = os.path.getsize(path)
+        self._total_bytes = sum(self._sizes.values())
+
+    @staticmethod
+    def make_key(image_bytes, model, prompt_version, variant=''):
+        """图像内容 + 模型ID + 提示词版本 (+ 预处理设置等) -> 缓存键"""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(f"\0{model}\0{prompt_version}\0{variant}".encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_file_key(image_path, model, prompt_version, variant=''):
+        """与 make_key 相同，但按块读取文件而不整个载入内存"""
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        digest.update(f"\0{model}\0{prompt_version}\0{variant}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """返回缓存的表格数据，未命中时返回None"""
+        with self._lock:
+            if key not in self._sizes:
+                self.stats['misses'] += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    table_data = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                # Unreadable entry: drop it and treat as a miss
+                self._remove(key)
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return table_data
+
+    def put(self, key, table_data):
+        """保存表格数据并按需淘汰最久未使用的条目"""
+        data = json.dumps(table_data, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - self._sizes.get(key, 0)
+            self._sizes[key] = len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=key)
+
+    def clear(self):
+        """删除所有缓存条目"""
+        with self._lock:
+            for key in list(self._sizes):
+                self._remove(key)
+
+    def _evict(self, keep):
+        by_age = sorted(
+            (key for key in self._sizes if key != keep),
+            key=lambda key: self._mtime(key)
+        )
+        for key in by_age:
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove(key)
+            self.stats['evictions'] += 1
+
+    def _mtime(self, key):
+        try:
+            return os.path.getmtime(self._path(key))
+        except OSError:
+            return 0
+
+    def _remove(self, key):
+        self._total_bytes -= self._sizes.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
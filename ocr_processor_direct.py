@@ -7,28 +7,170 @@ OCR处理器 - 直接HTTP版本
 import base64
 import json
 import os
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
 from kivy.storage.jsonstore import JsonStore
+from ocr_cache import OCRCache
+from image_preprocessor import ImagePreprocessor
+from streaming_body import IMAGE_PLACEHOLDER, StreamingJSONBody
+from api_retry import RetryScheduler
+from table_parser import IncrementalTableParser, parse_table
 
 DEFAULT_MODEL = "claude-sonnet-4-6"
+# Pages sent to the API at the same time
+DEFAULT_MAX_IN_FLIGHT = 3
+# Part of the OCR cache key: bump whenever EXTRACTION_PROMPT changes
+PROMPT_VERSION = 2
+
+EXTRACTION_PROMPT = """分析这张送货单图像并提取所有表格数据。
+
+重要：只返回有效的JSON格式，格式如下：
+
+{
+  "headers": ["列1", "列2", "列3"],
+  "rows": [
+    ["值1", "值2", "值3"],
+    ["值1", "值2", "值3"]
+  ]
+}
+
+规则：
+- 提取所有可见的列
+- 包含所有数据行
+- 对引号和特殊字符使用正确的JSON转义
+- JSON前后不要包含任何其他文本
+- 确保所有字符串都正确引用
+- 不要使用尾随逗号
+
+只返回JSON。"""
+
+# Structured output: the table comes back as the input of a forced tool call
+EXTRACTION_MODES = ('tool', 'prompt')
+DEFAULT_EXTRACTION_MODE = 'tool'
+
+TABLE_TOOL = {
+    "name": "record_delivery_note_table",
+    "description": "记录送货单图像中的表格：所有列的表头和所有数据行，单元格按原样抄录为字符串。",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "headers": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "表头，按从左到右的顺序"
+            },
+            "rows": {
+                "type": "array",
+                "items": {"type": "array", "items": {"type": "string"}},
+                "description": "数据行，每行的单元格与表头一一对应"
+            }
+        },
+        "required": ["headers", "rows"]
+    }
+}
+
+TOOL_PROMPT = """分析这张送货单图像，用 record_delivery_note_table 工具记录表格。
+- 提取所有可见的列
+- 包含所有数据行
+- 单元格按图像中的原样抄录"""
+
+# The instructions above go in a cached system block; each page only adds its image and this line
+PAGE_PROMPT = "提取这张送货单图像中的表格。"
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens',
+                'cache_creation_input_tokens', 'cache_read_input_tokens')
+# Only replies that ended on their own are cached (not max_tokens, not a dropped stream)
+COMPLETE_STOP_REASONS = ('end_turn', 'tool_use', 'stop_sequence')
 
 class OCRProcessor:
-    def __init__(self, api_key, model=None):
+    def __init__(self, api_key, model=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, cache=None,
+                 preprocessor=None, retry=None, api_url=None,
+                 extraction_mode=DEFAULT_EXTRACTION_MODE):
         """
         初始化OCR处理器
         Args:
             api_key: Claude API密钥
             model:   Claude模型ID (默认 claude-sonnet-4-6)
+            max_in_flight: 同时发送的最大请求数 (1 = 逐张处理)
+            cache:   OCRCache实例 (默认在 user_data_dir/ocr_cache)
+            preprocessor: ImagePreprocessor实例 (默认缩小到1568像素长边的JPEG)
+            retry:   RetryScheduler实例 (默认使用全局共享的令牌桶)
+            api_url: Messages API地址 (测试时可指向本地模拟服务器)
+            extraction_mode: 'tool' = 通过工具调用返回结构化表格 (失败时退回提示词)，
+                             'prompt' = 原来的JSON提示词
         """
         self.api_key = api_key
         self.model = model or DEFAULT_MODEL
-        self.api_url = "https://api.anthropic.com/v1/messages"
+        if extraction_mode not in EXTRACTION_MODES:
+            extraction_mode = DEFAULT_EXTRACTION_MODE
+        self.extraction_mode = extraction_mode
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.api_url = api_url or "https://api.anthropic.com/v1/messages"
+        self.retry = retry or RetryScheduler()
+        self.session = self._create_session()
+        if cache is None:
+            try:
+                cache = OCRCache()
+            except OSError as e:
+                print(f"⚠️ OCR缓存不可用: {e}")
+        self.cache = cache
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        # Token totals reported by the API, including prompt cache writes/reads
+        self._usage = dict.fromkeys(USAGE_FIELDS, 0)
+        self._usage_lock = threading.Lock()
 
         # 验证API密钥格式
         if not api_key or not api_key.startswith('sk-ant-'):
             print("⚠️ 警告: API密钥格式可能不正确")
     
+    def _create_session(self):
+        """带连接池的长连接会话，DNS/TCP/TLS 只在首次请求时建立"""
+        session = requests.Session()
+        # One pooled keep-alive connection per concurrent page
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        session.mount("https://", adapter)
+        session.headers.update({
+            "x-api-key": self.api_key or "",
+            "anthropic-version": "2023-06-01",
+            "Connection": "keep-alive",
+        })
+        return session
+    
+    def warm_up(self):
+        """在后台预先建立到API的连接 (失败时忽略)"""
+        def connect():
+            try:
+                # Any response will do: it leaves a live TLS connection in the pool
+                self.session.head(self.api_url, timeout=10)
+            except Exception as e:
+                print(f"⚠️ API预连接失败: {e}")
+        
+        threading.Thread(target=connect, daemon=True).start()
+    
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+    
+    @property
+    def cache_stats(self):
+        """OCR缓存命中/未命中/淘汰次数"""
+        if self.cache is None:
+            return {'hits': 0, 'misses': 0, 'evictions': 0}
+        return dict(self.cache.stats)
+    
+    @property
+    def usage_stats(self):
+        """累计的token用量 (输入/输出/提示词缓存写入/缓存读取)"""
+        with self._usage_lock:
+            return dict(self._usage)
+    
+    def _record_usage(self, usage):
+        with self._usage_lock:
+            for field in USAGE_FIELDS:
+                self._usage[field] += usage.get(field) or 0
+    
     def encode_image_to_base64(self, image_path):
         """将图像编码为base64"""
         try:
@@ -40,216 +182,308 @@ class OCRProcessor:
     
     def extract_delivery_note_data(self, image_paths, progress_callback=None):
         """
-        从送货单图像中提取数据 - 逐张处理以避免输出限制
+        从送货单图像中提取数据 - 阻塞直到所有图像处理完毕
         Args:
             image_paths: 图像文件路径列表
             progress_callback: 进度回调函数 callback(current, total, message)
         Returns:
-            提取的数据列表
+            提取的数据列表 (按图像顺序，失败的图像被跳过)
+        """
+        return self.stream_delivery_note_data(image_paths, progress_callback=progress_callback)
+    
+    def stream_delivery_note_data(self, image_paths, row_callback=None, progress_callback=None,
+                                  page_callback=None):
+        """
+        从送货单图像中提取数据 - 每张图像一个流式请求，最多 max_in_flight 个并发
+        Args:
+            image_paths: 图像文件路径列表
+            row_callback: 行回调函数 callback(page, headers, rows)，每解析出新行调用一次
+            progress_callback: 进度回调函数 callback(current, total, message)
+            page_callback: 页面回调函数 callback(page, table_data, error)，每张图像结束时
+                           在调用线程中调用一次 (成功时 error 为None)
+        Returns:
+            提取的数据列表 (按图像顺序，失败的图像被跳过)
         """
         if not self.api_key:
             raise Exception("未设置API密钥")
         
-        extracted_data = []
         total_images = len(image_paths)
+        results = [None] * total_images
+        callback_lock = threading.Lock()
+        
+        def notify(current, message):
+            print(message)
+            if progress_callback:
+                # Workers report concurrently; keep callbacks one at a time
+                with callback_lock:
+                    progress_callback(current, total_images, message)
         
-        for index, image_path in enumerate(image_paths, 1):
+        def emit_rows(index, headers, rows):
+            if row_callback and rows:
+                with callback_lock:
+                    row_callback(index, headers, rows)
+        
+        def process(index, image_path):
+            # A failed page is reported and skipped, its siblings keep going
             try:
-                filename = os.path.basename(image_path)
-                progress_msg = f"正在处理图像 {index}/{total_images}: {filename}"
-                print(f"🔄 {progress_msg}")
-                
-                # 通知进度
-                if progress_callback:
-                    progress_callback(index, total_images, progress_msg)
-                
-                # 编码图像
-                base64_image = self.encode_image_to_base64(image_path)
-                
-                # 构建请求数据
-                headers = {
-                    "Content-Type": "application/json",
-                    "x-api-key": self.api_key,
-                    "anthropic-version": "2023-06-01"
-                }
-                
-                payload = {
-                    "model": self.model,
-                    "max_tokens": 3000,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/jpeg",
-                                        "data": base64_image
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": """分析这张送货单图像并提取所有表格数据。
-
-重要：只返回有效的JSON格式，格式如下：
-
-{
-  "headers": ["列1", "列2", "列3"],
-  "rows": [
-    ["值1", "值2", "值3"],
-    ["值1", "值2", "值3"]
-  ]
-}
-
-规则：
-- 提取所有可见的列
-- 包含所有数据行
-- 对引号和特殊字符使用正确的JSON转义
-- JSON前后不要包含任何其他文本
-- 确保所有字符串都正确引用
-- 不要使用尾随逗号
-
-只返回JSON。"""
-                                }
-                            ]
-                        }
-                    ]
-                }
-                
-                # 发送请求
-                api_progress_msg = f"发送到Claude API处理图像 {index}/{total_images}..."
-                print(f"📡 {api_progress_msg}")
-                if progress_callback:
-                    progress_callback(index, total_images, api_progress_msg)
-                    
-                response = requests.post(
-                    self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=90  # 增加超时时间给Sonnet 4
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'content' in result and len(result['content']) > 0:
-                        response_text = result['content'][0]['text']
-                        print(f"✅ Claude响应: {response_text[:200]}...")
-                        
-                        # 解析JSON响应
-                        table_data = self._parse_response(response_text)
-                        if table_data:
-                            extracted_data.append(table_data)
-                            success_msg = f"✅ 图像 {index}/{total_images} 处理完成"
-                            print(success_msg)
-                            if progress_callback:
-                                progress_callback(index, total_images, success_msg)
-                        else:
-                            error_msg = f"⚠️ 图像 {index}/{total_images} 未提取到数据"
-                            print(error_msg)
-                            if progress_callback:
-                                progress_callback(index, total_images, error_msg)
-                    else:
-                        print("❌ API响应格式异常")
-                else:
-                    error_msg = f"API请求失败: {response.status_code}"
-                    try:
-                        error_detail = response.json()
-                        if 'error' in error_detail:
-                            error_msg += f" - {error_detail['error'].get('message', '')}"
-                    except:
-                        error_msg += f" - {response.text[:200]}"
-                    
-                    print(f"❌ {error_msg}")
-                    raise Exception(error_msg)
-                    
+                table_data = self._process_image(index, total_images, image_path, notify, emit_rows)
             except Exception as e:
-                error_msg = f"❌ 图像 {index}/{total_images} 处理失败: {str(e)}"
-                print(error_msg)
-                if progress_callback:
-                    progress_callback(index, total_images, error_msg)
-                continue
+                notify(index, f"❌ 图像 {index}/{total_images} 处理失败: {str(e)}")
+                return None, e
+            return table_data, None
+        
+        workers = max(1, min(self.max_in_flight, total_images))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr') as executor:
+            futures = {
+                executor.submit(process, index, image_path): index
+                for index, image_path in enumerate(image_paths, 1)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                table_data, error = future.result()
+                results[index - 1] = table_data
+                if page_callback:
+                    page_callback(index, table_data, error)
+        
+        extracted_data = [table_data for table_data in results if table_data]
         
         # Progreso final
         final_msg = f"🎉 处理完成！成功提取 {len(extracted_data)} 个表格，总计 {total_images} 张图像"
-        print(final_msg)
-        if progress_callback:
-            progress_callback(total_images, total_images, final_msg)
+        notify(total_images, final_msg)
         
         return extracted_data
     
-    def _parse_response(self, response_text):
-        """解析Claude的响应文本"""
-        try:
-            # 尝试提取JSON
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group()
-                
-                # 清理JSON
-                json_text = self._clean_json(json_text)
-                
+    def _process_image(self, index, total_images, image_path, notify, emit_rows):
+        """处理单张图像，返回表格数据或None (API错误时抛出异常)"""
+        filename = os.path.basename(image_path)
+        notify(index, f"🔄 正在处理图像 {index}/{total_images}: {filename}")
+        
+        # Same photo, model and prompt: reuse the table parsed last time
+        cache_key = None
+        if self.cache is not None:
+            cache_key = OCRCache.make_file_key(
+                image_path, self.model, f"{PROMPT_VERSION}-{self.extraction_mode}",
+                self.preprocessor.signature
+            )
+            table_data = self.cache.get(cache_key)
+            if table_data and table_data.get('rows'):
+                notify(index, f"⚡ 图像 {index}/{total_images} 使用缓存结果")
+                emit_rows(index, table_data['headers'], table_data['rows'])
+                return table_data
+        
+        # 旋转/缩小/重新编码后再上传 (None: 原文件直接上传)
+        original_size = os.path.getsize(image_path)
+        upload_bytes, media_type = self.preprocessor.process_file(image_path)
+        upload_size = original_size if upload_bytes is None else len(upload_bytes)
+        saved = original_size - upload_size
+        notify(index, f"🗜️ 图像 {index}/{total_images}: {original_size // 1024} KB -> "
+                      f"{upload_size // 1024} KB (节省 {saved // 1024} KB)")
+        
+        image = image_path if upload_bytes is None else upload_bytes
+        table_data, stop_reason = self._request_table(
+            index, total_images, image, media_type, self.extraction_mode, notify, emit_rows
+        )
+        if table_data is None and self.extraction_mode == 'tool':
+            notify(index, f"↩️ 图像 {index}/{total_images} 结构化输出失败，改用提示词模式")
+            table_data, stop_reason = self._request_table(
+                index, total_images, image, media_type, 'prompt', notify, emit_rows
+            )
+        
+        if table_data:
+            # An empty or cut-off table is returned but asked for again next time
+            if (cache_key is not None and table_data.get('rows')
+                    and stop_reason in COMPLETE_STOP_REASONS):
                 try:
-                    json_data = json.loads(json_text)
-                    if 'headers' in json_data and 'rows' in json_data:
-                        print(f"✅ 成功解析表格，列数: {len(json_data['headers'])}, 行数: {len(json_data['rows'])}")
-                        return json_data
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON解析错误: {e}")
-                    # 尝试修复数据
-                    salvaged_data = self._salvage_data(response_text)
-                    if salvaged_data:
-                        return salvaged_data
-            
-            print("❌ 未找到有效的JSON数据")
-            return None
-            
-        except Exception as e:
-            print(f"❌ 响应解析失败: {e}")
-            return None
+                    self.cache.put(cache_key, table_data)
+                except OSError as e:
+                    print(f"⚠️ OCR缓存写入失败: {e}")
+            notify(index, f"✅ 图像 {index}/{total_images} 处理完成")
+        else:
+            notify(index, f"⚠️ 图像 {index}/{total_images} 未提取到数据")
+        return table_data
     
-    def _clean_json(self, json_text):
-        """清理JSON格式问题"""
-        # 移除尾随逗号
-        json_text = re.sub(r',(\s*[}\]])', r'\1', json_text)
+    def _request_table(self, index, total_images, image, media_type, mode, notify, emit_rows):
+        """发送一次提取请求并解析表格 (image 为字节或文件路径)
+
+        Returns:
+            (表格或None, stop_reason)，流中途断开时 stop_reason 为None
+        """
+        # 构建请求数据 (认证头在会话中)
+        # tools + system are identical for every page: the cache breakpoint covers both
+        payload = {
+            "model": self.model,
+            "max_tokens": 3000,
+            "stream": True,
+            "system": [
+                {
+                    "type": "text",
+                    "text": TOOL_PROMPT if mode == 'tool' else EXTRACTION_PROMPT,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                # Filled in chunk by chunk by StreamingJSONBody
+                                "data": IMAGE_PLACEHOLDER
+                            }
+                        },
+                        {
+                            "type": "text",
+                            "text": PAGE_PROMPT
+                        }
+                    ]
+                }
+            ]
+        }
+        if mode == 'tool':
+            payload["tools"] = [TABLE_TOOL]
+            payload["tool_choice"] = {"type": "tool", "name": TABLE_TOOL["name"]}
         
-        # 移除控制字符
-        json_text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', json_text)
+        # 发送请求
+        notify(index, f"📡 发送到Claude API处理图像 {index}/{total_images}...")
+        body = StreamingJSONBody(payload, image)
+        
+        def on_retry(attempt, delay, reason):
+            notify(index, f"⏳ 图像 {index}/{total_images}: {reason}，{delay:.1f} 秒后重试 "
+                          f"({attempt}/{self.retry.max_attempts})")
+        
+        # 429/529/5xx wait for retry-after or back off, then resend the same body
+        response = self.retry.call(
+            lambda: self.session.post(
+                self.api_url,
+                data=body,
+                headers={"Content-Type": "application/json"},
+                stream=True,
+                timeout=90  # 增加超时时间给Sonnet 4
+            ),
+            on_retry=on_retry
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"API请求失败: {response.status_code}"
+            try:
+                error_detail = response.json()
+                if 'error' in error_detail:
+                    error_msg += f" - {error_detail['error'].get('message', '')}"
+            except:
+                error_msg += f" - {response.text[:200]}"
+            raise Exception(error_msg)
+        
+        # Rows are handed to the UI as soon as each one is complete.
+        # Tool input JSON has the same {"headers", "rows"} shape as the prompt's reply.
+        parser = IncrementalTableParser()
+        parse_errors = []
+        
+        def on_text(text):
+            if parse_errors:
+                return
+            try:
+                rows = parser.feed(text)
+            except Exception as e:
+                # One odd token must not throw away the rows already streamed
+                parse_errors.append(e)
+                print(f"⚠️ 图像 {index}/{total_images} 流式解析出错，读完后整体解析: {e}")
+                return
+            emit_rows(index, parser.headers, rows)
+        
+        with response:
+            if response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                response_text, stop_reason = self._read_event_stream(
+                    response, on_text,
+                    lambda usage: self._record_page_usage(index, total_images, usage)
+                )
+            else:
+                result = response.json()
+                self._record_page_usage(index, total_images, result.get('usage') or {})
+                stop_reason = result.get('stop_reason')
+                if 'content' not in result or len(result['content']) == 0:
+                    print("❌ API响应格式异常")
+                    return None, stop_reason
+                response_text = ''.join(
+                    json.dumps(block['input'], ensure_ascii=False)
+                    if block.get('type') == 'tool_use' else block.get('text', '')
+                    for block in result['content']
+                )
+                on_text(response_text)
+        print(f"✅ Claude响应: {response_text[:200]}...")
         
-        return json_text
+        # 解析JSON响应 (被截断时保留已完整的行)
+        if parse_errors:
+            try:
+                return parse_table(response_text), stop_reason
+            except Exception as e:
+                print(f"⚠️ 图像 {index}/{total_images} 整体解析失败，保留已解析的行: {e}")
+                # stop_reason None: a partial table is shown but not cached
+                return parser.finish(), None
+        return parser.finish(), stop_reason
     
-    def _salvage_data(self, response_text):
-        """尝试从损坏的响应中提取数据"""
-        try:
-            # 查找headers模式
-            headers_match = re.search(r'"headers":\s*\[(.*?)\]', response_text, re.DOTALL)
-            rows_match = re.search(r'"rows":\s*\[(.*?)\]\s*\}', response_text, re.DOTALL)
-            
-            if headers_match and rows_match:
-                headers_text = headers_match.group(1)
-                rows_text = rows_match.group(1)
-                
-                # 提取headers
-                headers = re.findall(r'"([^"]*)"', headers_text)
-                
-                # 提取rows
-                rows = []
-                row_matches = re.findall(r'\[(.*?)\]', rows_text)
-                for row_match in row_matches:
-                    values = re.findall(r'"([^"]*)"', row_match)
-                    if values:
-                        rows.append(values)
-                
-                if headers and rows:
-                    print(f"🔧 数据修复成功，列数: {len(headers)}, 行数: {len(rows)}")
-                    return {
-                        "headers": headers,
-                        "rows": rows
-                    }
-        except Exception as e:
-            print(f"❌ 数据修复失败: {e}")
-            
-        return None
+    def _record_page_usage(self, index, total_images, usage):
+        self._record_usage(usage)
+        print(f"💾 图像 {index}/{total_images} 提示词缓存: "
+              f"读取 {usage.get('cache_read_input_tokens') or 0} / "
+              f"写入 {usage.get('cache_creation_input_tokens') or 0} tokens")
+    
+    def _read_event_stream(self, response, on_text, on_usage):
+        """读取Messages API的SSE流，把文本/工具输入增量交给 on_text
+
+        on_usage(usage) 在流结束时以合并后的用量调用一次。
+        Returns:
+            (完整文本, stop_reason)
+        """
+        parts = []
+        stop_reason = None
+        # message_start carries input/cache counts, message_delta the final output count
+        usage = {}
+        for event, data in self._iter_events(response):
+            if event == 'message_start':
+                usage.update(data.get('message', {}).get('usage') or {})
+            elif event == 'content_block_delta':
+                delta = data.get('delta', {})
+                if delta.get('type') == 'text_delta':
+                    parts.append(delta['text'])
+                    on_text(delta['text'])
+                elif delta.get('type') == 'input_json_delta':
+                    # Forced tool call: the tool input streams as partial JSON
+                    parts.append(delta['partial_json'])
+                    on_text(delta['partial_json'])
+            elif event == 'message_delta':
+                # Later counts win; null means "not reported here"
+                usage.update((field, value) for field, value in (data.get('usage') or {}).items()
+                             if value is not None)
+                stop_reason = data.get('delta', {}).get('stop_reason') or stop_reason
+                if stop_reason == 'max_tokens':
+                    print("⚠️ 响应达到max_tokens上限，表格可能不完整")
+            elif event == 'error':
+                raise Exception(f"API流错误: {data.get('error', {}).get('message', '')}")
+            elif event == 'message_stop':
+                break
+        on_usage(usage)
+        return ''.join(parts), stop_reason
+    
+    @staticmethod
+    def _iter_events(response):
+        """把SSE响应拆成 (event, data) 对"""
+        event, data_lines = None, []
+        # Bytes lines: SSE has no charset parameter and requests would guess latin-1
+        for line in response.iter_lines():
+            line = line.decode('utf-8')
+            if not line:
+                if data_lines:
+                    yield event, json.loads('\n'.join(data_lines))
+                event, data_lines = None, []
+            elif line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data_lines.append(line[5:].lstrip())
+        if data_lines:
+            yield event, json.loads('\n'.join(data_lines))
 
 # 配置管理类
 class OCRConfig:
@@ -258,21 +492,37 @@ class OCRConfig:
     def __init__(self):
         self.config_store = JsonStore('ocr_config.json')
     
+    def _save(self, **changes):
+        """更新 'api' 条目中的部分字段, 其余字段保持不变"""
+        values = {
+            'api_key': self.get_api_key() or '',
+            'model': self.get_model(),
+            'extraction_mode': self.get_extraction_mode(),
+        }
+        values.update(changes)
+        self.config_store.put('api', **values)
+
     def save_api_key(self, api_key):
         """保存API密钥"""
-        existing_model = self.get_model()
-        self.config_store.put('api', api_key=api_key, model=existing_model or DEFAULT_MODEL)
+        self._save(api_key=api_key)
         print("✅ API密钥已保存")
 
     def save_model(self, model):
         """保存模型ID"""
-        existing_key = self.get_api_key() or ''
-        self.config_store.put('api', api_key=existing_key, model=model)
+        self._save(model=model)
         print(f"✅ 模型已保存: {model}")
 
-    def save_config(self, api_key, model):
-        """同时保存API密钥和模型"""
-        self.config_store.put('api', api_key=api_key, model=model)
+    def save_extraction_mode(self, extraction_mode):
+        """保存提取模式 ('tool' 或 'prompt')"""
+        self._save(extraction_mode=extraction_mode)
+        print(f"✅ 提取模式已保存: {extraction_mode}")
+
+    def save_config(self, api_key, model, extraction_mode=None):
+        """同时保存API密钥和模型 (以及提取模式)"""
+        changes = {'api_key': api_key, 'model': model}
+        if extraction_mode is not None:
+            changes['extraction_mode'] = extraction_mode
+        self._save(**changes)
         print(f"✅ 配置已保存 (模型: {model})")
 
     def get_api_key(self):
@@ -289,6 +539,14 @@ class OCRConfig:
         except KeyError:
             return DEFAULT_MODEL
 
+    def get_extraction_mode(self):
+        """获取提取模式"""
+        try:
+            mode = self.config_store.get('api').get('extraction_mode')
+        except KeyError:
+            return DEFAULT_EXTRACTION_MODE
+        return mode if mode in EXTRACTION_MODES else DEFAULT_EXTRACTION_MODE
+
     def has_api_key(self):
         """检查是否已设置API密钥"""
         api_key = self.get_api_key()
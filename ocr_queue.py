@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+持久化的OCR任务队列
+每张图像一行 (ocr_jobs 表)，状态 pending -> in_flight -> done / failed；
+后台线程逐批处理，每完成一页立即保存结果。应用被杀或断网后，下次启动自动继续
+"""
+
+import os
+import shutil
+import threading
+import uuid
+import requests
+
+
+class OCRJobQueue:
+    """把送货单照片排队交给 OCRProcessor 处理
+
+    图像先复制到队列目录，原文件 (相机临时文件) 被覆盖也不影响。
+    网络错误不算失败次数：图像放回 pending，等待一段时间 (或 wake()) 后重试。
+    其他错误计入失败次数，RETRY_DELAY 秒后重试，每次加倍。
+    """
+    # Failed (non-network) attempts before a page is given up on
+    MAX_ATTEMPTS = 3
+    # Seconds before a failed page is tried again, doubled after every failure
+    RETRY_DELAY = 30.0
+    # Seconds to wait after a network error, doubled up to OFFLINE_MAX_DELAY
+    OFFLINE_DELAY = 15.0
+    OFFLINE_MAX_DELAY = 300.0
+    NETWORK_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self, db, get_processor, spool_dir=None, on_batch_done=None):
+        """
+        Args:
+            db: DatabaseManager
+            get_processor: 返回当前的 OCRProcessor (未配置时返回None)
+            spool_dir: 保存排队图像的目录 (默认 user_data_dir/ocr_jobs)
+            on_batch_done: callback(batch_id, delivery_note_id, tables)，
+                           没有单独注册回调的批次 (例如重启后恢复的) 处理完时在工作线程中调用
+        """
+        if spool_dir is None:
+            try:
+                from kivy.app import App
+                app = App.get_running_app()
+                if app and hasattr(app, 'user_data_dir'):
+                    spool_dir = os.path.join(app.user_data_dir, 'ocr_jobs')
+                else:
+                    spool_dir = 'ocr_jobs'
+            except Exception:
+                spool_dir = 'ocr_jobs'
+        self.db = db
+        self.get_processor = get_processor
+        self.spool_dir = spool_dir
+        self.on_batch_done = on_batch_done
+        os.makedirs(spool_dir, exist_ok=True)
+        # batch_id -> dict of progress/row/done callbacks registered by enqueue()
+        self._listeners = {}
+        self._cond = threading.Condition()
+        self._wake = False
+        self._stopped = False
+        self._thread = None
+        self._offline_delay = self.OFFLINE_DELAY
+
+    def start(self):
+        """恢复上次中断的任务并启动后台线程"""
+        resumed = self.db.release_ocr_jobs()
+        if resumed:
+            print(f"🔁 恢复 {resumed} 张未完成的OCR图像")
+        self._prune_spool()
+        with self._cond:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='ocr-queue', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止后台线程 (正在处理的图像在下次启动时重新处理)"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def wake(self):
+        """立即检查队列 (新任务、网络恢复或API密钥已设置)"""
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
+
+    def enqueue(self, delivery_note_id, image_paths, progress_callback=None,
+                row_callback=None, done_callback=None):
+        """复制图像并加入队列，返回批次ID
+
+        回调与 OCRProcessor.stream_delivery_note_data 相同 (page 为批次内页码)，
+        done_callback(batch_id, tables) 在这批全部处理完时调用，均在工作线程中。
+        """
+        spooled = []
+        for image_path in image_paths:
+            extension = os.path.splitext(image_path)[1] or '.jpg'
+            spooled_path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}{extension}")
+            shutil.copyfile(image_path, spooled_path)
+            spooled.append(spooled_path)
+        batch_id = self.db.enqueue_ocr_batch(delivery_note_id, spooled)
+        self.set_listener(batch_id, progress_callback, row_callback, done_callback)
+        self.wake()
+        return batch_id
+
+    def set_listener(self, batch_id, progress_callback=None, row_callback=None, done_callback=None):
+        """为一个批次注册回调 (替换已有的)"""
+        with self._cond:
+            self._listeners[batch_id] = {
+                'progress': progress_callback,
+                'rows': row_callback,
+                'done': done_callback,
+            }
+
+    def remove_listener(self, batch_id):
+        with self._cond:
+            self._listeners.pop(batch_id, None)
+
+    def discard_batch(self, batch_id):
+        """删除一个批次及其图像 (放弃后)"""
+        self.forget_batch(batch_id, self.db.delete_ocr_batch(batch_id))
+    
+    def forget_batch(self, batch_id, image_paths):
+        """批次已从数据库删除 (例如和导入在同一事务中)：删除回调和图像"""
+        self.remove_listener(batch_id)
+        for path in image_paths:
+            self._remove_file(path)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._wake = False
+            processor = self.get_processor()
+            jobs = self.db.claim_ocr_batch() if processor is not None else []
+            if not jobs:
+                # Pages backing off after an error are picked up when their delay is over
+                self._wait(self.db.next_ocr_retry_delay() if processor is not None else None)
+                continue
+            offline = self._process_batch(processor, jobs)
+            if offline:
+                print(f"📴 网络不可用，{self._offline_delay:.0f} 秒后重试OCR队列")
+                self._wait(self._offline_delay)
+                self._offline_delay = min(self.OFFLINE_MAX_DELAY, self._offline_delay * 2)
+            else:
+                self._offline_delay = self.OFFLINE_DELAY
+
+    def _wait(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._wake or self._stopped, timeout)
+
+    def _process_batch(self, processor, jobs):
+        """处理一批中被领取的图像，返回是否因网络错误中断"""
+        batch_id = jobs[0].batch_id
+        with self._cond:
+            listener = self._listeners.get(batch_id, {})
+        total_pages = len(self.db.get_ocr_batch(batch_id))
+        offline = []
+
+        def on_progress(current, total, message):
+            if listener.get('progress'):
+                listener['progress'](jobs[min(current, len(jobs)) - 1].page, total_pages, message)
+
+        def on_rows(index, headers, rows):
+            if listener.get('rows'):
+                listener['rows'](jobs[index - 1].page, headers, rows)
+
+        def on_page(index, table_data, error):
+            # Runs on this thread: the result is committed before the next page finishes
+            job = jobs[index - 1]
+            if error is None:
+                self.db.complete_ocr_job(job.id, table_data)
+            elif isinstance(error, self.NETWORK_ERRORS):
+                offline.append(job.id)
+            else:
+                self.db.retry_ocr_job(job.id, str(error), self.MAX_ATTEMPTS, self.RETRY_DELAY)
+
+        try:
+            if hasattr(processor, 'stream_delivery_note_data'):
+                processor.stream_delivery_note_data(
+                    [job.image_path for job in jobs],
+                    row_callback=on_rows,
+                    progress_callback=on_progress,
+                    page_callback=on_page
+                )
+            else:
+                # Desktop processor: one blocking call per page keeps the per-page commits
+                for index, job in enumerate(jobs, 1):
+                    try:
+                        on_progress(index, total_pages, f"🔄 正在处理图像 {job.page}/{total_pages}")
+                        tables = processor.extract_delivery_note_data([job.image_path])
+                    except Exception as e:
+                        on_page(index, None, e)
+                    else:
+                        on_page(index, tables[0] if tables else None, None)
+        except Exception as e:
+            # No API key and the like: keep the pages for later instead of failing them
+            print(f"❌ OCR队列处理失败: {e}")
+            offline.extend(job.id for job in jobs)
+        if offline:
+            self.db.release_ocr_jobs(offline)
+
+        if self.db.is_ocr_batch_finished(batch_id):
+            tables = self.db.get_ocr_batch_tables(batch_id)
+            done = listener.get('done')
+            if done:
+                done(batch_id, tables)
+            elif self.on_batch_done:
+                self.on_batch_done(batch_id, jobs[0].delivery_note_id, tables)
+        return bool(offline)
+
+    def _prune_spool(self):
+        """删除不再属于任何任务的图像 (送货单被删除等)"""
+        referenced = {os.path.abspath(path) for path in self.db.get_ocr_image_paths()}
+        for filename in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, filename)
+            if os.path.abspath(path) not in referenced:
+                self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -28,11 +28,11 @@ def export_to_csv(delivery_note_name, items):
             # Data rows
             for item in items:
                 writer.writerow([
-                    item[2] or '',  # barcode
-                    item[3] or '',  # name  
-                    item[4] or 0,   # price
-                    item[5] or 0,   # quantity
-                    item[6] or 'unchecked'  # status
+                    item.barcode or '',
+                    item.name or '',
+                    item.unit_price or 0,
+                    item.quantity or 0,
+                    item.status or 'unchecked'
                 ])
         
         return filepath
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+多页表格合并
+按表头相似度对齐各页的列并拼接行，去掉每页重复出现的表头行和照片重叠造成的重复行，
+一张送货单只需一次列映射和一次导入
+"""
+
+import unicodedata
+from difflib import SequenceMatcher
+
+# Headers at least this similar are treated as the same column
+HEADER_SIMILARITY = 0.75
+
+
+def normalize_cell(value):
+    """比较用的单元格形式: 去掉重音、大小写、空格和标点 ("Código " == "codigo")"""
+    text = unicodedata.normalize('NFKD', str(value)).casefold()
+    return ''.join(char for char in text if char.isalnum())
+
+
+def header_similarity(left, right, threshold=0.0):
+    """两个表头的相似度 0..1 (都已 normalize_cell)
+
+    低于 threshold 时可能只返回上界 (省去逐字比较)。
+    """
+    if left == right:
+        return 1.0
+    if not left or not right:
+        return 0.0
+    short, long = sorted((left, right), key=len)
+    if len(short) >= 3 and long.startswith(short):
+        # Abbreviations: "Cant." / "Cantidad", "Ref" / "Referencia"
+        return max(0.85, SequenceMatcher(None, left, right).ratio())
+    # Cheap upper bound first: most data cells are nothing like a header
+    bound = 2 * len(short) / (len(short) + len(long))
+    if bound < threshold:
+        return bound
+    matcher = SequenceMatcher(None, left, right)
+    bound = matcher.quick_ratio()
+    if bound < threshold:
+        return bound
+    return matcher.ratio()
+
+
+def align_headers(headers, page_headers, threshold=HEADER_SIMILARITY):
+    """返回 page_headers 每一列在 headers 中的位置 (没有对应列时为None)
+
+    按相似度从高到低贪心匹配，每个目标列只用一次。
+    """
+    targets = [normalize_cell(header) for header in headers]
+    sources = [normalize_cell(header) for header in page_headers]
+    candidates = sorted(
+        ((header_similarity(source, target, threshold), source_index, target_index)
+         for source_index, source in enumerate(sources)
+         for target_index, target in enumerate(targets)),
+        reverse=True
+    )
+    positions = [None] * len(page_headers)
+    used = set()
+    for score, source_index, target_index in candidates:
+        if score < threshold:
+            break
+        if positions[source_index] is None and target_index not in used:
+            positions[source_index] = target_index
+            used.add(target_index)
+    return positions
+
+
+def _is_header_row(normalized_row, normalized_headers, threshold=HEADER_SIMILARITY):
+    """一半以上的非空单元格和所在列的表头相同 -> 重复的表头行"""
+    cells = [(cell, header) for cell, header in zip(normalized_row, normalized_headers) if cell]
+    if not cells:
+        return False
+    matches = sum(1 for cell, header in cells
+                  if header_similarity(cell, header, threshold) >= threshold)
+    return matches * 2 > len(cells)
+
+
+def _is_data_line(cells):
+    """有数字或条码单元格，或者没有一个单元格能识别为字段 -> 是数据行而不是表头"""
+    # column_mapping imports this module
+    from column_mapping import guess_field, parse_number
+
+    for cell in cells:
+        try:
+            if parse_number(cell) is not None:
+                return True
+        except ValueError:
+            pass
+    return all(guess_field(cell) is None for cell in cells)
+
+
+def merge_tables(tables, threshold=HEADER_SIMILARITY):
+    """把各页的 {"headers", "rows"} 合并成一个表格
+
+    第一页的表头为基准，其他页新出现的列追加在后面。
+    没有任何列能对上、列数又不多于已有列、"表头"又像数据 (见 _is_data_line) 的页按续页处理:
+    它的"表头"其实是第一行数据。换了说法的表头 (EAN/Artículo 对 Código/Descripción) 作为新列追加。
+    与上一页某行完全相同的行视为照片重叠，只保留一次；同一页内的相同行保留。
+    Returns:
+        {"headers", "rows", "pages", "dropped_header_rows", "dropped_duplicates"}，
+        没有任何表头时返回None
+    """
+    tables = [table for table in tables if table and table.get('headers')]
+    if not tables:
+        return None
+
+    headers = [str(header) for header in tables[0]['headers']]
+    rows = []
+    dropped_header_rows = 0
+    dropped_duplicates = 0
+    previous_hashes = set()
+
+    for page, table in enumerate(tables):
+        page_headers = [str(header) for header in table['headers']]
+        page_rows = list(table.get('rows') or [])
+        if page == 0:
+            positions = list(range(len(page_headers)))
+        else:
+            positions = align_headers(headers, page_headers, threshold)
+            if (all(position is None for position in positions) and len(page_headers) <= len(headers)
+                    and _is_data_line(page_headers)):
+                # Continuation page photographed without its header line
+                positions = list(range(len(page_headers)))
+                page_rows.insert(0, page_headers)
+            for source_index, position in enumerate(positions):
+                if position is None:
+                    positions[source_index] = len(headers)
+                    headers.append(page_headers[source_index])
+
+        normalized_headers = [normalize_cell(header) for header in headers]
+        page_hashes = set()
+        for row in page_rows:
+            merged = [''] * len(headers)
+            for source_index, cell in enumerate(row[:len(positions)]):
+                merged[positions[source_index]] = cell
+            normalized = tuple(normalize_cell(cell) for cell in merged)
+            if _is_header_row(normalized, normalized_headers, threshold):
+                dropped_header_rows += 1
+                continue
+            # Only the filled cells: the same line hashes alike before and after columns are added
+            row_hash = hash(tuple((column, cell) for column, cell in enumerate(normalized) if cell))
+            page_hashes.add(row_hash)
+            if row_hash in previous_hashes:
+                dropped_duplicates += 1
+                continue
+            rows.append(merged)
+        if page_hashes:
+            previous_hashes = page_hashes
+
+    # Columns added by later pages: pad the earlier rows
+    for row in rows:
+        row.extend([''] * (len(headers) - len(row)))
+    return {
+        "headers": headers,
+        "rows": rows,
+        "pages": len(tables),
+        "dropped_header_rows": dropped_header_rows,
+        "dropped_duplicates": dropped_duplicates,
+    }
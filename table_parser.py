@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+增量表格解析器
+逐块读取模型输出的 {"headers": [...], "rows": [[...], ...]}，每收到一整行就返回该行，
+不必等完整的JSON
+"""
+
+import json
+import re
+
+# Separators, then one token: string | bracket | number/literal | anything else.
+# A number takes the whole [0-9.eE+-] run: "0841234567890", ".5" or "1e" are one token, not "5" or "1"
+_TOKEN = re.compile(r'''[\s,:]*(?:
+    ("(?:[^"\\]|\\.)*")
+  | ([\[\]{}])
+  | (-?\.?\d[0-9.eE+-]*|true|false|null)
+  | (.)
+)''', re.DOTALL | re.VERBOSE)
+# Separators before the next row of the "rows" array
+_ROW_START = re.compile(r'[\s,]*([\[{])')
+_LITERALS = {'true': True, 'false': False, 'null': None}
+_DECODER = json.JSONDecoder(strict=False)
+
+
+class IncrementalTableParser:
+    """容错的单遍解析器
+
+    feed() 可以在任意位置切分输入；不完整的字符串或数字留到下次 feed 再处理。
+    JSON之前的文字被忽略，逗号和冒号可有可无，尾随逗号不影响结果。
+    """
+
+    def __init__(self):
+        self.headers = None
+        self.rows = []
+        self.done = False
+        self._text = ''
+        self._pos = 0
+        # Open containers as [value, role, pending_key]
+        self._stack = []
+
+    def feed(self, text):
+        """追加一段文本，返回这段文本中完成的新行"""
+        if self.done:
+            return []
+        self._text += text
+        first_new_row = len(self.rows)
+        self._parse()
+        # Drop what has been consumed so the buffer stays small
+        self._text = self._text[self._pos:]
+        self._pos = 0
+        return self.rows[first_new_row:]
+
+    def _parse(self):
+        text = self._text
+        end = len(text)
+        pos = self._pos
+        stack = self._stack
+        while pos < end and not self.done:
+            if not stack:
+                # Skip prose or a ```json fence before the table object
+                start = text.find('{', pos)
+                if start < 0:
+                    pos = end
+                    break
+                stack.append([{}, 'root', None])
+                pos = start + 1
+                continue
+            match = _TOKEN.match(text, pos)
+            if match is None:
+                pos = end  # only separators left
+                break
+            string, bracket, literal, other = match.groups()
+            if string is not None:
+                # Most cells have no escapes: skip the json.loads round-trip
+                value = self._decode_string(string) if '\\' in string else string[1:-1]
+                top = stack[-1]
+                if top[0].__class__ is list:
+                    top[0].append(value)
+                else:
+                    self._add_value(value)
+            elif bracket is not None:
+                if bracket == '[' or bracket == '{':
+                    if stack[-1][1] == 'rows' and stack[-1][0].__class__ is list:
+                        row_end = self._decode_rows(text, match.start(2))
+                        if row_end != match.start(2):
+                            pos = row_end
+                            continue
+                    self._open([] if bracket == '[' else {})
+                else:
+                    self._close(list if bracket == ']' else dict)
+            elif literal is not None:
+                if match.end() == end:
+                    break  # "12" or "12." might still become "12.5"
+                self._add_value(_LITERALS[literal] if literal in _LITERALS else self._decode_number(literal))
+            else:
+                rest = text[match.start(4):]
+                if (other == '"' or rest in ('-', '.', '-.')
+                        or any(word.startswith(rest) for word in _LITERALS)):
+                    break  # unterminated string, "-" or "tru": wait for the next chunk
+                # stray character: ignore it
+            pos = match.end()
+        self._pos = pos
+
+    def _decode_rows(self, text, pos):
+        """从pos开始把完整的行交给C解码器，返回第一个解不了的行 (不完整或有错误) 的位置"""
+        parent = self._stack[-1][0]
+        while True:
+            try:
+                row, row_end = _DECODER.raw_decode(text, pos)
+            except ValueError:
+                return pos
+            if row.__class__ is list:
+                self.rows.append(row)
+            else:
+                self._finish(row, 'row')
+            parent.append(row)
+            match = _ROW_START.match(text, row_end)
+            if match is None:
+                return row_end
+            pos = match.end(1) - 1
+
+    def _role_for_child(self):
+        parent, role, key = self._stack[-1]
+        if role == 'root' and key in ('headers', 'rows'):
+            return key
+        if role == 'rows':
+            return 'row'
+        return None
+
+    def _open(self, container):
+        self._stack.append([container, self._role_for_child(), None])
+
+    def _close(self, kind):
+        # Tolerate a mismatched closer by closing up to the matching container
+        while self._stack:
+            container, role, _ = self._stack.pop()
+            self._finish(container, role)
+            if not self._stack:
+                self.done = True
+                return
+            self._add_value(container)
+            if isinstance(container, kind):
+                return
+
+    def _finish(self, container, role):
+        if role == 'headers' and self.headers is None:
+            self.headers = [str(value) for value in container]
+        elif role == 'row':
+            if isinstance(container, dict):
+                # Row written as {"header": value}: put values in header order
+                keys = self.headers or list(container)
+                container = [container.get(key, '') for key in keys]
+            self.rows.append(container)
+
+    def _add_value(self, value):
+        entry = self._stack[-1]
+        container = entry[0]
+        if isinstance(container, list):
+            container.append(value)
+        elif entry[2] is None:
+            entry[2] = value if isinstance(value, str) else str(value)
+        else:
+            container[entry[2]] = value
+            entry[2] = None
+
+    @staticmethod
+    def _decode_number(literal):
+        try:
+            return json.loads(literal)
+        except ValueError:
+            # Leading zeros ("0841234567890" is a barcode), ".5", "1e": keep the text as written
+            return literal
+
+    @staticmethod
+    def _decode_string(literal):
+        try:
+            # strict=False: raw newlines/tabs inside a cell are kept, not fatal
+            return json.loads(literal, strict=False)
+        except ValueError:
+            # Invalid escape or raw control character: keep the text as written
+            return literal[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+    def finish(self):
+        """输入结束 (包括在 max_tokens 处被截断)，返回 result()
+
+        末尾被截断的字符串或数字丢弃 ("4" 可能本来是 "45")；
+        未闭合的行如果已有全部列则保留，否则丢弃；未闭合的表头按已收到的部分使用。
+        """
+        if not self.done:
+            while self._stack:
+                container, role, _ = self._stack.pop()
+                if role == 'headers':
+                    self._finish(container, role)
+                elif role == 'row' and len(container) >= len(self.headers or ()):
+                    # Cut off right before "]": every cell made it
+                    self._finish(container, role)
+                elif role == 'rows':
+                    # Rows nested in an unclosed "rows" array were already collected
+                    pass
+            self.done = True
+        return self.result()
+    
+    def result(self):
+        """当前能得到的表格 {"headers", "rows"}，还没有表头时返回None"""
+        if self.headers is None:
+            return None
+        return {"headers": self.headers, "rows": list(self.rows)}
+
+
+def parse_table(text):
+    """一次性解析完整 (或被截断) 的模型输出，返回 {"headers", "rows"} 或None"""
+    start = text.find('{')
+    if start < 0:
+        return None
+    # Well-formed replies: one pass of the C decoder. Anything else: the tolerant tokenizer.
+    try:
+        table, _ = _DECODER.raw_decode(text, start)
+    except ValueError:
+        table = None
+    if (isinstance(table, dict) and isinstance(table.get('headers'), list)
+            and isinstance(table.get('rows'), list)
+            and all(isinstance(row, list) for row in table['rows'])):
+        return {"headers": [str(value) for value in table['headers']], "rows": table['rows']}
+    
+    parser = IncrementalTableParser()
+    parser.feed(text)
+    return parser.finish()